@@ -0,0 +1,66 @@
+"""
+Fanning a packet out to sessions whose sends finish without waiting, as socket sessions' do, compared with the
+task-per-recipient delivery fanout used before it started sends directly.
+
+Run with `PYTHONPATH=. python benchmarks/bench_fanout.py` from the repository root.
+"""
+
+from neolith.protocol import Broadcast, ChatPosted, Session, fanout
+
+import asyncio
+import time
+
+
+class ImmediateSession (Session):
+    """ A session whose send queues nothing and never waits, leaving only the cost of delivery itself. """
+
+    async def send(self, data):
+        pass
+
+
+async def task_per_recipient(sessions, data, timeout=5.0, concurrency=256):
+    # What fanout did before: a semaphore per call, and a task with its own timeout for every recipient.
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(session, data):
+        async with semaphore:
+            try:
+                await asyncio.wait_for(session.send(data), timeout)
+            except Exception:
+                return session
+        return None
+
+    data = Broadcast.wrap(data)
+    results = await asyncio.gather(*[send(session, data) for session in sessions])
+    return [session for session in results if session is not None]
+
+
+async def sequential(sessions, data):
+    data = Broadcast.wrap(data)
+    for session in sessions:
+        await session.send(data)
+
+
+async def measure(deliver, sessions, data, repeat=20):
+    start = time.perf_counter()
+    for i in range(repeat):
+        await deliver(sessions, data)
+    return (time.perf_counter() - start) / repeat
+
+
+def report(name, seconds, sessions):
+    print('{:<24} {:>10.3f} ms {:>10.2f} us per session'.format(name, seconds * 1000, seconds * 1e6 / sessions))
+
+
+async def main():
+    chat = ChatPosted(channel='public', chat='Hello, world!', user=Session(ident='sender', nickname='sender'))
+    for count in (10, 1000, 10000):
+        sessions = [ImmediateSession(ident=str(n), nickname='user{}'.format(n)) for n in range(count)]
+        print('{} sessions'.format(count))
+        report('sequential sends', await measure(sequential, sessions, chat), count)
+        report('task per recipient', await measure(task_per_recipient, sessions, chat), count)
+        report('fanout', await measure(fanout, sessions, chat), count)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
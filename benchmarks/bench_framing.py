@@ -0,0 +1,75 @@
+"""
+Benchmarks SocketSession frame parsing against the old bytes-concatenation approach.
+
+Run with `PYTHONPATH=. python benchmarks/bench_framing.py` from the repository root.
+"""
+
+from neolith.framing import FrameBuffer, header
+
+import random
+import struct
+import time
+
+
+class BytesBuffer:
+    # The original SocketSession.data_received buffering, which copies the whole buffer on every append and frame.
+
+    def __init__(self):
+        self.buffered = b''
+
+    def feed(self, data):
+        self.buffered += data
+
+    def frames(self):
+        frames = []
+        while len(self.buffered) >= 4:
+            size = struct.unpack('!L', self.buffered[:4])[0]
+            total = 4 + size
+            if len(self.buffered) < total:
+                break
+            frames.append(self.buffered[4:total])
+            self.buffered = self.buffered[total:]
+        return frames
+
+
+def chunked(stream, low, high, seed=0):
+    rng = random.Random(seed)
+    chunks = []
+    pos = 0
+    while pos < len(stream):
+        size = rng.randrange(low, high)
+        chunks.append(stream[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def run(name, buf, chunks, expected):
+    count = 0
+    start = time.perf_counter()
+    for chunk in chunks:
+        buf.feed(chunk)
+        count += len(buf.frames())
+    elapsed = time.perf_counter() - start
+    assert count == expected
+    print('{:<50} {:>8.3f} s'.format(name, elapsed))
+
+
+def main():
+    rng = random.Random(42)
+    payloads = [b'{"channel.post": [{"channel": "public", "chat": "%s"}]}' % (b'x' * rng.randrange(10, 200))
+        for i in range(100000)]
+    stream = b''.join(header.pack(len(p)) + p for p in payloads)
+    chunks = chunked(stream, 1, 8192)
+    print('100k pipelined frames, {} bytes in {} random chunks'.format(len(stream), len(chunks)))
+    run('bytes concatenation', BytesBuffer(), chunks, len(payloads))
+    run('FrameBuffer', FrameBuffer(), chunks, len(payloads))
+
+    big = b'x' * (16 * 1024 * 1024)
+    segments = chunked(header.pack(len(big)) + big, 1400, 1500)
+    print('One 16 MB frame in {} TCP-sized segments'.format(len(segments)))
+    run('bytes concatenation', BytesBuffer(), segments, 1)
+    run('FrameBuffer', FrameBuffer(max_frame_size=len(big)), segments, 1)
+
+
+if __name__ == '__main__':
+    main()
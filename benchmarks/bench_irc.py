@@ -0,0 +1,89 @@
+"""
+Benchmarks IRC line parsing, LineBuffer and parse_message against the old IRCSession.data_received approach.
+
+Run with `PYTHONPATH=. python benchmarks/bench_irc.py` from the repository root.
+"""
+
+from neolith.ircparser import LineBuffer, parse_message
+
+import random
+import time
+
+
+class SplitParser:
+    # The original IRCSession.data_received parsing, which re-splits the whole buffer on every read.
+
+    def __init__(self):
+        self.buffer = b''
+
+    def feed(self, data):
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b'\r\n')
+        messages = []
+        for line in lines:
+            parts = line.decode('utf-8').split(':', 2)
+            if parts[0]:
+                prefix = None
+                cmd, *params = parts[0].strip().split(' ')
+                params.extend(parts[1:])
+            else:
+                prefix, cmd, *params = parts[1].strip().split(' ')
+                params.extend(parts[2:])
+            messages.append((prefix, cmd.upper(), params))
+        return messages
+
+
+class IncrementalParser:
+
+    def __init__(self):
+        self.buffer = LineBuffer()
+
+    def feed(self, data):
+        return [line and parse_message(line.decode('utf-8', 'replace')) for line in self.buffer.feed(data)]
+
+
+def chunked(stream, low, high, seed=0):
+    rng = random.Random(seed)
+    chunks = []
+    pos = 0
+    while pos < len(stream):
+        size = rng.randrange(low, high)
+        chunks.append(stream[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def run(name, parser, chunks, expected):
+    count = 0
+    start = time.perf_counter()
+    for chunk in chunks:
+        count += len(parser.feed(chunk))
+    elapsed = time.perf_counter() - start
+    assert count == expected
+    print('{:<50} {:>8.3f} s {:>10.0f} lines/s'.format(name, elapsed, count / elapsed))
+
+
+def main():
+    rng = random.Random(42)
+    lines = [b'PRIVMSG #public :%s' % (b'x' * rng.randrange(10, 400)) if i % 10 else b'PING :neolith'
+        for i in range(200000)]
+    stream = b''.join(line + b'\r\n' for line in lines)
+    chunks = chunked(stream, 1, 8192)
+    print('200k pipelined lines, {} bytes in {} random chunks'.format(len(stream), len(chunks)))
+    run('split', SplitParser(), chunks, len(lines))
+    run('LineBuffer + parse_message', IncrementalParser(), chunks, len(lines))
+
+    segments = chunked(b''.join(line + b'\r\n' for line in lines[:2000]), 1, 16)
+    print('2k lines trickling in {} chunks of under 16 bytes'.format(len(segments)))
+    run('split', SplitParser(), segments, 2000)
+    run('LineBuffer + parse_message', IncrementalParser(), segments, 2000)
+
+    # The old parser buffers (and re-splits) all of a line that never ends, LineBuffer drops it once it's too long.
+    endless = chunked(b'x' * (2 * 1024 * 1024), 1400, 1500)
+    print('2 MB without a line ending in {} TCP-sized segments'.format(len(endless)))
+    run('split', SplitParser(), endless, 0)
+    run('LineBuffer + parse_message', IncrementalParser(), endless, 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Memory used per protocol object, with field values in slots (see ContainerMeta) versus a per-instance __dict__.
+
+Run with `PYTHONPATH=. python benchmarks/bench_memory.py` from the repository root.
+"""
+
+from neolith.protocol import ChatPosted, Container, ContainerMeta, Session
+
+import copy
+import os
+import tracemalloc
+
+
+def unslotted(cls):
+    # The same fields declared on a plain Container subclass, so values are kept in __dict__ as they were before.
+    namespace = {'cache_prepared': cls.cache_prepared}
+    for name, field, required, readonly in cls._schema:
+        namespace[name] = copy.copy(field)
+        namespace[name].slot = None
+    return ContainerMeta('Unslotted' + cls.__name__, (Container,), namespace)
+
+
+def make_session(cls, n):
+    # Each session gets its own keys, which are counted the same either way.
+    session = cls(ident='{:032x}'.format(n), username='someone', nickname='someone{}'.format(n),
+        x25519=os.urandom(32), ed25519=os.urandom(32))
+    # Fill in the default hostname, as sending the session anywhere would.
+    session.hostname
+    return session
+
+
+def make_chat(cls, user):
+    chat = cls(channel='public', chat='Hello, world!', user=user)
+    chat.prepare()
+    return chat
+
+
+def measure(factory, count):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = [factory(n) for n in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    used = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del objects
+    return used / count
+
+
+def report(name, dict_bytes, slot_bytes):
+    print('{:<20} {:>8.0f} B (__dict__) {:>8.0f} B (slots) {:>7.1%}'.format(
+        name, dict_bytes, slot_bytes, slot_bytes / dict_bytes - 1))
+
+
+def main(count=50000):
+    user = make_session(Session, 0)
+    report('Session', measure(lambda n: make_session(UnslottedSession, n), count),
+        measure(lambda n: make_session(Session, n), count))
+    report('ChatPosted', measure(lambda n: make_chat(UnslottedChatPosted, user), count),
+        measure(lambda n: make_chat(ChatPosted, user), count))
+
+
+UnslottedSession = unslotted(Session)
+UnslottedChatPosted = unslotted(ChatPosted)
+
+
+if __name__ == '__main__':
+    main()
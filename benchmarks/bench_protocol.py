@@ -0,0 +1,90 @@
+"""
+Microbenchmarks for protocol serialization.
+
+Run with `PYTHONPATH=. python benchmarks/bench_protocol.py` from the repository root.
+"""
+
+from neolith.protocol import (
+    ChatPosted, DataType, Object, ProtocolError, Session, Transaction, UserList, get_codec, use_codecs)
+from neolith.wire import encode_json
+
+import json
+import os
+import timeit
+
+
+def mro_prepare(obj):
+    # The per-call MRO walk that Container.prepare used before fields were compiled into Container._schema.
+    data = {}
+    for klass in obj.__class__.mro():
+        for name, field in vars(klass).items():
+            if isinstance(field, DataType) and name not in data:
+                value = getattr(obj, name)
+                if value is None and field.required:
+                    raise ProtocolError('{}.{} is required to have a value'.format(obj.__class__.__name__, name))
+                if isinstance(field, Object) and value is not None:
+                    data[name] = mro_prepare(value)
+                else:
+                    data[name] = field.prepare(value)
+    return data
+
+
+def mro_unpack(cls, data):
+    instance = cls()
+    seen = set()
+    for klass in cls.mro():
+        for name, field in vars(klass).items():
+            if isinstance(field, DataType):
+                if name not in seen and not field.readonly:
+                    setattr(instance, name, field.unpack(data.get(name)))
+                seen.add(name)
+    return instance
+
+
+def sample_session(n=0):
+    return Session(ident='{:032x}'.format(n), username='someone', hostname='127.0.0.1', nickname='someone{}'.format(n),
+        x25519=os.urandom(32), ed25519=os.urandom(32))
+
+
+def sample_chat():
+    return ChatPosted(channel='public', chat='Hello, world!', emote=False, user=sample_session())
+
+
+def uncached_listing(listing):
+    # What building a user.listing cost before sessions cached their prepared form: every session prepared and
+    # encoded again.
+    data = {listing.ident: [{'users': [user.prepare_fields() for user in listing.users]}]}
+    return json.dumps(data)
+
+
+def report(name, seconds, number):
+    print('{:<40} {:>10.2f} us/op'.format(name, seconds / number * 1e6))
+
+
+def main(number=20000):
+    chat = sample_chat()
+    assert mro_prepare(chat) == chat.prepare()
+    wire = json.loads(json.dumps(chat.to_dict()))
+    fields = wire['channel.posted'][0]
+
+    report('prepare (mro walk)', timeit.timeit(lambda: mro_prepare(chat), number=number), number)
+    report('prepare (schema)', timeit.timeit(chat.prepare, number=number), number)
+    report('unpack (mro walk)', timeit.timeit(lambda: mro_unpack(ChatPosted, fields), number=number), number)
+    report('unpack (schema)', timeit.timeit(lambda: ChatPosted.unpack(fields), number=number), number)
+    report('Transaction(...) (schema)', timeit.timeit(lambda: Transaction(wire), number=number), number)
+
+    codec = get_codec(ChatPosted)
+    report('encode (codec)', timeit.timeit(lambda: codec.encode(chat), number=number), number)
+    report('decode (codec)', timeit.timeit(lambda: codec.decode(fields), number=number), number)
+    use_codecs()
+    report('Transaction(...) (codec)', timeit.timeit(lambda: Transaction(wire), number=number), number)
+    use_codecs(False)
+
+    listing = UserList(users=[sample_session(n) for n in range(2000)])
+    assert json.loads(uncached_listing(listing)) == json.loads(encode_json(listing.to_dict()))
+    report('user.listing x2000 (uncached)', timeit.timeit(lambda: uncached_listing(listing), number=100), 100)
+    report('user.listing x2000 (fragments)', timeit.timeit(lambda: encode_json(listing.to_dict()), number=100), 100)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+send() syscalls made delivering a burst of chat to a channel, with and without OUTBOX_BATCH.
+
+Run with `PYTHONPATH=. python benchmarks/bench_writes.py` from the repository root.
+"""
+
+from neolith import settings
+from neolith.irc import IRCSession
+from neolith.protocol import Channel, ChatPosted, Session
+from neolith.server import SocketSession
+
+import asyncio
+import socket
+import time
+
+
+class CountingSocket (socket.socket):
+    """ A socket that counts the sends the event loop's transport makes on it. """
+
+    sends = 0
+
+    def send(self, data, *args):
+        CountingSocket.sends += 1
+        return super().send(data, *args)
+
+    def sendmsg(self, buffers, *args):
+        CountingSocket.sends += 1
+        return super().sendmsg(buffers, *args)
+
+
+async def connect(listener, protocol_factory):
+    sock = CountingSocket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(listener.getsockname())
+    sock.setblocking(False)
+    # Keep the other end open (and unread, the burst fits in its receive buffer).
+    peer, address = listener.accept()
+    transport, session = await asyncio.get_event_loop().create_connection(protocol_factory, sock=sock)
+    return session, peer
+
+
+async def burst(session_class, batch, sessions=200, posts=20):
+    settings.OUTBOX_BATCH = batch
+    channel = Channel(name='public')
+    sender = Session(ident='sender', username='sender', nickname='sender')
+    peers = []
+    with socket.create_server(('127.0.0.1', 0), backlog=sessions) as listener:
+        for n in range(sessions):
+            session, peer = await connect(listener, lambda: session_class(None))
+            session.ident = str(n)
+            session.nickname = 'user{}'.format(n)
+            session.authenticated = True
+            channel.add(session)
+            peers.append(peer)
+    CountingSocket.sends = 0
+    start = time.perf_counter()
+    await asyncio.gather(*[channel.send(ChatPosted(channel='public', chat='Message {}'.format(n), user=sender))
+                           for n in range(posts)])
+    await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    sends = CountingSocket.sends
+    for session in channel.sessions:
+        session.transport.close()
+    for peer in peers:
+        peer.close()
+    await asyncio.sleep(0)
+    return sends, elapsed
+
+
+def report(name, sends, elapsed, sessions=200):
+    print('{:<28} {:>7} sends {:>7.2f} per session {:>8.2f} ms'.format(
+        name, sends, sends / sessions, elapsed * 1000))
+
+
+async def main():
+    for session_class in (SocketSession, IRCSession):
+        for batch in (False, True):
+            sends, elapsed = await burst(session_class, batch)
+            report('{} ({})'.format(session_class.__name__, 'batched' if batch else 'unbatched'), sends, elapsed)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+import asyncio
+import collections
+import time
+
+
+class AsyncCache:
+    """
+    An LRU cache in front of an async loader function, with entries that expire after ttl seconds. Misses (loads that
+    return None) are cached too, for negative_ttl seconds. Concurrent gets for a key that is being loaded all wait on
+    the same load, so a burst of requests for one key only calls the loader once.
+    """
+
+    def __init__(self, loader, ttl=300.0, negative_ttl=30.0, max_size=10000, clock=time.monotonic):
+        self.loader = loader
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.clock = clock
+        self.entries = collections.OrderedDict()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'loading': len(self.pending),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    async def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            value, expires = entry
+            if expires > self.clock():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.entries[key]
+        self.misses += 1
+        task = self.pending.get(key)
+        if task is None:
+            task = self.pending[key] = asyncio.ensure_future(self.load(key))
+        # Shielded, so one caller giving up doesn't cancel the load for everyone else waiting on it.
+        return await asyncio.shield(task)
+
+    async def load(self, key):
+        task = asyncio.current_task()
+        try:
+            value = await self.loader(key)
+        finally:
+            # An invalidation while loading means this result may already be stale, so it's returned but not kept.
+            current = self.pending.get(key) is task
+            if current:
+                del self.pending[key]
+        if current:
+            self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        ttl = self.negative_ttl if value is None else self.ttl
+        if not ttl:
+            return
+        self.entries[key] = (value, self.clock() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """ Forgets key (or everything, if key is None), including any load of it that's in progress. """
+        if key is None:
+            self.entries.clear()
+            self.pending.clear()
+        else:
+            self.entries.pop(key, None)
+            self.pending.pop(key, None)
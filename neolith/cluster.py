@@ -0,0 +1,756 @@
+from neolith import settings
+from neolith.events import EventStream, format_event
+from neolith.framing import FrameBuffer, header
+from neolith.models import Account, accounts
+from neolith.protocol import (
+    Channel, ChannelLeave, ProtocolError, Sendable, Session, Transaction, UserLeft, fanout)
+from neolith.wire import encode_json_compact
+
+import asyncio
+import hmac
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import shutil
+import socket
+import tempfile
+import zlib
+
+
+logger = logging.getLogger(__name__)
+
+
+def encode_payload(data: Sendable) -> bytes:
+    """ Wire format for Sendables relayed between nodes, encoded once however many nodes they go to. """
+    return encode_json_compact(data.to_dict()).encode('utf-8')
+
+
+def decode_payload(payload: bytes):
+    tx = Transaction(json.loads(payload))
+    # Nodes only relay notifications, which are sent on as the packet itself rather than a transaction of one.
+    if tx.txid is None and len(tx.packets) == 1:
+        return tx.packets[0]
+    return tx
+
+
+def encode_message(message, data: Sendable = None) -> bytes:
+    """ A message between nodes: a frame holding a JSON list, followed by a newline and data if there is any. """
+    frame = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    if data is not None:
+        frame += b'\n' + data.encode(encode_payload)
+    return header.pack(len(frame)) + frame
+
+
+def bind_reuse_port(host, port):
+    """ Returns a TCP socket bound to host:port with SO_REUSEPORT set, so every worker can listen on the same port. """
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def run_workers(target, count, path=None):
+    """
+    Calls target(node, path) in count forked worker processes, numbered from 0, and waits for them all to exit. path
+    is the directory the workers put their Unix sockets in, and a temporary one is made (and removed) if not given.
+    """
+    context = multiprocessing.get_context('fork')
+    temporary = path is None
+    if temporary:
+        path = tempfile.mkdtemp(prefix='neolith-')
+    workers = [context.Process(target=target, args=(node, path), name='neolith-worker-{}'.format(node))
+               for node in range(count)]
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        if temporary:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def create_cluster(server, worker=None, path=None):
+    """
+    Returns the Cluster this process is part of, going by the settings: a TCP mesh between CLUSTER_NODES (and all of
+    their workers), a Unix socket bus between the workers of this server, or None if this process is all there is.
+    """
+    if settings.CLUSTER_NODES:
+        if settings.CLUSTER_NODE not in settings.CLUSTER_NODES:
+            raise ValueError('CLUSTER_NODE must be one of CLUSTER_NODES.')
+        addresses = {}
+        for entry in settings.CLUSTER_NODES:
+            host, port = entry.rsplit(':', 1)
+            for n in range(settings.WORKERS):
+                addresses['{}:{}'.format(host, int(port) + n)] = (host, int(port) + n)
+        host, port = settings.CLUSTER_NODE.rsplit(':', 1)
+        node = '{}:{}'.format(host, int(port) + (worker or 0))
+        transport = TCPTransport(addresses, settings.CLUSTER_SECRET)
+    elif worker is not None:
+        addresses = {str(n): os.path.join(path, 'worker-{}.sock'.format(n)) for n in range(settings.WORKERS)}
+        node = str(worker)
+        transport = UnixTransport(addresses, settings.CLUSTER_SECRET)
+    else:
+        return None
+    return Cluster(server, node, addresses, transport, batch_delay=settings.CLUSTER_BATCH_DELAY)
+
+
+class Transport:
+    """
+    Carries bytes between the nodes of a Cluster, so anything that can do that (a message broker, say) can be plugged
+    in. start() connects this node to the others, after which the transport reports back through the cluster's
+    connected(node), received(node, data) and lost(node) methods. Whatever is sent to a node must arrive intact and in
+    order, though it may be split up or joined together differently than it was sent.
+    """
+
+    cluster = None
+
+    async def start(self, cluster):
+        raise NotImplementedError()
+
+    def send(self, node, data: bytes):
+        raise NotImplementedError()
+
+    def close(self):
+        raise NotImplementedError()
+
+
+class LoopbackTransport (Transport):
+    """ Connects clusters within one process, such as in tests. Every transport sharing a hub dict is connected. """
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    async def start(self, cluster):
+        self.cluster = cluster
+        for other in list(self.hub.values()):
+            other.cluster.connected(cluster.node)
+            cluster.connected(other.cluster.node)
+        self.hub[cluster.node] = self
+
+    def send(self, node, data: bytes):
+        other = self.hub.get(node)
+        if other is not None:
+            # Handed over on the next iteration of the event loop, as it would be by any other transport.
+            asyncio.get_event_loop().call_soon(other.cluster.received, self.cluster.node, data)
+
+    def close(self):
+        if self.hub.get(self.cluster.node) is self:
+            del self.hub[self.cluster.node]
+            loop = asyncio.get_event_loop()
+            for other in list(self.hub.values()):
+                loop.call_soon(other.cluster.lost, self.cluster.node)
+                self.cluster.lost(other.cluster.node)
+
+
+class StreamTransport (Transport):
+    """
+    Base for transports connecting every node to every other over stream sockets, given {node: address} for all of
+    them. Each node sends on the connection it made, starting with its name on a line of its own. Nodes that can't be
+    reached are retried (backing off up to max_retry_interval) for as long as the transport is open, so nodes can
+    start in any order and rejoin after a restart.
+
+    Given a secret, the name comes with a random challenge, and both ends prove they know the secret (with an HMAC of
+    their names and both challenges) before anything else is sent. Connections from nodes that can't are refused.
+    """
+
+    retry_interval = 0.05
+    max_retry_interval = 5.0
+    # Seconds start() waits for the other nodes to be reachable before carrying on without them.
+    startup_timeout = 5.0
+    # Seconds a new connection has to identify itself.
+    handshake_timeout = 5.0
+
+    def __init__(self, addresses, secret=None):
+        self.addresses = addresses
+        self.secret = secret.encode('utf-8') if isinstance(secret, str) else secret
+        self.listener = None
+        self.writers = {}
+        self.inbound = set()
+        self.connecting = {}
+        self.closed = False
+
+    async def listen(self, address):
+        raise NotImplementedError()
+
+    async def open(self, address):
+        raise NotImplementedError()
+
+    async def start(self, cluster):
+        self.cluster = cluster
+        self.listener = await self.listen(self.addresses[cluster.node])
+        tasks = [self.reconnect(node) for node in self.addresses if node != cluster.node]
+        if tasks:
+            await asyncio.wait(tasks, timeout=self.startup_timeout)
+
+    def reconnect(self, node):
+        task = self.connecting[node] = asyncio.ensure_future(self.connect(node))
+        return task
+
+    async def connect(self, node):
+        interval = self.retry_interval
+        while True:
+            writer = None
+            try:
+                reader, writer = await self.open(self.addresses[node])
+                await asyncio.wait_for(self.introduce(node, reader, writer), self.handshake_timeout)
+                break
+            except ProtocolError as e:
+                logger.warning('Not connecting to node %s: %s', node, e)
+            except (OSError, asyncio.TimeoutError):
+                pass
+            if writer is not None:
+                writer.close()
+            await asyncio.sleep(interval)
+            interval = min(2 * interval, self.max_retry_interval)
+        self.connecting.pop(node, None)
+        self.writers[node] = writer
+        self.cluster.connected(node)
+
+    def sign(self, *parts):
+        return hmac.new(self.secret, '\n'.join(parts).encode('utf-8'), 'sha256').hexdigest()
+
+    def verify(self, proof, *parts):
+        return hmac.compare_digest(proof.encode('utf-8'), self.sign(*parts).encode('ascii'))
+
+    async def readline(self, reader):
+        line = await reader.readline()
+        if not line.endswith(b'\n'):
+            raise ConnectionResetError('Connection closed during handshake')
+        return line.decode('utf-8', 'replace').strip()
+
+    async def introduce(self, node, reader, writer):
+        """ Tells node (on a connection to it) which node this is, and has it prove it knows the secret, if any. """
+        if self.secret is None:
+            writer.write(self.cluster.node.encode('utf-8') + b'\n')
+            return
+        challenge = secrets.token_hex(16)
+        writer.write('{} {}\n'.format(self.cluster.node, challenge).encode('utf-8'))
+        response, _, proof = (await self.readline(reader)).partition(' ')
+        if not self.verify(proof, 'accept', node, challenge, response):
+            raise ProtocolError('it does not know the cluster secret')
+        writer.write(self.sign('connect', self.cluster.node, response, challenge).encode('ascii') + b'\n')
+
+    async def identify(self, reader, writer):
+        """ Returns the name of the node that made a connection, raising ProtocolError if it isn't one. """
+        line = await self.readline(reader)
+        if self.secret is None:
+            name = line
+        else:
+            name, _, challenge = line.rpartition(' ')
+        if name not in self.addresses or name == self.cluster.node:
+            raise ProtocolError('unknown node {!r}'.format(name))
+        if self.secret is not None:
+            response = secrets.token_hex(16)
+            proof = self.sign('accept', self.cluster.node, challenge, response)
+            writer.write('{} {}\n'.format(response, proof).encode('ascii'))
+            if not self.verify(await self.readline(reader), 'connect', name, response, challenge):
+                raise ProtocolError('node {} does not know the cluster secret'.format(name))
+        return name
+
+    async def accept(self, reader, writer):
+        self.inbound.add(writer)
+        node = None
+        try:
+            try:
+                node = await asyncio.wait_for(self.identify(reader, writer), self.handshake_timeout)
+            except (OSError, asyncio.TimeoutError, ProtocolError) as e:
+                logger.warning('Refusing connection: %s', e)
+                return
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                self.cluster.received(node, data)
+        except (ConnectionError, ProtocolError) as e:
+            logger.warning('Lost connection to node %s: %s', node, e)
+        finally:
+            self.inbound.discard(writer)
+            writer.close()
+            if node is not None and not self.closed:
+                self.disconnected(node)
+
+    def disconnected(self, node):
+        writer = self.writers.pop(node, None)
+        if writer is not None:
+            writer.close()
+        self.cluster.lost(node)
+        if node not in self.connecting:
+            self.reconnect(node)
+
+    def send(self, node, data: bytes):
+        writer = self.writers.get(node)
+        if writer is not None:
+            writer.write(data)
+
+    def close(self):
+        self.closed = True
+        for task in self.connecting.values():
+            task.cancel()
+        self.connecting.clear()
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+        for writer in list(self.writers.values()) + list(self.inbound):
+            writer.close()
+        self.writers.clear()
+
+
+class UnixTransport (StreamTransport):
+    """ Connects the worker processes of one server, given {node: socket path} for all of them. """
+
+    async def listen(self, path):
+        return await asyncio.start_unix_server(self.accept, path)
+
+    async def open(self, path):
+        return await asyncio.open_unix_connection(path)
+
+
+class TCPTransport (StreamTransport):
+    """
+    Connects nodes on different hosts, given {node: (host, port)} for all of them. Anyone who can reach a node could
+    otherwise join the cluster as one of the others, so a secret is required.
+    """
+
+    def __init__(self, addresses, secret=None):
+        if not secret:
+            raise ValueError('Connecting cluster nodes over TCP requires a secret (CLUSTER_SECRET).')
+        super().__init__(addresses, secret)
+
+    async def listen(self, address):
+        host, port = address
+        return await asyncio.start_server(self.accept, host, port, reuse_address=True)
+
+    async def open(self, address):
+        host, port = address
+        return await asyncio.open_connection(host, port)
+
+
+class RemoteSession (Session):
+    """
+    Stands in for an authenticated session connected to another node, so it can be listed, looked up and sent to like
+    any other session. Anything sent to it is forwarded to its node.
+    """
+
+    cluster = None
+
+    async def send(self, data: Sendable):
+        self.cluster.forward(self, data)
+
+
+class RemoteWebSession:
+    """
+    Stands in for a WebSession on another node, for HTTP API requests with its token that reach this one. They're
+    passed on to the node with the session (each node only hands out tokens for its own, see Cluster.tag_token), which
+    answers with None if it no longer has the session.
+    """
+
+    def __init__(self, cluster, node, token):
+        self.cluster = cluster
+        self.node = node
+        self.token = token
+
+    async def request(self, data):
+        return await self.cluster.call(self.node, ['web_request', self.token, data])
+
+    async def poll(self, since=None, timeout=10.0, linger=0.0):
+        # Waits for the poll itself as well as the usual time for the node to answer.
+        return await self.cluster.call(self.node, ['web_poll', self.token, since, timeout, linger],
+            timeout + linger + self.cluster.timeout)
+
+    async def stream(self, since=None, heartbeat=15.0):
+        """ Yields chunks of server-sent events from the session, polling for them. """
+        while True:
+            try:
+                result = await self.poll(since, heartbeat)
+            except ProtocolError:
+                return
+            if result is None:
+                return
+            last, missed, events = result
+            chunks = []
+            if missed:
+                chunks.append('event: missed\ndata: {}\n\n'.format(missed).encode('ascii'))
+            first = last - len(events) + 1
+            chunks.extend(format_event(first + n, event) for n, event in enumerate(events))
+            since = last
+            yield b''.join(chunks) or EventStream.keepalive
+
+
+class Cluster:
+    """
+    Joins several nodes (server processes, whether workers on one host or servers on many) into one logical server,
+    so their clients all see the same server. Each node tells the others about its authenticated sessions (which they
+    register as RemoteSessions), the channels those sessions are in, and any channels created. Broadcasts and channel
+    sends are relayed once to each node that needs them, and fanned out there to its own sessions. Nicknames are
+    claimed from the node that owns them (chosen by hashing the nickname), so two nodes never hand out the same one.
+    Web sessions stay on the node that created them, which the others pass their HTTP requests on to. Accounts saved
+    on one node are announced to the others, which drop them from their account caches.
+
+    Messages to each node are queued up and handed to the transport together, once per event loop iteration (or
+    every batch_delay seconds), and anything forwarded to several sessions on one node is sent to it only once. Each
+    message is a frame (as read by FrameBuffer) holding a JSON list of an operation and its arguments, optionally
+    followed by a newline and an encoded Sendable, and is handled by the matching handle_<operation> method.
+    """
+
+    # Seconds to wait for another node to answer a request (such as a nickname claim).
+    timeout = 5.0
+    max_frame_size = 16777216
+
+    def __init__(self, server, node, nodes, transport: Transport, batch_delay=0.0):
+        self.server = server
+        self.node = node
+        self.nodes = sorted(nodes)
+        self.transport = transport
+        self.batch_delay = batch_delay
+        # The nodes currently connected, and the stream of messages received from each.
+        self.peers = set()
+        self.buffers = {}
+        # Messages waiting to be sent by node, and the deliver messages among them by (node, id(data)).
+        self.outgoing = {}
+        self.forwards = {}
+        self.flush_handle = None
+        # Nicknames this node owns as {casefolded nickname: (node, ident)}, and those held by local sessions.
+        self.claims = {}
+        self.claimed = {}
+        # Requests waiting for an answer from another node, as {request id: (node, future)}.
+        self.requests = {}
+        self.request_ids = itertools.count()
+
+    async def start(self):
+        self.server.sessions.observer = self
+        self.server.channels.observer = self
+        Account.observer = self
+        await self.transport.start(self)
+
+    def close(self):
+        self.server.sessions.observer = None
+        self.server.channels.observer = None
+        if Account.observer is self:
+            Account.observer = None
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush()
+        self.transport.close()
+
+    # Called by the transport.
+
+    def connected(self, node):
+        self.peers.add(node)
+        # Bring the node up to date with anything that happened here before it was connected.
+        for channel in self.server.channels:
+            self.send(node, ['channel', channel.prepare()])
+        for session in self.server.sessions.local_authenticated:
+            self.send(node, self.presence(session))
+
+    def received(self, node, data: bytes):
+        buffer = self.buffers.get(node)
+        if buffer is None:
+            buffer = self.buffers[node] = FrameBuffer(self.max_frame_size)
+        buffer.feed(data)
+        for frame in buffer.frames():
+            message, _, payload = frame.partition(b'\n')
+            op, *args = json.loads(message)
+            self.dispatch(node, op, args, payload)
+
+    def lost(self, node):
+        """ Forgets a node that has gone away, along with its nickname claims and sessions. """
+        self.peers.discard(node)
+        self.buffers.pop(node, None)
+        self.outgoing.pop(node, None)
+        for request, (owner, future) in self.requests.items():
+            if owner == node and not future.done():
+                future.set_exception(ProtocolError('The server is busy, please try again.'))
+        for key, holder in list(self.claims.items()):
+            if holder[0] == node:
+                del self.claims[key]
+        for session in [s for s in self.server.sessions.remote if s.node == node]:
+            channels = list(session.channels)
+            self.drop(session)
+            # The node can no longer say its sessions left, so the local sessions are told here instead.
+            for channel in channels:
+                asyncio.ensure_future(fanout(channel.local_sessions, ChannelLeave(channel=channel.name, user=session)))
+            asyncio.ensure_future(fanout(list(self.server.sessions.local_authenticated), UserLeft(user=session)))
+
+    def dispatch(self, node, op, args, payload):
+        handler = getattr(self, 'handle_{}'.format(op), None)
+        if handler is None:
+            logger.warning('Unknown message from node %s: %s', node, op)
+            return
+        try:
+            if payload:
+                args.append(decode_payload(payload))
+            handler(node, *args)
+        except Exception:
+            logger.exception('Error handling %s from node %s', op, node)
+
+    # Sending to other nodes.
+
+    def send(self, node, message, data: Sendable = None):
+        if node not in self.peers:
+            return
+        self.outgoing.setdefault(node, []).append((message, data))
+        if self.flush_handle is None:
+            loop = asyncio.get_event_loop()
+            if self.batch_delay:
+                self.flush_handle = loop.call_later(self.batch_delay, self.flush)
+            else:
+                self.flush_handle = loop.call_soon(self.flush)
+
+    def publish(self, message, data: Sendable = None, nodes=None):
+        """ Sends message (and data, if given) to each of nodes, or every other node. """
+        for node in self.peers if nodes is None else nodes:
+            self.send(node, message, data)
+
+    def flush(self):
+        """ Hands everything queued for each node to the transport in one go. """
+        self.flush_handle = None
+        self.forwards.clear()
+        outgoing, self.outgoing = self.outgoing, {}
+        # Messages published to several nodes are only encoded once.
+        encoded = {}
+        for node, messages in outgoing.items():
+            frames = []
+            for message, data in messages:
+                frame = encoded.get(id(message))
+                if frame is None:
+                    frame = encoded[id(message)] = encode_message(message, data)
+                frames.append(frame)
+            self.transport.send(node, b''.join(frames))
+
+    async def call(self, node, message, timeout=None):
+        """
+        Sends message to node with a request id after the operation, and returns the result it replies with (see
+        reply), raising ProtocolError if it doesn't within timeout seconds (or the usual timeout).
+        """
+        if node not in self.peers:
+            raise ProtocolError('The server is busy, please try again.')
+        request = next(self.request_ids)
+        future = asyncio.get_event_loop().create_future()
+        self.requests[request] = (node, future)
+        op, *args = message
+        self.send(node, [op, request] + args)
+        try:
+            return await asyncio.wait_for(future, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            raise ProtocolError('The server is busy, please try again.')
+        finally:
+            del self.requests[request]
+
+    def reply(self, node, request, result, error=None):
+        """ Answers a call from node, with a result or an error (raised as a ProtocolError by call). """
+        self.send(node, ['reply', request, result] if error is None else ['reply', request, None, error])
+
+    def presence(self, session):
+        return ['session', session.prepare(), [channel.name for channel in session.channels]]
+
+    # Changes to local state, reported by the server's Sessions and Channels registries, and by Account.
+
+    def session_changed(self, session, name, old_value):
+        if name == 'authenticated':
+            if session.authenticated and not old_value:
+                self.publish(self.presence(session))
+            elif old_value and not session.authenticated:
+                self.publish(['left', session.ident])
+                self.release(session)
+        elif name == 'nickname' and session.authenticated and session.nickname != old_value:
+            self.publish(self.presence(session))
+
+    def session_removed(self, session):
+        if session.authenticated:
+            self.publish(['left', session.ident])
+        self.release(session)
+
+    def channel_created(self, channel):
+        self.publish(['channel', channel.prepare()])
+
+    def membership_changed(self, channel, session, joined):
+        self.publish(['joined' if joined else 'parted', channel.name, session.ident])
+
+    def account_saved(self, key):
+        self.publish(['account', key])
+
+    # Sending to sessions on other nodes.
+
+    def broadcast(self, data: Sendable):
+        self.publish(['broadcast'], data)
+
+    def channel_sent(self, channel, data: Sendable):
+        nodes = {session.node for session in channel.remote_sessions}
+        self.publish(['post', channel.name], data, nodes=nodes)
+
+    def forward(self, session, data: Sendable):
+        if session.node not in self.peers:
+            return
+        # The same data sent to several sessions on a node (as fanout does) goes out as one message for all of them.
+        key = (session.node, id(data))
+        message = self.forwards.get(key)
+        if message is None:
+            message = self.forwards[key] = ['deliver', [session.ident]]
+            self.send(session.node, message, data)
+        else:
+            message[1].append(session.ident)
+
+    # Nickname claims.
+
+    def owner(self, key):
+        return self.nodes[zlib.crc32(key.encode('utf-8')) % len(self.nodes)]
+
+    async def claim(self, session, nickname):
+        """ Claims nickname for session on every node, returning False if another session already holds it. """
+        key = nickname.casefold()
+        owner = self.owner(key)
+        if owner == self.node:
+            granted = self.grant(key, self.node, session.ident)
+        else:
+            granted = await self.call(owner, ['claim', key, session.ident])
+        if granted:
+            previous = self.claimed.get(session.ident)
+            self.claimed[session.ident] = key
+            if previous is not None and previous != key:
+                self.release_key(previous, session.ident)
+            if session.registry is None:
+                # The session disconnected while waiting.
+                self.release(session)
+                return False
+        return granted
+
+    def release(self, session):
+        key = self.claimed.pop(session.ident, None)
+        if key is not None:
+            self.release_key(key, session.ident)
+
+    def release_key(self, key, ident):
+        owner = self.owner(key)
+        if owner == self.node:
+            self.revoke(key, self.node, ident)
+        else:
+            self.send(owner, ['release', key, ident])
+
+    def grant(self, key, node, ident):
+        return self.claims.setdefault(key, (node, ident)) == (node, ident)
+
+    def revoke(self, key, node, ident):
+        if self.claims.get(key) == (node, ident):
+            del self.claims[key]
+
+    # Web sessions.
+
+    def tag_token(self, token):
+        """ Marks a session token as this node's, so HTTP requests with it that reach other nodes are sent here. """
+        return '{}-{}'.format(self.nodes.index(self.node), token)
+
+    def token_node(self, token):
+        """ The node that handed out token, or None if it wasn't handed out by a node of this cluster. """
+        index, _, rest = token.partition('-')
+        if not rest or not index.isdigit() or int(index) >= len(self.nodes):
+            return None
+        return self.nodes[int(index)]
+
+    def answer(self, node, request, token, method, *args):
+        """ Replies to a request from node with the result of calling method on the local WebSession with token. """
+        async def run():
+            session = self.server.local_web_session(token)
+            try:
+                result = await getattr(session, method)(*args) if session is not None else None
+            except Exception:
+                logger.exception('Error handling web %s from node %s', method, node)
+                self.reply(node, request, None, 'Internal server error.')
+            else:
+                self.reply(node, request, result)
+        asyncio.ensure_future(run())
+
+    # Changes on other nodes.
+
+    def drop(self, session):
+        for channel in list(session.channels):
+            channel.remove(session)
+        self.server.sessions.remove(session)
+
+    def remote_session(self, node, ident):
+        session = self.server.sessions.by_ident.get(ident)
+        return session if session is not None and session.node == node else None
+
+    def handle_session(self, node, fields, channels):
+        session = self.server.sessions.by_ident.get(fields['ident'])
+        update = RemoteSession.unpack(fields)
+        if session is None:
+            session = update
+            session.cluster = self
+            session.node = node
+            session.authenticated = True
+            self.server.sessions.add(session)
+        elif session.node == node:
+            for name, field, required, readonly in Session._schema:
+                if not readonly:
+                    setattr(session, name, getattr(update, name))
+        else:
+            return
+        names = set(channels)
+        for channel in list(session.channels):
+            if channel.name not in names:
+                channel.remove(session)
+        for name in names:
+            if name in self.server.channels:
+                self.server.channels[name].add(session)
+
+    def handle_left(self, node, ident):
+        session = self.remote_session(node, ident)
+        if session is not None:
+            self.drop(session)
+
+    def handle_channel(self, node, fields):
+        self.server.channels.add(Channel.unpack(fields), replicated=True)
+
+    def handle_joined(self, node, name, ident):
+        session = self.remote_session(node, ident)
+        if session is not None and name in self.server.channels:
+            self.server.channels[name].add(session)
+
+    def handle_parted(self, node, name, ident):
+        session = self.remote_session(node, ident)
+        if session is not None and name in self.server.channels:
+            self.server.channels[name].remove(session)
+
+    def handle_broadcast(self, node, data):
+        asyncio.ensure_future(fanout(list(self.server.sessions.local_authenticated), data))
+
+    def handle_post(self, node, name, data):
+        if name in self.server.channels:
+            asyncio.ensure_future(fanout(list(self.server.channels[name].local_sessions), data))
+
+    def handle_deliver(self, node, idents, data):
+        sessions = [self.server.sessions.by_ident.get(ident) for ident in idents]
+        asyncio.ensure_future(fanout([s for s in sessions if s is not None and s.node is None], data))
+
+    def handle_account(self, node, key):
+        accounts.invalidate(key)
+
+    def handle_claim(self, node, request, key, ident):
+        self.reply(node, request, self.grant(key, node, ident))
+
+    def handle_reply(self, node, request, result, error=None):
+        owner, future = self.requests.get(request, (None, None))
+        if owner != node or future.done():
+            return
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(ProtocolError(error))
+
+    def handle_release(self, node, key, ident):
+        self.revoke(key, node, ident)
+
+    def handle_web_request(self, node, request, token, data):
+        self.answer(node, request, token, 'request', data)
+
+    def handle_web_poll(self, node, request, token, since, timeout, linger):
+        self.answer(node, request, token, 'poll', since, timeout, linger)
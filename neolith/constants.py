@@ -114,6 +114,7 @@ class ERR (enum.Enum):
     NOTOPLEVEL = 413
     WILDTOPLEVEL = 414
     BADMASK = 415
+    INPUTTOOLONG = 417
     UNKNOWNCOMMAND = 421
     NOMOTD = 422
     NOADMININFO = 423
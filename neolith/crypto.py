@@ -0,0 +1,98 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import asyncio
+import hashlib
+import hmac
+
+
+class ExecutorBusy (Exception):
+    pass
+
+
+def xor(b1, b2):
+    return bytes([a ^ b for a, b in zip(b1, b2)])
+
+
+def verify_password(password_spec, stored_key, password):
+    """ Checks a plaintext password against an account's PasswordSpec and SCRAM stored key. """
+    salted_password = password_spec.generate(password)
+    client_key = hmac.new(salted_password, b'Client Key', 'sha256').digest()
+    return stored_key is not None and hmac.compare_digest(hashlib.sha256(client_key).digest(), stored_key)
+
+
+def verify_proof(stored_key, server_key, nonce, proof):
+    """ Checks a SCRAM client proof, returning the server signature if it's valid, or None if it's not. """
+    client_signature = hmac.new(stored_key, nonce, 'sha256').digest()
+    client_key = xor(client_signature, proof)
+    if not hmac.compare_digest(hashlib.sha256(client_key).digest(), stored_key):
+        return None
+    return hmac.new(server_key, nonce, 'sha256').digest()
+
+
+class CryptoExecutor:
+    """
+    Runs password hashing and verification off the event loop. hashlib releases the GIL while hashing, so a thread
+    pool is usually enough, but a process pool can be used instead (functions and arguments must then be picklable).
+    At most `workers` jobs run at once; once more than `max_queue` are waiting behind them (if set), new jobs are
+    rejected with ExecutorBusy rather than piling up.
+    """
+
+    def __init__(self, workers=4, processes=False, max_queue=0):
+        self.workers = workers
+        self.processes = processes
+        self.max_queue = max_queue
+        self.pool = None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def queued(self):
+        """ Number of jobs waiting for a free worker. """
+        return max(0, self.in_flight - self.workers)
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'running': min(self.in_flight, self.workers),
+            'queued': self.queued,
+            'completed': self.completed,
+            'rejected': self.rejected,
+        }
+
+    async def run(self, func, *args):
+        if self.max_queue and self.queued >= self.max_queue:
+            self.rejected += 1
+            raise ExecutorBusy('Too many pending {} jobs.'.format(func.__name__))
+        if self.pool is None:
+            pool_class = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+            self.pool = pool_class(max_workers=self.workers)
+        self.in_flight += 1
+        try:
+            return await asyncio.get_event_loop().run_in_executor(self.pool, func, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+
+executor = CryptoExecutor()
+
+
+def configure_crypto(workers=4, processes=False, max_queue=0):
+    global executor
+    executor.shutdown()
+    executor = CryptoExecutor(workers=workers, processes=processes, max_queue=max_queue)
+
+
+def shutdown_crypto():
+    executor.shutdown()
+
+
+async def run_crypto(func, *args):
+    """ Runs func(*args) on the crypto executor. """
+    return await executor.run(func, *args)
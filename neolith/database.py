@@ -0,0 +1,178 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncio
+import bisect
+import queue
+import sqlite3
+import threading
+import time
+
+
+class Histogram:
+    """ Counts observed latencies (in seconds) into fixed buckets, by upper bound. """
+
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, float('inf'))
+
+    def __init__(self):
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'buckets': {str(bound): count for bound, count in zip(self.buckets, self.counts)},
+        }
+
+
+def connect(path):
+    # Connections are handed between threads, but each is only ever used by one thread at a time.
+    connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, cached_statements=256)
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute('PRAGMA busy_timeout=5000')
+    return connection
+
+
+class Reader:
+    """ A read-only connection with its own dedicated thread. """
+
+    def __init__(self, path, name):
+        self.connection = connect(path)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.in_flight = 0
+
+    def fetch(self, sql, params):
+        return self.connection.execute(sql, params).fetchall()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.connection.close()
+
+
+class Writer (threading.Thread):
+    """
+    The single connection that writes to the database. Writes queued while it's busy are committed together in one
+    transaction (up to batch_size at a time), each in its own savepoint so one failing statement doesn't take the
+    rest of the batch down with it.
+    """
+
+    def __init__(self, path, batch_size=100):
+        super().__init__(name='neolith-db-writer', daemon=True)
+        self.connection = connect(path)
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.batches = 0
+
+    def submit(self, sql, params, future):
+        self.queue.put((sql, params, future, asyncio.get_event_loop()))
+
+    def run(self):
+        running = True
+        while running:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            self.write(batch)
+        self.connection.close()
+
+    def write(self, batch):
+        results = []
+        try:
+            self.connection.execute('BEGIN')
+            for sql, params, future, loop in batch:
+                self.connection.execute('SAVEPOINT neolith_write')
+                try:
+                    results.append((self.connection.execute(sql, params), None))
+                except Exception as e:
+                    self.connection.execute('ROLLBACK TO neolith_write')
+                    results.append((None, e))
+                self.connection.execute('RELEASE neolith_write')
+            self.connection.execute('COMMIT')
+        except Exception as e:
+            if self.connection.in_transaction:
+                self.connection.execute('ROLLBACK')
+            results = [(None, e)] * len(batch)
+        self.batches += 1
+        for (sql, params, future, loop), (result, error) in zip(batch, results):
+            loop.call_soon_threadsafe(resolve, future, result, error)
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+
+
+def resolve(future, result, error):
+    if future.done():
+        return
+    if error is None:
+        future.set_result(result)
+    else:
+        future.set_exception(error)
+
+
+class Database:
+    """
+    A small pool of SQLite connections in WAL mode, so reads never wait on writes or on each other, and nothing
+    touches the database from the event loop thread. Reads go to the least busy reader; writes are queued for the
+    writer, which batches them. Latency (including time spent waiting for a connection) is tracked per operation.
+    """
+
+    def __init__(self, path, readers=4, batch_size=100):
+        self.path = path
+        self.writer = Writer(path, batch_size=batch_size)
+        self.writer.start()
+        self.readers = [Reader(path, 'neolith-db-reader-{}'.format(n)) for n in range(readers)]
+        self.latency = {
+            'read': Histogram(),
+            'write': Histogram(),
+        }
+
+    def stats(self):
+        return {
+            'readers': [r.in_flight for r in self.readers],
+            'writes_queued': self.writer.queue.qsize(),
+            'write_batches': self.writer.batches,
+            'latency': {name: histogram.stats() for name, histogram in self.latency.items()},
+        }
+
+    async def fetch(self, sql, params=None):
+        reader = min(self.readers, key=lambda r: r.in_flight)
+        reader.in_flight += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_event_loop().run_in_executor(reader.executor, reader.fetch, sql, params or [])
+        finally:
+            reader.in_flight -= 1
+            self.latency['read'].observe(time.perf_counter() - start)
+
+    async def execute(self, sql, params=None):
+        future = asyncio.get_event_loop().create_future()
+        start = time.perf_counter()
+        self.writer.submit(sql, params or [], future)
+        try:
+            return await future
+        finally:
+            self.latency['write'].observe(time.perf_counter() - start)
+
+    def close(self):
+        self.writer.close()
+        for reader in self.readers:
+            reader.close()
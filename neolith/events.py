@@ -0,0 +1,133 @@
+import asyncio
+import collections
+import itertools
+
+
+class EventBuffer:
+    """
+    Bounded buffer of encoded events for a session that polls for them over HTTP. Events are numbered in order from 1,
+    and clients ask for the ones after the last they've seen, so a response lost on the way is simply sent again on
+    the next request. Once size events are buffered, each new one pushes out the oldest, and a client that falls that
+    far behind is told how many it missed.
+    """
+
+    def __init__(self, size=1000):
+        self.events = collections.deque(maxlen=size)
+        self.last = 0
+        # Shared by everyone waiting for the next event, and only created while someone is.
+        self.waiter = None
+
+    def __len__(self):
+        return len(self.events)
+
+    @property
+    def first(self):
+        """ Sequence number of the oldest buffered event (or the next one, if there are none). """
+        return self.last - len(self.events) + 1
+
+    def append(self, event):
+        """ Buffers event, returning its sequence number. """
+        self.last += 1
+        self.events.append(event)
+        if self.waiter is not None:
+            if not self.waiter.done():
+                self.waiter.set_result(None)
+            self.waiter = None
+        return self.last
+
+    def since(self, seq):
+        """
+        Returns (missed, events) for everything after sequence number seq, where missed is the number of those events
+        already pushed out of the buffer, and events is a list of (seq, event) for the rest.
+        """
+        seq = min(seq, self.last)
+        first = self.first
+        missed = max(first - seq - 1, 0)
+        start = max(seq + 1 - first, 0)
+        return missed, list(zip(itertools.count(first + start), itertools.islice(self.events, start, None)))
+
+    async def wait(self, seq, timeout=None):
+        """ Waits up to timeout seconds for an event after seq, returning whether there is one. """
+        if self.last > seq:
+            return True
+        if self.waiter is None:
+            self.waiter = asyncio.get_event_loop().create_future()
+        try:
+            # Shielded, since the future is shared with anyone else waiting.
+            await asyncio.wait_for(asyncio.shield(self.waiter), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.last > seq
+
+
+def format_event(seq, event):
+    """ Frames an encoded event (which mustn't contain newlines, as compact JSON doesn't) as a server-sent event. """
+    return 'id: {}\ndata: {}\n\n'.format(seq, event).encode('utf-8')
+
+
+def event_seq(frame):
+    """ Returns the sequence number of a frame made by format_event, or None for anything else sent on a stream. """
+    if frame.startswith(b'id: '):
+        return int(frame[4:frame.index(b'\n')])
+    return None
+
+
+class EventStream:
+    """
+    Stands in for the transport of an Outbox whose frames are sent as a streaming HTTP response (of server-sent events)
+    rather than over a socket. The response pulls what's been written through chunks(), and the outbox is paused while
+    each chunk is being sent, so writes meanwhile are queued under the same limit and policy as for any other session.
+    A comment is sent after heartbeat seconds without anything to send, to keep proxies from timing the stream out.
+    The sequence number of the last event the response has taken (starting from since) is kept as sent.
+    """
+
+    keepalive = b': keepalive\n\n'
+
+    def __init__(self, heartbeat=15.0, since=0):
+        self.heartbeat = heartbeat
+        self.sent = since
+        self.outbox = None
+        self.pending = []
+        self.closed = False
+        self.waiter = None
+
+    def wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def write(self, data: bytes):
+        self.pending.append(data)
+        self.wake()
+
+    def writelines(self, data):
+        self.pending.extend(data)
+        self.wake()
+
+    def abort(self):
+        self.closed = True
+        self.wake()
+
+    close = abort
+
+    async def chunks(self):
+        while True:
+            # Let through anything the outbox queued while the last chunk was being sent.
+            self.outbox.resume()
+            if not self.pending and not self.closed:
+                self.waiter = asyncio.get_event_loop().create_future()
+                try:
+                    await asyncio.wait_for(self.waiter, self.heartbeat)
+                except asyncio.TimeoutError:
+                    pass
+                self.waiter = None
+            if self.closed:
+                return
+            frames, self.pending = self.pending, []
+            self.outbox.pause()
+            yield b''.join(frames) or self.keepalive
+            # The response only asks for the next chunk once it has sent this one.
+            for frame in reversed(frames):
+                seq = event_seq(frame)
+                if seq is not None:
+                    self.sent = seq
+                    break
@@ -0,0 +1,79 @@
+from neolith.protocol import ProtocolError
+
+import struct
+
+
+header = struct.Struct('!L')
+# Set in a frame header if the payload is compressed (with whatever compression the connection has negotiated).
+COMPRESSED = 0x80000000
+
+
+class FrameBuffer:
+    """
+    Accumulates a stream of length-prefixed frames (a 4-byte big-endian size followed by that many bytes) and parses
+    them in place. Consumed bytes are only reclaimed when more room is needed, so each byte received is copied a
+    constant number of times no matter how the stream is split up. Once the connection has negotiated compression,
+    decompressor is set and used for frames flagged as COMPRESSED.
+    """
+
+    def __init__(self, max_frame_size=1048576, initial_size=65536):
+        self.max_frame_size = max_frame_size
+        self.initial_size = initial_size
+        self.buffer = bytearray(initial_size)
+        self.start = 0
+        self.end = 0
+        self.decompressor = None
+
+    def __len__(self):
+        return self.end - self.start
+
+    def reserve(self, size):
+        """ Makes sure there are at least size bytes free at the end of the buffer. """
+        if len(self.buffer) - self.end >= size:
+            return
+        pending = self.end - self.start
+        if self.start:
+            # Move the unparsed tail to the front before deciding whether we need to grow.
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, pending
+        if len(self.buffer) - self.end < size:
+            self.buffer.extend(bytes(max(len(self.buffer), pending + size - len(self.buffer))))
+
+    def feed(self, data: bytes):
+        size = len(data)
+        self.reserve(size)
+        self.buffer[self.end:self.end + size] = data
+        self.end += size
+
+    def frames(self):
+        """
+        Returns the payloads of all complete frames received so far, leaving any partial frame buffered. Raises
+        ProtocolError if a frame header advertises more than max_frame_size bytes, or a compressed frame is invalid or
+        would decompress to more than that.
+        """
+        frames = []
+        with memoryview(self.buffer) as view:
+            while self.end - self.start >= 4:
+                size = header.unpack_from(view, self.start)[0]
+                compressed = size & COMPRESSED
+                size &= ~COMPRESSED
+                if size > self.max_frame_size:
+                    raise ProtocolError('Frame of {} bytes exceeds the maximum of {} bytes.'.format(
+                        size, self.max_frame_size))
+                if compressed and self.decompressor is None:
+                    raise ProtocolError('Compressed frame received before negotiating compression.')
+                total = 4 + size
+                if self.end - self.start < total:
+                    break
+                with view[self.start + 4:self.start + total] as payload:
+                    if compressed:
+                        frames.append(self.decompressor.decompress(payload, self.max_frame_size))
+                    else:
+                        frames.append(payload.tobytes())
+                self.start += total
+        if self.start == self.end:
+            # Everything has been consumed, so start over at the front for free (and give back any large buffer).
+            self.start = self.end = 0
+            if len(self.buffer) > self.initial_size:
+                self.buffer = bytearray(self.initial_size)
+        return frames
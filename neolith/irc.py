@@ -1,20 +1,97 @@
 from neolith import settings
-from neolith.protocol import Message, PostChat, ProtocolError, Sendable, Session, Transaction
+from neolith.protocol import Message, PostChat, ProtocolError, Sendable, Session, Transaction, valid_nickname
 
 from .constants import ERR, RPL
+from .crypto import ExecutorBusy
+from .ircparser import LineBuffer, command_table, parse_message
+from .outbox import Outbox
+from .wirelog import log_wire
 
 import asyncio
 import base64
 import logging
+import re
+
+
+# Longest line a client is expected to accept, including the line ending.
+MAX_LINE_LENGTH = 512
+
+
+# Characters that would end a line early, and those that can't appear in a prefix or a parameter other than the last.
+line_breaks = re.compile('[\r\n\0]+')
+word_breaks = re.compile('[\r\n\0 ]+|^:')
 
 
 def escape(text):
-    # TODO: escape stuff
-    if ' ' in text:
+    """
+    Makes text safe to send as the last parameter of a line, which needs a leading colon if it's empty or contains
+    spaces (or a colon of its own). Line breaks (and NULs) can't be escaped, so they're replaced with spaces.
+    """
+    text = line_breaks.sub(' ', text)
+    if not text or ' ' in text or text[0] == ':':
         return ':' + text
     return text
 
 
+def escape_word(text):
+    """
+    Makes text safe to send as a prefix or a parameter other than the last, which end at the first space and can't
+    start with a colon, by replacing anything that would break them up with an underscore.
+    """
+    return word_breaks.sub('_', text) if text else '*'
+
+
+def format_line(code, *params, prefix=None):
+    start = ':' + escape_word(str(prefix or settings.SERVER_NAME))
+    if params:
+        *params, last = params
+        params = [escape_word(param) for param in params]
+        params.append(escape(last))
+    line = '{} {} {}\r\n'.format(start, code, ' '.join(params))
+    return line.encode('utf-8')
+
+
+def format_list(code, *params, items, prefix=None):
+    """
+    Renders a line for code and params whose last parameter is a space-separated list of items (such as a NAMREPLY),
+    split into as many lines as it takes to keep each within MAX_LINE_LENGTH. Returns the lines joined together.
+    """
+    room = MAX_LINE_LENGTH - len(format_line(code, *params, '', prefix=prefix))
+    lines = []
+    batch = []
+    size = 0
+    for item in items:
+        length = len(item.encode('utf-8'))
+        if batch and size + 1 + length > room:
+            lines.append(format_line(code, *params, ' '.join(batch), prefix=prefix))
+            batch, size = [], 0
+        size += length + 1 if batch else length
+        batch.append(item)
+    if batch or not lines:
+        lines.append(format_line(code, *params, ' '.join(batch), prefix=prefix))
+    return b''.join(lines)
+
+
+def irc_lines(data: Sendable):
+    """
+    Wire format for IRCSession: a (packet, sender, line) tuple for each packet in data. Lines are rendered once for
+    every recipient, except the sender (so chat is not echoed back). Packets with a line of None render differently
+    for each recipient, and are left to IRCSession.rewrite.
+    """
+    lines = []
+    for packet in data:
+        if packet.ident == 'channel.posted':
+            line = format_line('PRIVMSG', '#' + packet.channel, packet.chat, prefix=packet.user) if packet.chat else b''
+            lines.append((packet, packet.user.ident, line))
+        elif packet.ident == 'channel.joined':
+            lines.append((packet, None, format_line('JOIN', '#' + packet.channel, prefix=packet.user)))
+        elif packet.ident == 'channel.left':
+            lines.append((packet, None, format_line('PART', '#' + packet.channel, prefix=packet.user)))
+        else:
+            lines.append((packet, None, None))
+    return lines
+
+
 class IRCSession (asyncio.Protocol, Session):
 
     # Mostly for the server to associate a HLUser with this connection.
@@ -22,14 +99,23 @@ class IRCSession (asyncio.Protocol, Session):
     password = None
 
     def __init__(self, server):
+        super().__init__()
         self.server = server
         self.transport = None
+        self.outbox = None
         self.address = None
         self.port = None
-        self.buffer = b''
+        self.buffer = LineBuffer()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Subclasses get their own table, with their handlers (and any from mixins) in it.
+        cls.commands = command_table(cls)
 
     def connection_made(self, transport):
         self.transport = transport
+        self.outbox = Outbox(transport, settings.OUTBOX_LIMIT, settings.OUTBOX_POLICY,
+            batch=settings.OUTBOX_BATCH)
         self.address, self.port = transport.get_extra_info('peername')
         self.hostname = self.address
         if hasattr(self.server, 'connected'):
@@ -39,48 +125,42 @@ class IRCSession (asyncio.Protocol, Session):
         if hasattr(self.server, 'disconnected'):
             asyncio.ensure_future(self.server.disconnected(self))
 
+    def pause_writing(self):
+        self.outbox.pause()
+
+    def resume_writing(self):
+        self.outbox.resume()
+
     def data_received(self, data):
-        self.buffer += data
-        *lines, self.buffer = self.buffer.split(b'\r\n')
-        for line in lines:
-            parts = line.decode('utf-8').split(':', 2)
-            if parts[0]:
-                prefix = None
-                cmd, *params = parts[0].strip().split(' ')
-                params.extend(parts[1:])
-            else:
-                prefix, cmd, *params = parts[1].strip().split(' ')
-                params.extend(parts[2:])
-            handler = getattr(self, 'handle_{}'.format(cmd.upper()), None)
+        for line in self.buffer.feed(data):
+            if line is None:
+                self.write(ERR.INPUTTOOLONG, self.nickname or '*', 'Input line was too long')
+                continue
+            message = parse_message(line.decode('utf-8', 'replace'))
+            if message is None:
+                continue
+            handler = self.commands.get(message.command)
             if handler:
                 # TODO: check authentication for non-login-related commands (PASS, USER, NICK, CAP, etc)
-                asyncio.ensure_future(handler(*params, prefix=prefix))
+                asyncio.ensure_future(handler(self, *message.params, prefix=message.prefix))
             else:
-                self.write(ERR.UNKNOWNCOMMAND, self.nickname or '*', cmd, 'Unknown command')
-                logging.debug('Unknown IRC command "%s" with params: %s', cmd, params)
+                self.write(ERR.UNKNOWNCOMMAND, self.nickname or '*', message.command, 'Unknown command')
+                logging.debug('Unknown IRC command "%s" with params: %s', message.command, message.params)
 
     def write(self, code, *params, prefix=None):
-        start = ':{}'.format(prefix or settings.SERVER_NAME)
-        line = '{} {} {}\r\n'.format(start, code, ' '.join(escape(p) for p in params))
-        self.transport.write(line.encode('utf-8'))
+        self.outbox.write(format_line(code, *params, prefix=prefix))
 
     async def send(self, data: Sendable):
-        print(self, '(IRC) <--', data.to_dict())
-        for packet in data:
-            await self.rewrite(packet)
+        log_wire(self, '<--', data)
+        for packet, sender, line in data.encode(irc_lines):
+            if line is None:
+                await self.rewrite(packet)
+            elif line and sender != self.ident:
+                self.outbox.write(line, packet.droppable, packet.coalesce_key())
 
     async def rewrite(self, packet):
-        if packet.ident == 'channel.posted' and packet.chat:
-            channel = self.server.channels[packet.channel]
-            if packet.user.ident != self.ident:
-                self.write('PRIVMSG', channel.irc_name, packet.chat, prefix=packet.user)
-        elif packet.ident == 'channel.joined':
-            channel = self.server.channels[packet.channel]
-            self.write('JOIN', channel.irc_name, prefix=packet.user)
-        elif packet.ident == 'channel.left':
-            channel = self.server.channels[packet.channel]
-            self.write('PART', channel.irc_name, prefix=packet.user)
-        elif packet.ident == 'message':
+        # Only packets whose IRC rendering depends on the recipient end up here, see irc_lines.
+        if packet.ident == 'message':
             if not packet.encrypted:
                 self.write('PRIVMSG', str(self), packet.message, prefix=packet.sender.nickname)
 
@@ -90,10 +170,14 @@ class IRCSession (asyncio.Protocol, Session):
         if self.username and self.nickname and not self.password:
             self.write('NOTICE', 'AUTH', '*** You are not logged in, please use PASS or AUTHENTICATE')
             return
-        from neolith.models import Account
+        from neolith.models import get_account
         if self.username and self.password and self.nickname:
-            self.account = await Account.query(username=self.username).get()
-            if self.account is None or not self.account.check_password(self.password):
+            self.account = await get_account(self.username)
+            try:
+                valid = self.account is not None and await self.account.verify_password(self.password)
+            except ExecutorBusy:
+                raise ProtocolError('The server is busy, please try again.')
+            if not valid:
                 raise ProtocolError('Login failed.')
             if sasl:
                 self.write(RPL.LOGGEDIN, self.nickname, str(self), self.username,
@@ -109,11 +193,11 @@ class IRCSession (asyncio.Protocol, Session):
 
     async def handle_CAP(self, *params, prefix=None):
         if params[0].upper() == 'LS':
-            self.write('CAP', self.nickname or '*', 'LS', ':sasl')
+            self.write('CAP', self.nickname or '*', 'LS', 'sasl')
         elif params[0].upper() == 'REQ':
             reqs = params[1].split()
             if 'sasl' in reqs:
-                self.write('CAP', self.nickname or '*', 'ACK', ':sasl')
+                self.write('CAP', self.nickname or '*', 'ACK', 'sasl')
 
     async def handle_AUTHENTICATE(self, *params, prefix=None):
         if params[0] == 'PLAIN':
@@ -136,7 +220,9 @@ class IRCSession (asyncio.Protocol, Session):
     async def handle_NICK(self, *params, prefix=None):
         if not params or params[0] == self.nickname:
             return
-        if self.server.get(nickname=params[0], authenticated=True):
+        if not valid_nickname(params[0]):
+            self.write(ERR.ERRONEUSNICKNAME, self.nickname or '*', params[0], 'Erroneous nickname')
+        elif not await self.server.nickname_available(self, params[0]):
             self.write(ERR.NICKNAMEINUSE, '*', 'Nickname is already in use.')
         else:
             self.nickname = params[0]
@@ -158,8 +244,8 @@ class IRCSession (asyncio.Protocol, Session):
             self.write(RPL.NOTOPIC, self.nickname, channel.irc_name)
         # Channels: = for public, * for private, @ for secret
         # Users: @ for ops, + for voiced
-        self.write(RPL.NAMREPLY, self.nickname, '=', channel.irc_name, ' '.join(
-            s.nickname for s in channel.sessions if s.authenticated))
+        names = (session.nickname for session in channel.authenticated_sessions)
+        self.outbox.write(format_list(RPL.NAMREPLY, self.nickname, '=', channel.irc_name, items=names))
         self.write(RPL.ENDOFNAMES, self.nickname, channel.irc_name, 'End of NAMES list')
 
     async def handle_PRIVMSG(self, *params, prefix=None):
@@ -188,4 +274,8 @@ class IRCSession (asyncio.Protocol, Session):
 
     async def handle_QUIT(self, *params, prefix=None):
         self.write('ERROR', 'Bye for now!')
-        self.transport.close()
+        self.outbox.shutdown()
+
+
+# Handlers by command name, looked up once rather than by name for every message.
+IRCSession.commands = command_table(IRCSession)
@@ -0,0 +1,123 @@
+import collections
+
+
+# Longest message (without its line ending) and longest tags section (including the leading @ and trailing space).
+MAX_MESSAGE_LENGTH = 510
+MAX_TAGS_LENGTH = 8191
+
+IRCMessage = collections.namedtuple('IRCMessage', 'tags prefix command params')
+
+tag_escapes = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+
+
+class LineBuffer:
+    """
+    Accumulates a stream of IRC lines, ending in \r\n or a bare \n, and splits them off as they're completed. Only
+    bytes received since the last call are searched for line endings, so a line trickling in costs nothing extra. Lines
+    longer than IRC allows (512 bytes with the line ending, plus up to 8191 bytes of IRCv3 tags) are discarded without
+    being buffered, and None is returned in their place.
+    """
+
+    def __init__(self, max_length=MAX_MESSAGE_LENGTH, max_tags_length=MAX_TAGS_LENGTH):
+        self.max_length = max_length
+        self.max_tags_length = max_tags_length
+        self.buffer = bytearray()
+        # Set while skipping the rest of a line that was already too long.
+        self.discarding = False
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def feed(self, data: bytes):
+        """ Returns the lines completed by data (without their line endings), with None for any that were too long. """
+        buffer = self.buffer
+        search = len(buffer)
+        buffer += data
+        end = buffer.rfind(b'\n', search)
+        lines = []
+        if end >= 0:
+            with memoryview(buffer) as view:
+                lines = view[:end + 1].tobytes().replace(b'\r\n', b'\n').split(b'\n')
+            del buffer[:end + 1]
+            # Splitting after the last line ending leaves an empty string at the end.
+            lines.pop()
+            if self.discarding:
+                # The end of a line that was already too long (and reported as such).
+                del lines[0]
+                self.discarding = False
+            if lines and max(map(len, lines)) > self.max_length:
+                lines = [line if self.fits(line) else None for line in lines]
+        if self.discarding:
+            buffer.clear()
+        elif len(buffer) > self.max_length + self.max_tags_length + 1:
+            # Whatever the rest of this line turns out to be, it's too long.
+            buffer.clear()
+            self.discarding = True
+            lines.append(None)
+        return lines
+
+    def fits(self, line: bytes):
+        if line[:1] == b'@':
+            tags = line.find(b' ') + 1 or len(line)
+            return tags <= self.max_tags_length and len(line) - tags <= self.max_length
+        return len(line) <= self.max_length
+
+
+def unescape_tag(value):
+    if '\\' not in value:
+        return value
+    unescaped = []
+    chars = iter(value)
+    for char in chars:
+        if char == '\\':
+            # An unknown escape is the character itself, and a trailing backslash is dropped.
+            escaped = next(chars, '')
+            unescaped.append(tag_escapes.get(escaped, escaped))
+        else:
+            unescaped.append(char)
+    return ''.join(unescaped)
+
+
+def parse_tags(text):
+    tags = {}
+    for tag in text.split(';'):
+        if tag:
+            key, _, value = tag.partition('=')
+            tags[key] = unescape_tag(value)
+    return tags
+
+
+def parse_message(line):
+    """
+    Parses an IRC message (RFC 1459, with IRCv3 message tags) from a line of text, returning an IRCMessage with the
+    command upper-cased, or None if the line has no command. A parameter starting with : takes the rest of the line,
+    spaces and all.
+    """
+    tags = {}
+    prefix = None
+    if line[:1] == '@':
+        text, _, line = line.partition(' ')
+        tags = parse_tags(text[1:])
+        line = line.lstrip(' ')
+    if line[:1] == ':':
+        prefix, _, line = line.partition(' ')
+        prefix = prefix[1:]
+    middle, separator, trailing = line.partition(' :')
+    params = middle.split(' ')
+    if '' in params:
+        params = [param for param in params if param]
+    if not params:
+        return None
+    if separator:
+        params.append(trailing)
+    # Skips the namedtuple's own __new__, which costs about as much again as the rest of the parsing.
+    return tuple.__new__(IRCMessage, (tags, prefix, params[0].upper(), params[1:]))
+
+
+def command_table(cls, prefix='handle_'):
+    """
+    Maps each command name to the method of cls handling it, for the methods named prefix + the command, including any
+    cls inherits (or overrides).
+    """
+    methods = {name[len(prefix):]: getattr(cls, name) for name in dir(cls) if name.startswith(prefix)}
+    return {command: method for command, method in methods.items() if callable(method)}
@@ -1,10 +1,10 @@
 import dorm
 
+from .cache import AsyncCache
+from .crypto import run_crypto, verify_password
 from .protocol.types import KeyPair, PasswordSpec
 
 import base64
-import hashlib
-import hmac
 
 
 def safe_b64encode(b):
@@ -20,6 +20,7 @@ KeyPairColumn = dorm.Column("text", to_sql=KeyPair.to_sql, to_python=KeyPair.to_
 
 
 class Account (dorm.AsyncTable):
+    __table__ = 'account'
     columns = {
         'username': dorm.String(unique=True, to_sql=dorm.lower),
         'email': dorm.Email(unique=True),
@@ -32,8 +33,78 @@ class Account (dorm.AsyncTable):
         'verified': dorm.Boolean(default=0),
     }
 
+    # When set (see use_database), queries go through this neolith.database.Database pool instead of dorm's single
+    # shared connection.
+    database = None
+    # When set (a neolith.cluster.Cluster), told the key of every saved account, so other nodes can drop it from their
+    # account caches.
+    observer = None
+
+    @classmethod
+    async def fetch(cls, sql, params=None):
+        if cls.database is None:
+            return await super().fetch(sql, params)
+        return await cls.database.fetch(sql, params)
+
+    @classmethod
+    async def execute(cls, sql, params=None):
+        if cls.database is None:
+            return await super().execute(sql, params)
+        return await cls.database.execute(sql, params)
+
     def check_password(self, password):
-        salted_password = self.password_spec.generate(password)
-        client_key = hmac.new(salted_password, b'Client Key', 'sha256').digest()
-        stored_key = hashlib.sha256(client_key).digest()
-        return stored_key == self.stored_key
+        return verify_password(self.password_spec, self.stored_key, password)
+
+    async def verify_password(self, password):
+        """ Like check_password, but runs the (deliberately slow) hashing on the crypto executor. """
+        return await run_crypto(verify_password, self.password_spec, self.stored_key, password)
+
+    async def save(self, force_insert=False):
+        # Account.insert also goes through here.
+        account = await super().save(force_insert=force_insert)
+        key = dorm.lower(self.username)
+        accounts.invalidate(key)
+        if self.observer is not None:
+            self.observer.account_saved(key)
+        return account
+
+
+# The hot account queries, built once so every execution hits the connection's prepared statement cache.
+ACCOUNT_BY_USERNAME = Account.query(username='').limit(1).to_sql()[0]
+ACCOUNTS_BY_EMAIL = Account.query(email='').to_sql(selects=['count(*)'])[0]
+
+
+def use_database(database):
+    """ Routes Account queries through database (a neolith.database.Database), or back to dorm if None. """
+    Account.database = database
+    accounts.invalidate()
+
+
+async def load_account(username):
+    rows = await Account.fetch(ACCOUNT_BY_USERNAME, [dorm.lower(username)])
+    return Account.from_db(rows[0]) if rows else None
+
+
+async def email_in_use(email):
+    rows = await Account.fetch(ACCOUNTS_BY_EMAIL, [dorm.lower(email)])
+    return rows[0][0] > 0
+
+
+# Accounts by (lowercased) username, including negative entries for usernames that don't exist. Saving an Account
+# invalidates its entry (on every node of a cluster), but bulk Account.query(...).update(...) calls bypass the cache
+# and should invalidate it.
+accounts = AsyncCache(load_account)
+
+
+def configure_account_cache(ttl=300.0, negative_ttl=30.0, max_size=10000):
+    accounts.ttl = ttl
+    accounts.negative_ttl = negative_ttl
+    accounts.max_size = max_size
+    accounts.invalidate()
+
+
+async def get_account(username):
+    """ Returns the Account for username (ignoring case) or None, from the account cache where possible. """
+    if not username:
+        return None
+    return await accounts.get(dorm.lower(username))
@@ -0,0 +1,155 @@
+import asyncio
+import collections
+
+
+class Outbox:
+    """
+    Bounded outbound queue in front of an asyncio transport. Writes go straight to the transport until it asks the
+    protocol to pause writing, then they are queued (up to limit bytes) and flushed once it resumes. When the limit is
+    hit, the policy decides what happens:
+
+        * drop - the oldest droppable (notification) frames are discarded to make room.
+        * coalesce - a newer frame replaces any queued frame with the same coalesce key, then behaves like drop.
+        * disconnect - the slow consumer is disconnected.
+
+    If dropping is not enough to get back under the limit (i.e. the queue is all responses), the session is
+    disconnected regardless of policy.
+
+    With batch set, writes are always queued, and everything queued during one iteration of the event loop is handed
+    to the transport together (with a single writelines call) at the start of the next. A burst of frames for one
+    session, such as a busy channel's chat or the notifications following a login, then costs one send instead of one
+    per frame.
+    """
+
+    policies = ('drop', 'coalesce', 'disconnect')
+
+    def __init__(self, transport, limit=1048576, policy='drop', batch=False):
+        self.check_policy(policy)
+        self.transport = transport
+        self.limit = limit
+        self.policy = policy
+        self.batch = batch
+        self.flush_handle = None
+        self.queue = collections.deque()
+        self.size = 0
+        self.paused = False
+        self.closed = False
+        self.dropped = 0
+        self.coalesced = 0
+
+    @classmethod
+    def check_policy(cls, policy):
+        """ Raises ValueError unless policy is one of the known overflow policies. """
+        if policy not in cls.policies:
+            raise ValueError('Unknown outbox policy "{}", must be one of: {}'.format(policy, ', '.join(cls.policies)))
+
+    def __len__(self):
+        return len(self.queue)
+
+    @property
+    def depth(self):
+        return len(self.queue)
+
+    def stats(self):
+        return {
+            'depth': len(self.queue),
+            'bytes': self.size,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'paused': self.paused,
+        }
+
+    def write(self, data: bytes, droppable=False, key=None):
+        """ Writes (or queues) data, returning False if the session has been disconnected for falling behind. """
+        if self.closed:
+            return False
+        if not self.paused and not self.queue and not self.batch:
+            self.transport.write(data)
+            return True
+        if key is not None and self.policy == 'coalesce':
+            self.coalesce(key)
+        self.queue.append((data, droppable, key))
+        self.size += len(data)
+        if self.batch and not self.paused:
+            # A batch for a transport that's keeping up goes out whole, however big it is.
+            if self.flush_handle is None:
+                self.flush_handle = asyncio.get_event_loop().call_soon(self.flush)
+        elif self.size > self.limit:
+            self.overflow()
+        return not self.closed
+
+    def coalesce(self, key):
+        kept = collections.deque()
+        for entry in self.queue:
+            if entry[2] == key:
+                self.size -= len(entry[0])
+                self.coalesced += 1
+            else:
+                kept.append(entry)
+        self.queue = kept
+
+    def overflow(self):
+        if self.policy != 'disconnect':
+            kept = collections.deque()
+            for entry in self.queue:
+                if entry[1] and self.size > self.limit:
+                    self.size -= len(entry[0])
+                    self.dropped += 1
+                else:
+                    kept.append(entry)
+            self.queue = kept
+        if self.size > self.limit:
+            self.close()
+
+    def close(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.closed = True
+        self.dropped += len(self.queue)
+        self.queue.clear()
+        self.size = 0
+        self.transport.abort()
+
+    def shutdown(self):
+        """
+        Hands everything queued to the transport right away, whether or not it's paused or waiting for the next batch,
+        then closes the transport (which finishes writing it before disconnecting). For sessions that write a final
+        message and hang up, which close() would throw away.
+        """
+        if self.closed:
+            return
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.queue:
+            self.transport.writelines([entry[0] for entry in self.queue])
+            self.queue.clear()
+            self.size = 0
+        self.closed = True
+        self.transport.close()
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self.flush()
+
+    def flush(self):
+        self.flush_handle = None
+        if self.batch:
+            if self.queue and not self.paused and not self.closed:
+                data = [entry[0] for entry in self.queue]
+                self.queue.clear()
+                self.size = 0
+                if len(data) == 1:
+                    self.transport.write(data[0])
+                else:
+                    self.transport.writelines(data)
+            return
+        # Writing may pause us again (synchronously) if the transport's buffer fills back up.
+        while self.queue and not self.paused and not self.closed:
+            data, droppable, key = self.queue.popleft()
+            self.size -= len(data)
+            self.transport.write(data)
@@ -3,6 +3,8 @@
 from .auth import *
 from .base import *
 from .chat import *
+from .codec import *
+from .delivery import *
 from .messages import *
 from .types import *
 from .user import *
@@ -1,13 +1,37 @@
-from .base import Action, Binary, Object, ProtocolError, Request, Response, String, packet
+from ..crypto import ExecutorBusy, run_crypto, verify_proof
+from .base import Action, Binary, List, Object, ProtocolError, Request, Response, String, packet
 from .types import KeyPair, PasswordSpec
 
-import hashlib
-import hmac
 import os
 
 
-def xor(b1, b2):
-    return bytes([a ^ b for a, b in zip(b1, b2)])
+@packet('codec', requires_auth=False)
+class NegotiateCodec (Request):
+    codecs = List(str, doc='Wire codecs the client supports, most preferred first.', required=True)
+    compression = List(str, doc='Frame compression the client supports, most preferred first.')
+
+    async def handle(self, server, session):
+        if session.authenticated:
+            raise ProtocolError('The wire codec must be chosen before logging in.')
+        for name in self.codecs:
+            if name in session.wire_codecs:
+                compression = None
+                for compressor in self.compression or ():
+                    if compressor in session.wire_compressors:
+                        compression = compressor
+                        break
+                # The response still goes out in the current codec, everything after it in the new one.
+                session.pending_codec = name
+                session.pending_compression = compression
+                return CodecSelected(codec=name, compression=compression)
+        raise ProtocolError('None of the requested codecs are supported.')
+
+
+@packet('codec.response')
+class CodecSelected (Response):
+    codec = String(doc='The codec used for everything sent (in either direction) after this response.', required=True)
+    compression = String(
+        doc='Compression for frames (flagged in their headers) sent in either direction after this response, if any.')
 
 
 @packet('challenge', requires_auth=False)
@@ -17,8 +41,8 @@ class LoginChallenge (Request):
 
     async def handle(self, server, session):
         # Account imports neolith.protocol.types
-        from ..models import Account
-        account = await Account.query(username=self.username).get()
+        from ..models import get_account
+        account = await get_account(self.username)
         # TODO: send deterministic challenge for unknown users.
         if account is None:
             raise ProtocolError('Unknown user.')
@@ -51,11 +75,12 @@ class LoginRequest (Request):
     async def handle(self, server, session):
         if session.account is None:
             raise ProtocolError('Login failed.')
-        server_signature = hmac.new(session.account.server_key, self.nonce, 'sha256').digest()
-        client_signature = hmac.new(session.account.stored_key, self.nonce, 'sha256').digest()
-        client_key = xor(client_signature, self.proof)
-        stored_key = hashlib.sha256(client_key).digest()
-        if session.account.stored_key != stored_key:
+        try:
+            server_signature = await run_crypto(
+                verify_proof, session.account.stored_key, session.account.server_key, self.nonce, self.proof)
+        except ExecutorBusy:
+            raise ProtocolError('The server is busy, please try again.')
+        if server_signature is None:
             raise ProtocolError('Login failed.')
         session.nickname = self.nickname
         if session.account.x25519:
@@ -1,10 +1,16 @@
 import base64
 import json
 import re
+import types
 
 
 registered_packets = {}
 
+# Whether Packet and Transaction serialization should use the generated codecs (see neolith.protocol.codec).
+codecs_enabled = False
+# Whether Transactions decode packet fields when they're first accessed rather than up front.
+lazy_decoding = False
+
 
 class ProtocolError (Exception):
     pass
@@ -12,6 +18,8 @@ class ProtocolError (Exception):
 
 class DataType:
     python_type = None
+    # The member descriptor holding this field's value, if the Container declaring it has slots (see ContainerMeta).
+    slot = None
 
     def __init__(self, doc="", default=None, required=False, readonly=False):
         self.doc = doc
@@ -22,21 +30,49 @@ class DataType:
     def __get__(self, instance, owner):
         if not instance:
             return self
-        if self.name not in instance.__dict__:
+        try:
+            return instance.__dict__[self.name] if self.slot is None else getattr(instance, self.slot_attr)
+        except (KeyError, AttributeError):
+            pass
+        lazy = getattr(instance, '_raw', None)
+        if lazy is not None and not self.readonly:
+            data, binary = lazy
+            try:
+                value = self.unpack(data.get(self.name), binary, lazy=True)
+                self.__set__(instance, value)
+            except (AttributeError, TypeError, ValueError) as e:
+                # Decoded up front, a badly typed field would have been rejected with the rest of the request. Decoded
+                # here, it's rejected by whoever handles the request, which only expects ProtocolErrors.
+                raise ProtocolError(str(e)) from None
+            return value
+        else:
             value = self.get_default()
             if self.readonly:
                 return value
-            # Set the default value the first time it's accessed, so it's not changing on every access.
-            self.__set__(instance, value)
-        return instance.__dict__[self.name]
+        # Set the value the first time it's accessed, so it's not changing (or being unpacked again) on every access.
+        self.__set__(instance, value)
+        return value
 
     def __set__(self, instance, value):
         if self.readonly:
             raise AttributeError('{}.{} is immutable'.format(instance.__class__.__name__, self.name))
-        instance.__dict__[self.name] = self.check_value(instance, value)
+        value = self.check_value(instance, value)
+        if self.slot is None:
+            instance.__dict__[self.name] = value
+        else:
+            self.slot.__set__(instance, value)
+        if instance.cache_prepared:
+            object.__setattr__(instance, '_version', getattr(instance, '_version', 0) + 1)
 
     def __set_name__(self, owner, name):
         self.name = name
+        self.slot_attr = slot_name(name)
+
+    def is_set(self, instance):
+        """ Whether a value is stored for this field on instance (defaults and lazy values are, once accessed). """
+        if self.slot is None:
+            return self.name in getattr(instance, '__dict__', ())
+        return hasattr(instance, self.slot_attr)
 
     def get_default(self):
         return self.default() if callable(self.default) else self.default
@@ -47,12 +83,20 @@ class DataType:
         raise AttributeError('{}.{} must be of type {} (got {})'.format(
             instance.__class__.__name__, self.name, self.python_type.__name__, value.__class__.__name__))
 
-    def prepare(self, value):
+    def prepare(self, value, binary=False):
         return self.get_default() if value is None else value
 
-    def unpack(self, value):
+    def unpack(self, value, binary=False, lazy=False):
         return self.get_default() if value is None else value
 
+    def passthrough(self, value, binary=False):
+        """ Returns a still-encoded value if it can be sent on as-is in the same wire format, otherwise None. """
+        return None
+
+    def is_encoded(self, value, binary=False):
+        """ Whether a value passthrough would send on is what unpack expects, so sending it on is safe. """
+        return True
+
     def describe(self):
         default = self.default
         if callable(default):
@@ -82,12 +126,27 @@ class Boolean (DataType):
 
 class Binary (DataType):
     python_type = bytes
+    # Strict (padded, and nothing but the base64 alphabet) base64, which b64decode would otherwise be lenient about.
+    base64_pattern = re.compile(r'(?:[A-Za-z0-9+/]{4})*(?:[A-Za-z0-9+/]{2}==|[A-Za-z0-9+/]{3}=)?')
 
-    def prepare(self, value):
-        return base64.b64encode(value).decode('ascii') if value is not None else None
+    def prepare(self, value, binary=False):
+        # Binary wire formats carry bytes as-is, text ones (JSON) get them base64-encoded.
+        if value is None or binary:
+            return value
+        return base64.b64encode(value).decode('ascii')
+
+    def unpack(self, value, binary=False, lazy=False):
+        if value is None or binary:
+            return value
+        return base64.b64decode(value)
+
+    def passthrough(self, value, binary=False):
+        return value if isinstance(value, bytes if binary else str) else None
 
-    def unpack(self, value):
-        return base64.b64decode(value) if value is not None else None
+    def is_encoded(self, value, binary=False):
+        if binary:
+            return isinstance(value, bytes)
+        return isinstance(value, str) and self.base64_pattern.fullmatch(value) is not None
 
 
 class Object (DataType):
@@ -99,11 +158,11 @@ class Object (DataType):
         self.python_type = item_type
         super().__init__(**kwargs)
 
-    def prepare(self, value):
-        return value.prepare() if value is not None else None
+    def prepare(self, value, binary=False):
+        return value.prepare(binary) if value is not None else None
 
-    def unpack(self, value):
-        return self.python_type.unpack(value) if value is not None else None
+    def unpack(self, value, binary=False, lazy=False):
+        return self.python_type.unpack(value, binary, lazy) if value is not None else None
 
 
 class Dictionary (DataType):
@@ -123,20 +182,20 @@ class Dictionary (DataType):
                         instance.__class__.__name__, self.name, self.item_type.__name__))
         return super().check_value(instance, value)
 
-    def prepare(self, value):
+    def prepare(self, value, binary=False):
         prepared = {}
         if value is None:
             return prepared
         for key, item in value.items():
             if isinstance(item, self.item_type):
-                prepared[key] = item.prepare() if isinstance(item, Container) else item
+                prepared[key] = item.prepare(binary) if isinstance(item, Container) else item
         return prepared
 
-    def unpack(self, value):
+    def unpack(self, value, binary=False, lazy=False):
         if value is None:
             return {}
         if issubclass(self.item_type, Container):
-            return {key: self.item_type.unpack(item) for key, item in value.items()}
+            return {key: self.item_type.unpack(item, binary, lazy) for key, item in value.items()}
         else:
             return {key: self.item_type(item) for key, item in value.items()}
 
@@ -163,20 +222,20 @@ class List (DataType):
                         instance.__class__.__name__, self.name, self.item_type.__name__))
         return super().check_value(instance, value)
 
-    def prepare(self, value):
+    def prepare(self, value, binary=False):
         prepared = []
         if value is None:
             return prepared
         for item in value:
             if isinstance(item, self.item_type):
-                prepared.append(item.prepare() if isinstance(item, Container) else item)
+                prepared.append(item.prepare(binary) if isinstance(item, Container) else item)
         return prepared
 
-    def unpack(self, value):
+    def unpack(self, value, binary=False, lazy=False):
         if value is None:
             return []
         if issubclass(self.item_type, Container):
-            return [self.item_type.unpack(item) for item in value]
+            return [self.item_type.unpack(item, binary, lazy) for item in value]
         else:
             return [self.item_type(item) for item in value]
 
@@ -186,55 +245,179 @@ class List (DataType):
         return description
 
 
-class Container:
+class Prepared (dict):
+    """
+    A cached Container.prepare result (see Container.cache_prepared), stamped with the version of the instance it was
+    prepared from. Wire formats may keep their encodings of it in encodings, which go away along with it.
+    """
+
+    __slots__ = ('version', 'encodings')
+
+    def __init__(self, data, version):
+        super().__init__(data)
+        self.version = version
+        self.encodings = {}
+
+
+def slot_name(field_name):
+    return '_slot_' + field_name
+
+
+# Per-instance bookkeeping (see Container.unpack and Container.prepare_cached), with the value each starts out as.
+bookkeeping = (('_raw', None), ('_version', 0), ('_prepared', None), ('_prepared_binary', None))
+
+
+class ContainerMeta (type):
+    """
+    Gives Containers declared with slots=True (which subclasses inherit, unless they pass slots=False) __slots__ for
+    their fields instead of a per-instance __dict__. Each field's value lives in a slot named by slot_name, and the
+    DataType descriptor stays on the class, reading and writing that slot (see DataType.slot) so defaults, type checks
+    and readonly fields behave exactly as before. Anything in the class body's own __slots__ is kept, so a class whose
+    instances also need arbitrary attributes can list '__dict__' there.
+    """
+
+    def __new__(mcls, name, bases, namespace, slots=None, **kwargs):
+        inherited = any(getattr(base, '_slotted', False) for base in bases)
+        if slots is None:
+            slots = inherited
+        if not slots:
+            if inherited:
+                namespace['_slotted'] = False
+            return super().__new__(mcls, name, bases, namespace, **kwargs)
+        fields = [key for key, value in namespace.items() if isinstance(value, DataType) and not value.readonly]
+        names = list(namespace.get('__slots__', ())) + [slot_name(key) for key in fields]
+        if '__dict__' not in names and not any(base.__dictoffset__ for base in bases):
+            # With no __dict__ to keep it in, bookkeeping needs slots too.
+            cache_prepared = namespace.get('cache_prepared', any(getattr(b, 'cache_prepared', False) for b in bases))
+            for key, default in bookkeeping if cache_prepared else bookkeeping[:1]:
+                if not any(isinstance(getattr(base, key, None), types.MemberDescriptorType) for base in bases):
+                    names.append(key)
+        namespace['__slots__'] = tuple(names)
+        namespace['_slotted'] = True
+        cls = super().__new__(mcls, name, bases, namespace, **kwargs)
+        for key in fields:
+            namespace[key].slot = cls.__dict__[slot_name(key)]
+        # Unlike class attributes, slots have no value until one is set, so __init__ sets the bookkeeping ones.
+        lines = ['    self.{} = {!r}'.format(key, default) for key, default in bookkeeping
+            if isinstance(getattr(cls, key, None), types.MemberDescriptorType)]
+        if lines:
+            code = {}
+            exec('def _init_slots(self):\n' + '\n'.join(lines), code)
+            cls._init_slots = code['_init_slots']
+        return cls
+
+
+class Container (metaclass=ContainerMeta):
+    __slots__ = ()
+    # Set on classes declared with slots=True (see ContainerMeta).
+    _slotted = False
+    # Overridden per instance by unpack and prepare_cached (in slots, for Containers without a __dict__).
+    _raw = None
+    _version = 0
+    _prepared = None
+    _prepared_binary = None
+    # Whether instances keep their prepared dicts until a field is next set. Only for classes that are prepared often
+    # and whose field values are never modified in place (setting a field is the only way to invalidate the cache).
+    cache_prepared = False
+    # Ordered tuple of (name, field, required, readonly) for every DataType declared on the class or its bases, with
+    # subclass declarations taking precedence. Built once per class in __init_subclass__.
+    _schema = ()
+    # (name, field) for the fields in _schema that a lazily unpacked instance may send on still encoded (see
+    # DataType.passthrough).
+    _passthrough = ()
+    # Generated Codec for this exact class, set by codec.get_codec (never inherited, see __init_subclass__).
+    _codec = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._codec = None
+        schema = []
+        seen = set()
+        for klass in cls.mro():
+            for name, field in vars(klass).items():
+                if isinstance(field, DataType) and name not in seen:
+                    schema.append((name, field, field.required, field.readonly))
+                    seen.add(name)
+        cls._schema = tuple(schema)
+        cls._passthrough = tuple((name, field) for name, field, required, readonly in schema
+            if not readonly and type(field).passthrough is not DataType.passthrough)
 
     def __init__(self, **kwargs):
+        self._init_slots()
         for field, value in kwargs.items():
             setattr(self, field, value)
 
+    def _init_slots(self):
+        pass
+
     def __str__(self):
         fields = []
-        seen = set()
-        for klass in self.__class__.mro():
-            for name, field in vars(klass).items():
-                if isinstance(field, DataType) and name not in seen:
-                    value = getattr(self, name)
-                    if isinstance(value, bytes):
-                        value = '[{} bytes]'.format(len(value))
-                    fields.append('{}={}'.format(name, value))
-                    seen.add(name)
+        for name, field, required, readonly in self._schema:
+            value = getattr(self, name)
+            if isinstance(value, bytes):
+                value = '[{} bytes]'.format(len(value))
+            fields.append('{}={}'.format(name, value))
         return '<{} {}>'.format(self.__class__.__name__, ', '.join(fields))
 
-    def prepare(self):
+    def prepare(self, binary=False):
+        """ Returns the fields as a dict, with Binary values left as bytes if binary is set (base64 otherwise). """
+        if self.cache_prepared:
+            return self.prepare_cached(Container.prepare_fields, binary)
+        return self.prepare_fields(binary)
+
+    def prepare_cached(self, prepare, binary=False):
+        """ Returns prepare(self, binary) as a Prepared dict, reusing the last one if no field has been set since. """
+        key = '_prepared_binary' if binary else '_prepared'
+        prepared = getattr(self, key, None)
+        if prepared is not None and prepared.version == getattr(self, '_version', 0):
+            return prepared
+        data = prepare(self, binary)
+        # Stamped afterwards, since preparing may itself set fields (defaults, or lazily unpacked values).
+        prepared = Prepared(data, getattr(self, '_version', 0))
+        object.__setattr__(self, key, prepared)
+        return prepared
+
+    def prepare_fields(self, binary=False):
         data = {}
-        for klass in self.__class__.mro():
-            for name, field in vars(klass).items():
-                if isinstance(field, DataType) and name not in data:
-                    value = getattr(self, name)
-                    if value is None and field.required:
-                        raise ProtocolError('{}.{} is required to have a value'.format(self.__class__.__name__, name))
-                    data[name] = field.prepare(value)
+        lazy = getattr(self, '_raw', None)
+        for name, field, required, readonly in self._schema:
+            if lazy is not None and lazy[1] == binary and not readonly and not field.is_set(self):
+                # Fields of a lazily unpacked instance that were never accessed may not need decoding at all.
+                value = field.passthrough(lazy[0].get(name), binary)
+                if value is not None:
+                    data[name] = value
+                    continue
+            value = getattr(self, name)
+            if value is None and required:
+                raise ProtocolError('{}.{} is required to have a value'.format(self.__class__.__name__, name))
+            data[name] = field.prepare(value, binary)
         return data
 
     @classmethod
-    def unpack(cls, data: dict):
+    def unpack(cls, data: dict, binary=False, lazy=False):
+        """
+        Builds an instance from prepared data. If lazy is set, the data is kept as-is and each field is only unpacked
+        (and checked) the first time it's accessed.
+        """
         instance = cls()
-        seen = set()
-        for klass in cls.mro():
-            for name, field in vars(klass).items():
-                if isinstance(field, DataType):
-                    if name not in seen and not field.readonly:
-                        setattr(instance, name, field.unpack(data.get(name)))
-                    seen.add(name)
+        if lazy:
+            object.__setattr__(instance, '_raw', (data, binary))
+            # Fields that may be sent on without ever being unpacked are checked now, as unpacking would have.
+            for name, field in cls._passthrough:
+                value = data.get(name)
+                if value is not None and not field.is_encoded(value, binary):
+                    raise ProtocolError('{}.{} is not validly encoded'.format(cls.__name__, name))
+            return instance
+        for name, field, required, readonly in cls._schema:
+            if not readonly:
+                setattr(instance, name, field.unpack(data.get(name), binary))
         return instance
 
     @classmethod
     def describe(cls):
         description = {}
-        for klass in cls.mro():
-            for name, field in vars(klass).items():
-                if isinstance(field, DataType):
-                    description.update(field.describe())
+        for name, field, required, readonly in cls._schema:
+            description.update(field.describe())
         return description
 
     @classmethod
@@ -252,16 +435,75 @@ class Container:
 
 
 class Sendable:
+    __slots__ = ()
+    # Whether this may be dropped, rather than delivered late, to a session that can't keep up.
+    droppable = False
 
-    def to_dict(self):
+    def to_dict(self, binary=False):
         raise NotImplementedError()
 
+    def coalesce_key(self):
+        """ Undelivered Sendables with the same (non-None) key are superseded by newer ones for slow sessions. """
+        return None
+
+    def encode(self, wire_format):
+        """ Returns this Sendable encoded by wire_format, a callable taking a Sendable. """
+        return wire_format(self)
+
+
+class Broadcast (Sendable):
+    """
+    Wraps a Sendable that is being delivered to many sessions, so it's only serialized once per wire format no matter
+    how many transports it's handed to. Anything else is passed through to the wrapped Sendable.
+    """
+
+    def __init__(self, data: Sendable):
+        self.data = data
+        self.encodings = {}
+        self.prepared = {}
+
+    def __getattr__(self, name):
+        return getattr(self.data, name)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    @property
+    def droppable(self):
+        return self.data.droppable
+
+    def coalesce_key(self):
+        return self.data.coalesce_key()
+
+    def to_dict(self, binary=False):
+        try:
+            return self.prepared[binary]
+        except KeyError:
+            prepared = self.prepared[binary] = self.data.to_dict(binary)
+            return prepared
+
+    def encode(self, wire_format):
+        try:
+            return self.encodings[wire_format]
+        except KeyError:
+            encoded = self.encodings[wire_format] = wire_format(self)
+            return encoded
+
+    @classmethod
+    def wrap(cls, data: Sendable):
+        return data if isinstance(data, cls) else cls(data)
+
 
 class Packet (Container, Sendable):
+    # No __dict__ here or in the base packet classes below, so packets declared with slots=True (see ContainerMeta)
+    # don't get one either. Other packets get a __dict__ as usual.
+    __slots__ = ()
     ident = None
 
-    def to_dict(self) -> dict:
-        return {self.ident: [self.prepare()]}
+    def to_dict(self, binary=False) -> dict:
+        if codecs_enabled and self._codec:
+            return {self.ident: [self._codec.encode(self, binary)]}
+        return {self.ident: [self.prepare(binary)]}
 
     @classmethod
     def find(cls, ident: str):
@@ -276,7 +518,9 @@ class Transaction (Sendable):
     txid = None
     error = None
 
-    def __init__(self, data=None, txid=None, packets=None):
+    def __init__(self, data=None, txid=None, packets=None, binary=False, lazy=None):
+        if lazy is None:
+            lazy = lazy_decoding
         self.txid = txid
         self.packets = packets or []
         if isinstance(data, dict):
@@ -286,8 +530,16 @@ class Transaction (Sendable):
                 elif ident in registered_packets:
                     if isinstance(payload, dict):
                         payload = [payload]
+                    packet_class = registered_packets[ident]
+                    if lazy:
+                        for fields in payload:
+                            self.packets.append(packet_class.unpack(fields, binary, lazy=True))
+                        continue
+                    unpack = packet_class.unpack
+                    if codecs_enabled and packet_class._codec:
+                        unpack = packet_class._codec.decode
                     for fields in payload:
-                        self.packets.append(registered_packets[ident].unpack(fields))
+                        self.packets.append(unpack(fields, binary))
 
     def __iter__(self):
         for p in self.packets:
@@ -310,14 +562,15 @@ class Transaction (Sendable):
                 return packet
         return None
 
-    def to_dict(self):
+    def to_dict(self, binary=False):
         data = {}
         if self.txid:
             data['txid'] = self.txid
         if self.error:
             data['error'] = str(self.error)
         for p in self.packets:
-            data.setdefault(p.ident, []).append(p.prepare())
+            prepared = p._codec.encode(p, binary) if codecs_enabled and p._codec else p.prepare(binary)
+            data.setdefault(p.ident, []).append(prepared)
         return data
 
 
@@ -333,16 +586,32 @@ def packet(ident, requires_auth=True):
         if issubclass(packet_class, ClientPacket):
             packet_class.requires_auth = requires_auth
         registered_packets[ident] = packet_class
+        # Packet modules import base, so the codec module can only be imported once a packet is being registered.
+        from .codec import get_codec
+        get_codec(packet_class)
         return packet_class
     return _decorator
 
 
+def use_codecs(enabled=True):
+    """ Turns the generated packet codecs on or off for Packet.to_dict, Transaction.to_dict and Transaction(). """
+    global codecs_enabled
+    codecs_enabled = enabled
+
+
+def use_lazy_decoding(enabled=True):
+    """ Sets whether Transaction() unpacks packets lazily (see Container.unpack) unless told otherwise. """
+    global lazy_decoding
+    lazy_decoding = enabled
+
+
 def snake(name):
     s1 = re.sub("(.)([A-Z][a-z]+)", r"\1_\2", name)
     return re.sub("([a-z0-9])([A-Z])", r"\1_\2", s1).lower()
 
 
 class ClientPacket (Packet):
+    __slots__ = ()
     requires_auth = True
 
     async def handle(self, server, session):
@@ -350,6 +619,7 @@ class ClientPacket (Packet):
 
 
 class ServerPacket (Packet):
+    __slots__ = ()
 
     def handle(self, client):
         methods = (
@@ -364,19 +634,20 @@ class ServerPacket (Packet):
 
 class Request (ClientPacket):
     """ A packet initiated by the client that expects a response. """
-    pass
+    __slots__ = ()
 
 
 class Action (ClientPacket):
     """ A packet sent by the client that does not expect a response. """
-    pass
+    __slots__ = ()
 
 
 class Response (ServerPacket):
     """ A packet sent by the server in response to a request. """
-    pass
+    __slots__ = ()
 
 
 class Notification (ServerPacket):
     """ A packet sent by the server not in response to a request. """
-    pass
+    __slots__ = ()
+    droppable = True
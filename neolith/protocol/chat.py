@@ -1,5 +1,6 @@
 from .base import (
     Action, Boolean, Dictionary, List, Notification, Object, ProtocolError, Request, Response, String, packet)
+from .delivery import deliver
 from .types import Channel, EncryptedMessage, Session
 
 
@@ -20,13 +21,14 @@ class PostChat (Action):
         if channel.encrypted:
             if set(self.encrypted) != set([s.ident for s in channel.authenticated_sessions]):
                 raise ProtocolError('You must encrypt chat for all members of the channel.')
-            for s in channel.authenticated_sessions:
-                await s.send(ChatPosted(
-                    channel=self.channel,
-                    encrypted=self.encrypted[s.ident],
-                    emote=self.emote,
-                    user=session
-                ))
+            # Every member gets their own ciphertext, so there is nothing to share between recipients here - each
+            # ChatPosted is sent (and serialized) individually rather than as a Broadcast.
+            await deliver((s, ChatPosted(
+                channel=self.channel,
+                encrypted=self.encrypted[s.ident],
+                emote=self.emote,
+                user=session
+            )) for s in channel.authenticated_sessions)
         else:
             await channel.send(ChatPosted(
                 channel=self.channel,
@@ -112,7 +114,7 @@ class ModifyChannel (Request):
 
 
 @packet('channel.posted')
-class ChatPosted (Notification):
+class ChatPosted (Notification, slots=True):
     channel = String(doc='The channel name this chat was posted to.', required=True)
     chat = String(doc='The posted chat, if the channel is not encrypted.')
     encrypted = Object(EncryptedMessage,
@@ -160,3 +162,6 @@ class ChannelLeave (Notification):
 @packet('channel.modified')
 class ChannelModified (Notification):
     channel = Object(Channel, doc='The channel that was modified.', required=True)
+
+    def coalesce_key(self):
+        return (self.ident, self.channel.name)
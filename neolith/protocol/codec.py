@@ -0,0 +1,176 @@
+from .base import Binary, Container, DataType, Dictionary, List, Object, ProtocolError, slot_name
+
+import base64
+import types
+
+
+class Codec:
+    """ Specialized encode/decode functions generated for a single Container class. """
+
+    def __init__(self, container_class, encode, decode, source=''):
+        self.container_class = container_class
+        self.encode = encode
+        self.decode = decode
+        self.source = source
+
+    def __repr__(self):
+        return '<Codec {}>'.format(self.container_class.__name__)
+
+
+def get_codec(container_class):
+    """ Returns the Codec for container_class, generating it the first time it's needed. """
+    codec = container_class._codec
+    if codec is None:
+        codec = container_class._codec = compile_codec(container_class)
+    return codec
+
+
+def cached_encoder(encode):
+    """ Wraps a generated encode function so it goes through Container.prepare_cached. """
+    def encode_cached(obj, binary=False):
+        return obj.prepare_cached(encode, binary)
+    return encode_cached
+
+
+def _is_plain(item_type):
+    # Items of a plain type can never be Containers, so List/Dictionary can pass them through untouched.
+    return not issubclass(item_type, Container) and not issubclass(Container, item_type)
+
+
+def _encode_expr(field, var, n, namespace):
+    kind = type(field)
+    if kind.prepare is DataType.prepare:
+        if field.default is None:
+            return 'v'
+        namespace[var] = field
+        return '({}.get_default() if v is None else v)'.format(var)
+    if kind.prepare is Binary.prepare:
+        return "(v if v is None or binary else _b64encode(v).decode('ascii'))"
+    if kind.prepare is Object.prepare:
+        return '(None if v is None else _get_codec(v.__class__).encode(v, binary))'
+    if kind.prepare in (Dictionary.prepare, List.prepare):
+        item = '_T{}'.format(n)
+        namespace[item] = field.item_type
+        if issubclass(field.item_type, Container):
+            value = '_get_codec(i.__class__).encode(i, binary)'
+        elif _is_plain(field.item_type):
+            value = 'i'
+        else:
+            namespace[var] = field
+            return '{}.prepare(v, binary)'.format(var)
+        if kind.prepare is Dictionary.prepare:
+            return '({{}} if v is None else {{k: {} for k, i in v.items() if isinstance(i, {})}})'.format(value, item)
+        return '([] if v is None else [{} for i in v if isinstance(i, {})])'.format(value, item)
+    namespace[var] = field
+    return '{}.prepare(v, binary)'.format(var)
+
+
+def _decode_lines(field, var, n, namespace):
+    kind = type(field)
+    if kind.unpack is DataType.unpack and kind.check_value is DataType.check_value:
+        item = '_T{}'.format(n)
+        namespace[item] = field.python_type
+        namespace[var] = field
+        lines = []
+        if field.default is not None:
+            lines.append('if v is None: v = {}.get_default()'.format(var))
+        lines.append('if v is not None and not isinstance(v, {}): {}.check_value(inst, v)'.format(item, var))
+        return lines
+    if kind.unpack is Binary.unpack and kind.check_value is DataType.check_value:
+        return ['if v is not None and not binary: v = _b64decode(v)']
+    if kind.unpack is Object.unpack and kind.check_value is DataType.check_value:
+        item = '_T{}'.format(n)
+        namespace[item] = field.python_type
+        return ['if v is not None: v = _get_codec({}).decode(v, binary)'.format(item)]
+    if kind.unpack in (Dictionary.unpack, List.unpack) and kind.check_value in (Dictionary.check_value,
+            List.check_value):
+        item = '_T{}'.format(n)
+        namespace[item] = field.item_type
+        if issubclass(field.item_type, Container):
+            value = '_get_codec({}).decode(i, binary)'.format(item)
+        else:
+            value = '{}(i)'.format(item)
+        if kind.unpack is Dictionary.unpack:
+            return ['v = {{}} if v is None else {{k: {} for k, i in v.items()}}'.format(value)]
+        return ['v = [] if v is None else [{} for i in v]'.format(value)]
+    namespace[var] = field
+    return ['v = {0}.check_value(inst, {0}.unpack(v, binary))'.format(var)]
+
+
+def compile_codec(container_class):
+    """
+    Generates a Codec for container_class whose encode/decode functions produce exactly what Container.prepare and
+    Container.unpack would, with the per-field DataType dispatch unrolled and nested Containers calling straight into
+    their own codecs.
+    """
+    namespace = {
+        '_cls': container_class,
+        '_missing': object(),
+        '_get_codec': get_codec,
+        '_b64encode': base64.b64encode,
+        '_b64decode': base64.b64decode,
+        '_prepare': Container.prepare,
+        '_ProtocolError': ProtocolError,
+    }
+    class_name = container_class.__name__
+    has_dict = container_class.__dictoffset__ != 0
+    # Lazily unpacked instances (see Container.unpack) go through Container.prepare, which knows how to handle them.
+    encode = ['def encode(obj, binary=False):']
+    if isinstance(getattr(container_class, '_raw', None), types.MemberDescriptorType):
+        encode.append("    if getattr(obj, '_raw', None) is not None: return _prepare(obj, binary)")
+    else:
+        encode.append("    if '_raw' in obj.__dict__: return _prepare(obj, binary)")
+    # Only fields declared without slots (see ContainerMeta) are read from, or written to, __dict__ directly.
+    if has_dict and any(field.slot is None and not readonly for name, field, required, readonly in
+            container_class._schema):
+        encode.append('    d = obj.__dict__')
+    else:
+        has_dict = False
+    decode = ['def decode(data, binary=False):', '    inst = _cls()']
+    if has_dict:
+        decode.append('    d = inst.__dict__')
+    keys = []
+    for n, (name, field, required, readonly) in enumerate(container_class._schema):
+        var = '_f{}'.format(n)
+        direct = type(field).__get__ is DataType.__get__ and type(field).__set__ is DataType.__set__
+        if direct and field.slot is not None:
+            encode.append('    try: v = obj.{}'.format(slot_name(name)))
+            encode.append('    except AttributeError: v = getattr(obj, {!r})'.format(name))
+        elif direct and has_dict and not readonly:
+            encode.append('    v = d.get({!r}, _missing)'.format(name))
+            encode.append('    if v is _missing: v = getattr(obj, {!r})'.format(name))
+        else:
+            encode.append('    v = getattr(obj, {!r})'.format(name))
+        if required:
+            message = '{}.{} is required to have a value'.format(class_name, name)
+            encode.append('    if v is None: raise _ProtocolError({!r})'.format(message))
+        encode.append('    e{} = {}'.format(n, _encode_expr(field, var, n, namespace)))
+        keys.append('{!r}: e{}'.format(name, n))
+        if not readonly:
+            decode.append('    v = data.get({!r})'.format(name))
+            if direct:
+                decode.extend('    ' + line for line in _decode_lines(field, var, n, namespace))
+                if field.slot is not None and container_class.__setattr__ is object.__setattr__:
+                    decode.append('    inst.{} = v'.format(slot_name(name)))
+                elif field.slot is not None:
+                    # Straight into the slot, bypassing the class's own __setattr__.
+                    namespace['_s{}'.format(n)] = field.slot
+                    decode.append('    _s{}.__set__(inst, v)'.format(n))
+                else:
+                    decode.append('    d[{!r}] = v'.format(name))
+            else:
+                namespace[var] = field
+                decode.append('    setattr(inst, {!r}, {}.unpack(v, binary))'.format(name, var))
+    encode.append('    return {{{}}}'.format(', '.join(keys)))
+    decode.append('    return inst')
+    source = '\n'.join(encode) + '\n\n\n' + '\n'.join(decode) + '\n'
+    exec(compile(source, '<codec {}>'.format(class_name), 'exec'), namespace)
+    encode_func, decode_func = namespace['encode'], namespace['decode']
+    # Classes that customize serialization themselves keep their own methods.
+    if container_class.prepare is not Container.prepare:
+        encode_func = container_class.prepare
+    elif container_class.cache_prepared:
+        encode_func = cached_encoder(encode_func)
+    if container_class.unpack.__func__ is not Container.unpack.__func__:
+        decode_func = container_class.unpack
+    return Codec(container_class, encode_func, decode_func, source=source)
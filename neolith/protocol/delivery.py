@@ -0,0 +1,133 @@
+from .base import Broadcast, Sendable
+
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for any one recipient before giving up on it (0 to wait forever), and the number of sends allowed
+# in flight at once. Set from neolith.settings by the server, see configure_fanout.
+fanout_timeout = 5.0
+fanout_concurrency = 256
+
+
+def configure_fanout(timeout=None, concurrency=None):
+    global fanout_timeout, fanout_concurrency, _semaphore
+    if timeout is not None:
+        fanout_timeout = timeout
+    if concurrency is not None:
+        fanout_concurrency = concurrency
+        _semaphore = None
+
+
+# The semaphore shared by every deliver call, and the event loop it was made for.
+_semaphore = None
+_semaphore_loop = None
+
+
+def _shared_semaphore():
+    global _semaphore, _semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _semaphore is None or _semaphore_loop is not loop:
+        _semaphore, _semaphore_loop = asyncio.Semaphore(fanout_concurrency), loop
+    return _semaphore
+
+
+class _Suspended:
+    """ Awaitable that finishes running a coroutine _start left suspended on `future`. """
+
+    __slots__ = ('coro', 'future')
+
+    def __init__(self, coro, future):
+        self.coro = coro
+        self.future = future
+
+    def __await__(self):
+        coro, future = self.coro, self.future
+        while True:
+            try:
+                value = yield future
+            except BaseException as e:
+                step, arg = coro.throw, e
+            else:
+                step, arg = coro.send, value
+            try:
+                future = step(arg)
+            except StopIteration as stop:
+                return stop.value
+
+
+def _start(coro):
+    """
+    Runs coro until it first has to wait, without a task. Returns None if it finished, otherwise an awaitable that
+    finishes it. Exceptions raised before it has to wait propagate.
+    """
+    try:
+        future = coro.send(None)
+    except StopIteration:
+        return None
+    return _Suspended(coro, future)
+
+
+async def _finish(session, sending, timeout):
+    # Waits out a send that has started, returning session if it failed.
+    try:
+        if timeout:
+            await asyncio.wait_for(sending, timeout)
+        else:
+            await sending
+    except asyncio.TimeoutError:
+        logger.warning('Timed out sending to %s', session)
+        return session
+    except Exception:
+        logger.exception('Error sending to %s', session)
+        return session
+    return None
+
+
+async def _send_later(session, data, semaphore, timeout):
+    async with semaphore:
+        return await _finish(session, session.send(data), timeout)
+
+
+async def deliver(deliveries, timeout=None, concurrency=None):
+    """
+    Sends each (session, data) pair in deliveries, with at most `concurrency` sends waiting at once and each one
+    limited to `timeout` seconds. Most sends only queue data on a transport and finish without waiting, so every send
+    is started directly and only those that have to wait are finished in a task. A recipient that times out or fails
+    is logged and skipped, so it can neither delay nor break delivery to anyone else. Returns the list of sessions
+    that failed.
+    """
+    timeout = fanout_timeout if timeout is None else timeout
+    semaphore = _shared_semaphore() if concurrency is None else asyncio.Semaphore(concurrency)
+    failed = []
+    waiting = []
+    for session, data in deliveries:
+        if semaphore.locked():
+            # Every slot is taken, so this send waits its turn before starting.
+            waiting.append(_send_later(session, data, semaphore, timeout))
+            continue
+        try:
+            sending = _start(session.send(data))
+        except Exception:
+            logger.exception('Error sending to %s', session)
+            failed.append(session)
+            continue
+        if sending is not None:
+            # The slot is free (checked above, and nothing has awaited since), so this acquires without waiting. It's
+            # released when the task is done, even if it's cancelled before it gets to run.
+            _start(semaphore.acquire())
+            task = asyncio.ensure_future(_finish(session, sending, timeout))
+            task.add_done_callback(lambda task: semaphore.release())
+            waiting.append(task)
+    if waiting:
+        results = await asyncio.gather(*waiting)
+        failed.extend(session for session in results if session is not None)
+    return failed
+
+
+async def fanout(sessions, data: Sendable, timeout=None, concurrency=None):
+    """ Sends the same data to every session in sessions, serializing it once per wire format (see deliver). """
+    data = Broadcast.wrap(data)
+    return await deliver(((session, data) for session in sessions), timeout=timeout, concurrency=concurrency)
@@ -14,7 +14,7 @@ class SendMessage (Action):
 
 
 @packet('message')
-class Message (Notification):
+class Message (Notification, slots=True):
     sender = Object(Session, doc='The message sender.', required=True)
     message = String(doc='Unencrypted message text.')
     encrypted = Object(EncryptedMessage, doc='The encrypted (and optionally signed) message.')
@@ -1,6 +1,12 @@
-from .base import Binary, Boolean, Container, Integer, Object, Sendable, String
+from .base import Binary, Boolean, Broadcast, Container, Integer, Object, Sendable, String
+from .delivery import fanout
 
 import hashlib
+import re
+
+
+# Nicknames are sent to IRC clients as they are, so they can't contain anything IRC gives a meaning to.
+nickname_pattern = re.compile(r'[^\s\x00-\x1f\x7f:#&!@,*?][^\s\x00-\x1f\x7f!@,*?]*')
 
 
 class PasswordSpec (Container):
@@ -23,7 +29,15 @@ class KeyPair (Container):
     public_key = Binary(doc='The public key.')
 
 
-class Session (Container):
+def valid_nickname(nickname):
+    """ Whether nickname can be used, which rules out spaces, control characters and IRC's special characters. """
+    return nickname_pattern.fullmatch(nickname or '') is not None
+
+
+class Session (Container, slots=True):
+    # Fields are kept in slots, but sessions also carry connection state (and subclasses their own attributes).
+    __slots__ = ('__dict__',)
+
     ident = String(doc='Public session ID used to identify users on the server.', required=True)
     username = String(doc='The username of the session.', required=True)
     hostname = String(doc='The hostname for the session, may be fake.', default='unknown', required=True)
@@ -31,9 +45,39 @@ class Session (Container):
     x25519 = Binary(doc='Public x25519 key (for key exchange).')
     ed25519 = Binary(doc='Public ed25519 key (for signature verification).')
 
+    # Sessions are embedded in most notifications, so they keep their prepared form around (see Container).
+    cache_prepared = True
     token = None
     authenticated = False
     account = None
+    # Names of the wire codecs this kind of session can switch to (see NegotiateCodec), and the one it's switching to.
+    wire_codecs = ()
+    pending_codec = None
+    # Likewise for frame compression.
+    wire_compressors = ()
+    pending_compression = None
+    # Set by the server's session registry while this session is registered with it.
+    registry = None
+    # The cluster node this session is connected to, or None if it's connected to this one (see neolith.cluster).
+    node = None
+    # Attributes the registry and joined channels index sessions by, which must tell them when they change.
+    indexed = frozenset(('token', 'nickname', 'authenticated'))
+
+    def __setattr__(self, name, value):
+        if name not in self.indexed:
+            return super().__setattr__(name, value)
+        old_value = getattr(self, name)
+        super().__setattr__(name, value)
+        if self.registry is not None:
+            self.registry.reindex(self, name, old_value)
+        if name == 'authenticated':
+            for channel in self.channels:
+                channel.reindex(self)
+
+    @property
+    def channels(self):
+        """ The set of channels this session is a member of, maintained by Channel.add and Channel.remove. """
+        return self.__dict__.setdefault('joined_channels', set())
 
     def __str__(self):
         return '{}!{}@{}'.format(self.nickname, self.username, self.hostname)
@@ -49,39 +93,73 @@ class EncryptedMessage (Container):
     signature = Binary(doc='Signature of the message data (before encryption).')
 
 
-class Channel (Container):
+class Channel (Container, slots=True):
+    __slots__ = ('sessions', 'authenticated_sessions', 'remote_sessions', 'invitations', 'registry')
+
     name = String(doc='The unique name of this channel.', required=True)
     topic = String(doc='Topic of the channel')
     protected = Boolean(doc='Whether this channel can be removed or not.', default=False)
     private = Boolean(doc='Whether this channel is invitation-only or not.', default=False)
     encrypted = Boolean(doc='Whether posts to this channel must be encrypted or not.', default=False)
 
+    cache_prepared = True
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.sessions = set()
+        # Kept up to date as sessions join, leave, and (un)authenticate - see reindex.
+        self.authenticated_sessions = set()
+        # Members connected to other nodes of a cluster, which are sent to through their own node (see send).
+        self.remote_sessions = set()
         self.invitations = set()
+        # Set by the server's channel registry once this channel is added to it.
+        self.registry = None
 
     @property
     def irc_name(self):
         return '#{}'.format(self.name)
 
-    @property
-    def authenticated_sessions(self):
-        return set([s for s in self.sessions if s.authenticated])
-
     def invite(self, session):
         self.invitations.add(session.ident)
 
+    @property
+    def local_sessions(self):
+        """ Authenticated members connected to this node. """
+        if not self.remote_sessions:
+            return self.authenticated_sessions
+        return self.authenticated_sessions - self.remote_sessions
+
     def add(self, session):
         if session in self.sessions:
             return False
         self.sessions.add(session)
+        if session.authenticated:
+            self.authenticated_sessions.add(session)
+        if session.node is not None:
+            self.remote_sessions.add(session)
+        session.channels.add(self)
+        if self.registry is not None:
+            self.registry.membership_changed(self, session, True)
         return True
 
     def remove(self, session):
+        member = session in self.sessions
         self.sessions.discard(session)
+        self.authenticated_sessions.discard(session)
+        self.remote_sessions.discard(session)
         self.invitations.discard(session.ident)
+        session.channels.discard(self)
+        if member and self.registry is not None:
+            self.registry.membership_changed(self, session, False)
+
+    def reindex(self, session):
+        if session.authenticated and session in self.sessions:
+            self.authenticated_sessions.add(session)
+        else:
+            self.authenticated_sessions.discard(session)
 
     async def send(self, data: Sendable):
-        for s in self.authenticated_sessions:
-            await s.send(data)
+        if self.remote_sessions and self.registry is not None:
+            data = Broadcast.wrap(data)
+            self.registry.relay(self, data)
+        await fanout(self.local_sessions, data)
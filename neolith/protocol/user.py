@@ -26,3 +26,6 @@ class UserLeft (Notification):
 @packet('user.modified')
 class UserModified (Notification):
     user = Object(Session, doc='The user who was modified.', required=True)
+
+    def coalesce_key(self):
+        return (self.ident, self.user.ident)
@@ -1,29 +1,55 @@
 from starlette.applications import Starlette
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response, StreamingResponse
 from starlette.staticfiles import StaticFiles
 from starlette.websockets import WebSocketDisconnect
 import dorm
 import uvicorn
 
 from neolith import settings
+from neolith.cluster import RemoteWebSession, bind_reuse_port, create_cluster, run_workers
+from neolith.crypto import configure_crypto, shutdown_crypto
+from neolith.database import Database
+from neolith.events import EventBuffer, EventStream, format_event
+from neolith.framing import FrameBuffer
 from neolith.irc import IRCSession
-from neolith.models import Account
+from neolith.models import Account, configure_account_cache, use_database
+from neolith.outbox import Outbox
 from neolith.protocol import (
-    Channel, ChannelJoin, ChannelLeave, ClientPacket, ProtocolError, Sendable, Session, Transaction, UserJoined,
-    UserLeft)
+    Broadcast, Channel, ChannelJoin, ChannelLeave, ClientPacket, ProtocolError, Sendable, Session, Transaction,
+    UserJoined, UserLeft, configure_fanout, fanout, use_codecs, use_lazy_decoding, valid_nickname)
 from neolith.web import client, docs, signup
+from neolith.wire import compressing_codec, compressors, encode_json_compact, wire_codecs
+from neolith.wirelog import configure_wire_log, log_wire, stop_wire_log
 
 import asyncio
 import binascii
-import json
 import os
-import struct
+
+
+def websocket_text(data: Sendable) -> str:
+    """ Wire format for WebSocketSession: a JSON text frame. """
+    return encode_json_compact(data.to_dict())
+
+
+def parse_since(value):
+    """ Parses the sequence number of the last event a web client has seen, raising ValueError if it's invalid. """
+    if value is None:
+        return None
+    since = int(value)
+    if since < 0:
+        raise ValueError(value)
+    return since
 
 
 class Channels:
+    """
+    Registry of channels by name. When the server is part of a cluster, the observer (a Cluster) is told about new
+    channels and about local sessions joining or leaving them, and relays sends to members on other nodes.
+    """
 
     def __init__(self):
         self.channels = {}
+        self.observer = None
 
     def __contains__(self, key: str):
         return key in self.channels
@@ -36,8 +62,144 @@ class Channels:
     def __iter__(self):
         return iter(self.channels.values())
 
-    def add(self, channel):
-        return self.channels.setdefault(channel.name, channel)
+    def add(self, channel, replicated=False):
+        """ Adds channel unless one with the same name exists, returning whichever is registered under the name. """
+        existing = self.channels.setdefault(channel.name, channel)
+        if existing is channel:
+            channel.registry = self
+            if self.observer is not None and not replicated:
+                self.observer.channel_created(channel)
+        return existing
+
+    def membership_changed(self, channel, session, joined):
+        # Only authenticated local sessions are replicated, see Cluster.
+        if self.observer is not None and session.node is None and session.authenticated:
+            self.observer.membership_changed(channel, session, joined)
+
+    def relay(self, channel, data):
+        if self.observer is not None:
+            self.observer.channel_sent(channel, data)
+
+
+class Sessions:
+    """
+    Registry of connected sessions, indexed by ident, token and case-folded nickname, with a separate set of the
+    authenticated ones. Registered sessions report changes to indexed attributes back through reindex (see
+    Session.__setattr__), so the indexes stay consistent however those attributes are changed. Changes to local
+    sessions are passed on to the observer (a Cluster) when the server is part of a cluster.
+    """
+
+    def __init__(self):
+        self.by_ident = {}
+        self.by_token = {}
+        self.by_nickname = {}
+        self.authenticated = set()
+        # Sessions connected to other nodes of a cluster (which are always authenticated).
+        self.remote = set()
+        self.observer = None
+
+    def __contains__(self, ident: str):
+        return ident in self.by_ident
+
+    def __getitem__(self, ident: str):
+        return self.by_ident[ident]
+
+    def __iter__(self):
+        return iter(self.by_ident.values())
+
+    def __len__(self):
+        return len(self.by_ident)
+
+    def values(self):
+        return self.by_ident.values()
+
+    @property
+    def local_authenticated(self):
+        """ Authenticated sessions connected to this node. """
+        if not self.remote:
+            return self.authenticated
+        return self.authenticated - self.remote
+
+    def add(self, session):
+        self.by_ident[session.ident] = session
+        if session.node is not None:
+            self.remote.add(session)
+        self.index(session, 'token', session.token)
+        self.index(session, 'nickname', session.nickname)
+        self.index(session, 'authenticated', session.authenticated)
+        session.registry = self
+
+    def remove(self, session):
+        if self.by_ident.get(session.ident) is not session:
+            return False
+        session.registry = None
+        del self.by_ident[session.ident]
+        self.unindex(session, 'token', session.token)
+        self.unindex(session, 'nickname', session.nickname)
+        self.unindex(session, 'authenticated', session.authenticated)
+        self.remote.discard(session)
+        if self.observer is not None and session.node is None:
+            self.observer.session_removed(session)
+        return True
+
+    def index(self, session, name, value):
+        if name == 'token':
+            if value is not None:
+                self.by_token[value] = session
+        elif name == 'nickname':
+            if value is not None:
+                self.by_nickname.setdefault(value.casefold(), set()).add(session)
+        elif name == 'authenticated':
+            if value:
+                self.authenticated.add(session)
+
+    def unindex(self, session, name, value):
+        if name == 'token':
+            if self.by_token.get(value) is session:
+                del self.by_token[value]
+        elif name == 'nickname':
+            if value is not None:
+                key = value.casefold()
+                matches = self.by_nickname.get(key, ())
+                if session in matches:
+                    matches.discard(session)
+                    if not matches:
+                        del self.by_nickname[key]
+        elif name == 'authenticated':
+            self.authenticated.discard(session)
+
+    def reindex(self, session, name, old_value):
+        self.unindex(session, name, old_value)
+        self.index(session, name, getattr(session, name))
+        if self.observer is not None and session.node is None:
+            self.observer.session_changed(session, name, old_value)
+
+    def nickname_in_use(self, nickname, exclude=None):
+        """ Whether an authenticated session (other than exclude) is using nickname, ignoring case. """
+        for session in self.by_nickname.get(nickname.casefold(), ()):
+            if session.authenticated and session is not exclude:
+                return True
+        return False
+
+    def candidates(self, kwargs):
+        if 'ident' in kwargs:
+            session = self.by_ident.get(kwargs['ident'])
+            return (session,) if session else ()
+        if 'token' in kwargs:
+            session = self.by_token.get(kwargs['token'])
+            return (session,) if session else ()
+        if 'nickname' in kwargs:
+            nickname = kwargs['nickname']
+            return tuple(self.by_nickname.get(nickname.casefold(), ())) if nickname is not None else ()
+        if kwargs.get('authenticated') is True:
+            return tuple(self.authenticated)
+        return tuple(self.by_ident.values())
+
+    def find(self, **kwargs):
+        """ Yields sessions whose attributes equal all of kwargs, narrowing the search with an index if one fits. """
+        for session in self.candidates(kwargs):
+            if all(getattr(session, field) == value for field, value in kwargs.items()):
+                yield session
 
 
 class NeolithServer:
@@ -46,16 +208,28 @@ class NeolithServer:
         self.loop = None
         self.server = None
         self.irc = None
-        self.sessions = {}
+        self.database = None
+        self.cluster = None
+        self.sessions = Sessions()
         self.channels = Channels()
         self.secret_key = os.urandom(32)
         self.name = settings.SERVER_NAME
+        # Checked here, rather than failing every connection once the first one is made.
+        Outbox.check_policy(settings.OUTBOX_POLICY)
+        use_codecs(settings.COMPILED_CODECS)
+        use_lazy_decoding(settings.LAZY_DECODING)
+        configure_fanout(timeout=settings.FANOUT_TIMEOUT, concurrency=settings.FANOUT_CONCURRENCY)
+        configure_crypto(settings.CRYPTO_WORKERS, processes=settings.CRYPTO_PROCESSES,
+            max_queue=settings.CRYPTO_MAX_QUEUE)
+        configure_account_cache(settings.ACCOUNT_CACHE_TTL, negative_ttl=settings.ACCOUNT_CACHE_NEGATIVE_TTL,
+            max_size=settings.ACCOUNT_CACHE_SIZE)
         if settings.PUBLIC_CHANNEL:
             self.channels.add(Channel(name=settings.PUBLIC_CHANNEL, topic='', protected=True, encrypted=False))
         self.web = Starlette(debug=True)
         self.web.add_event_handler('startup', self.startup)
         self.web.add_event_handler('shutdown', self.shutdown)
         self.web.add_route('/api', self.web_handler, methods=['GET', 'POST'])
+        self.web.add_route('/events', self.events_handler, methods=['GET'])
         self.web.add_websocket_route('/ws', self.websocket_handler)
         # Server static files
         static_dir = os.path.join(os.path.dirname(__file__), 'static')
@@ -68,37 +242,114 @@ class NeolithServer:
             self.web.add_route('/signup', signup, methods=['GET', 'POST'])
 
     async def startup(self):
+        # The wire log may start a thread, so it's set up here rather than before worker processes are forked.
+        configure_wire_log(settings.WIRE_LOG, sample=settings.WIRE_LOG_SAMPLE, use_queue=settings.WIRE_LOG_QUEUE)
         dorm.setup(settings.DATABASE, models=[Account])
+        if settings.DATABASE_READERS and settings.DATABASE != ':memory:':
+            # Each pooled connection would get its own (empty) in-memory database, so those stay on dorm's connection.
+            self.database = Database(settings.DATABASE, readers=settings.DATABASE_READERS,
+                batch_size=settings.DATABASE_BATCH_SIZE)
+            use_database(self.database)
         print('Starting binary protocol server on {}:{}'.format(settings.SOCKET_BIND, settings.SOCKET_PORT))
         # Careful not to use the event loop until after uvicorn starts it, since it may swap in uvloop.
         self.loop = asyncio.get_event_loop()
+        # Workers share the listening ports. Nodes connect to each other before accepting any clients.
+        reuse_port = settings.WORKERS > 1
+        if self.cluster:
+            await self.cluster.start()
         self.server = await self.loop.create_server(lambda: SocketSession(self), settings.SOCKET_BIND,
-            settings.SOCKET_PORT)
+            settings.SOCKET_PORT, reuse_port=reuse_port)
         if settings.ENABLE_IRC:
             print('Starting IRC server on {}:{}'.format(settings.IRC_BIND, settings.IRC_PORT))
-            self.irc = await self.loop.create_server(lambda: IRCSession(self), settings.IRC_BIND, settings.IRC_PORT)
+            self.irc = await self.loop.create_server(lambda: IRCSession(self), settings.IRC_BIND, settings.IRC_PORT,
+                reuse_port=reuse_port)
 
     async def shutdown(self):
         print('Stopping binary protocol server')
         self.server.close()
         if self.irc:
             self.irc.close()
+        if self.cluster:
+            self.cluster.close()
+        stop_wire_log()
+        if self.database:
+            use_database(None)
+            self.database.close()
+        shutdown_crypto()
+
+    def web_session(self, request):
+        """
+        Returns (token, session) for an HTTP API request, where session is None if there's no WebSession with the
+        token. The token is passed in the X-Neolith-Session header, or the token parameter by clients that can't set
+        headers (such as browsers' EventSource). When the server is part of a cluster, a token from another node gets a
+        RemoteWebSession, which passes requests on to the node that has the session.
+        """
+        token = request.headers.get('x-neolith-session') or request.query_params.get('token')
+        if not token:
+            return None, None
+        node = self.cluster.token_node(token) if self.cluster else None
+        if node is not None and node != self.cluster.node:
+            return token, RemoteWebSession(self.cluster, node, token)
+        return token, self.local_web_session(token)
+
+    def local_web_session(self, token):
+        session = self.get(token=token)
+        return session if isinstance(session, WebSession) else None
 
     async def web_handler(self, request):
-        session_token = request.headers.get('x-neolith-session')
-        session = self.get(token=session_token, default=WebSession())
+        session_token, session = self.web_session(request)
+        if session_token and session is None:
+            return JSONResponse({'error': 'Unknown or expired session.'}, status_code=401)
         if request.method == 'GET':
-            return JSONResponse([tx.to_dict() for tx in await session.events()])
+            if session is None:
+                return JSONResponse({'error': 'Unknown or expired session.'}, status_code=401)
+            try:
+                since = parse_since(request.query_params.get('since'))
+            except ValueError:
+                return JSONResponse({'error': 'Invalid event sequence number.'}, status_code=400)
+            try:
+                result = await session.poll(since, settings.WEB_POLL_TIMEOUT, settings.WEB_POLL_LINGER)
+            except ProtocolError as e:
+                return JSONResponse({'error': str(e)}, status_code=503)
+            if result is None:
+                return JSONResponse({'error': 'Unknown or expired session.'}, status_code=401)
+            last, missed, events = result
+            # The events are already encoded, so the response body is put together from them as they are.
+            headers = {'X-Neolith-Last-Event': str(last)}
+            if missed:
+                headers['X-Neolith-Missed'] = str(missed)
+            return Response('[{}]'.format(','.join(events)), media_type='application/json', headers=headers)
         elif request.method == 'POST':
-            session.hostname = request.client.host
-            if not session.ident:
-                await self.connected(session)
-            tx = Transaction(await request.json())
-            response = await self.handle(session, tx, send=False)
-            return JSONResponse(response.to_dict())
+            if session is None:
+                session = WebSession(self)
+            if isinstance(session, WebSession):
+                session.hostname = request.client.host
+                if not session.ident:
+                    await self.connected(session)
+            try:
+                response = await session.request(await request.json())
+            except ProtocolError as e:
+                return JSONResponse({'error': str(e)}, status_code=503)
+            if response is None:
+                return JSONResponse({'error': 'Unknown or expired session.'}, status_code=401)
+            return JSONResponse(response)
         else:
             return JSONResponse({'error': 'Invalid HTTP method.'}, status_code=405)
 
+    async def events_handler(self, request):
+        """ Streams a WebSession's events as server-sent events, resuming after the Last-Event-ID if there is one. """
+        session_token, session = self.web_session(request)
+        if session is None:
+            return JSONResponse({'error': 'Unknown or expired session.'}, status_code=401)
+        try:
+            since = parse_since(request.headers.get('last-event-id') or request.query_params.get('since'))
+        except ValueError:
+            return JSONResponse({'error': 'Invalid event sequence number.'}, status_code=400)
+        # Asks proxies (nginx in particular) not to buffer the stream.
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return StreamingResponse(session.stream(since, settings.WEB_STREAM_HEARTBEAT),
+            media_type='text/event-stream', headers=headers)
+
     async def websocket_handler(self, websocket, **kwargs):
         await websocket.accept()
 
@@ -117,7 +368,7 @@ class NeolithServer:
             await self.disconnected(session)
 
     async def handle(self, session, transaction, send=True):
-        print(session, '-->', transaction.to_dict())
+        log_wire(session, '-->', transaction)
         response = transaction.response()
         for packet in transaction.packets:
             assert isinstance(packet, ClientPacket)
@@ -135,31 +386,60 @@ class NeolithServer:
         print('New connection - {}'.format(session))
         session.ident = binascii.hexlify(os.urandom(16)).decode('ascii')
         session.token = binascii.hexlify(os.urandom(16)).decode('ascii')
-        self.sessions[session.ident] = session
+        if self.cluster:
+            # So requests with the token can find their way back to this node.
+            session.token = self.cluster.tag_token(session.token)
+        self.sessions.add(session)
 
     async def disconnected(self, session):
         if session.authenticated:
             session.authenticated = False
-            for channel in self.channels:
-                if session in channel.sessions:
-                    channel.remove(session)
-                    await channel.send(ChannelLeave(channel=channel.name, user=session))
+            for channel in list(session.channels):
+                channel.remove(session)
+                await channel.send(ChannelLeave(channel=channel.name, user=session))
             await self.broadcast(UserLeft(user=session))
-        if session.ident in self.sessions:
-            del self.sessions[session.ident]
+        self.sessions.remove(session)
 
     def start(self):
-        uvicorn.run(self.web, host=settings.WEB_BIND, port=settings.WEB_PORT)
+        if settings.WORKERS > 1:
+            run_workers(self.run, settings.WORKERS, settings.WORKER_SOCKET_DIR)
+        else:
+            self.run()
+
+    def run(self, worker=None, path=None):
+        """
+        Serves clients until shut down, as one of several worker processes if worker is given (see run_workers), and
+        as part of a cluster if one is configured (see create_cluster).
+        """
+        self.cluster = create_cluster(self, worker, path)
+        if worker is None:
+            uvicorn.run(self.web, host=settings.WEB_BIND, port=settings.WEB_PORT,
+                ws_per_message_deflate=settings.WEB_SOCKET_DEFLATE)
+        else:
+            config = uvicorn.Config(self.web, host=settings.WEB_BIND, port=settings.WEB_PORT,
+                ws_per_message_deflate=settings.WEB_SOCKET_DEFLATE)
+            uvicorn.Server(config).run(sockets=[bind_reuse_port(settings.WEB_BIND, settings.WEB_PORT)])
 
     async def broadcast(self, message):
-        for session in self.sessions.values():
-            if session.authenticated:
-                await session.send(message)
+        if self.cluster and self.cluster.peers:
+            message = Broadcast.wrap(message)
+            self.cluster.broadcast(message)
+        await fanout(list(self.sessions.local_authenticated), message)
+
+    async def nickname_available(self, session, nickname):
+        """ Whether session may use nickname, claiming it from the rest of the cluster if the server is part of one. """
+        if self.sessions.nickname_in_use(nickname, exclude=session):
+            return False
+        if self.cluster:
+            return await self.cluster.claim(session, nickname)
+        return True
 
     async def authenticate(self, session):
         if session.authenticated:
             raise ProtocolError('Session is already authenticated.')
-        if self.get(nickname=session.nickname, authenticated=True):
+        if not valid_nickname(session.nickname):
+            raise ProtocolError('Invalid nickname.')
+        if not await self.nickname_available(session, session.nickname):
             raise ProtocolError('This nickname is already in use.')
         # XXX: where should this go? maybe a new task to be executed next time through the loop?
         await self.broadcast(UserJoined(user=session))
@@ -173,13 +453,7 @@ class NeolithServer:
         return session.ident
 
     def find(self, **kwargs):
-        for session in self.sessions.values():
-            match = True
-            for field, value in kwargs.items():
-                if getattr(session, field) != value:
-                    match = False
-            if match:
-                yield session
+        return self.sessions.find(**kwargs)
 
     def get(self, **kwargs):
         default = kwargs.pop('default', None)
@@ -190,15 +464,20 @@ class NeolithServer:
 
 class SocketSession (asyncio.Protocol, Session):
 
-    def __init__(self, delegate):
+    def __init__(self, delegate, max_frame_size=None):
+        super().__init__()
         self.delegate = delegate
-        self.buffered = b''
+        self.buffer = FrameBuffer(max_frame_size or settings.SOCKET_MAX_FRAME_SIZE)
         self.transport = None
+        self.outbox = None
+        self.codec = wire_codecs['json']
         self.address = None
         self.port = None
 
     def connection_made(self, transport: asyncio.Transport):
         self.transport = transport
+        self.outbox = Outbox(transport, settings.OUTBOX_LIMIT, settings.OUTBOX_POLICY,
+            batch=settings.OUTBOX_BATCH)
         self.address, self.port = self.transport.get_extra_info('peername')
         self.hostname = self.address  # TODO: look up hostname from address?
         if hasattr(self.delegate, 'connected'):
@@ -208,55 +487,153 @@ class SocketSession (asyncio.Protocol, Session):
         if hasattr(self.delegate, 'disconnected'):
             asyncio.ensure_future(self.delegate.disconnected(self))
 
+    @property
+    def wire_codecs(self):
+        return tuple(name for name in settings.SOCKET_CODECS if name in wire_codecs)
+
+    @property
+    def wire_compressors(self):
+        return tuple(name for name in settings.SOCKET_COMPRESSION if name in compressors)
+
+    def pause_writing(self):
+        self.outbox.pause()
+
+    def resume_writing(self):
+        self.outbox.resume()
+
     def data_received(self, data: bytes):
-        self.buffered += data
-        done = len(self.buffered) < 4
-        while not done:
-            size = struct.unpack('!L', self.buffered[:4])[0]
-            total = 4 + size
-            if len(self.buffered) >= total:
-                json_data = json.loads(self.buffered[4:total])
-                tx = Transaction(data=json_data)
-                asyncio.ensure_future(self.delegate.handle(self, tx))
-                self.buffered = self.buffered[total:]
-                done = len(self.buffered) < 4
-            else:
-                done = True
+        self.buffer.feed(data)
+        self.frames_received()
+
+    def frames_received(self):
+        try:
+            frames = self.buffer.frames()
+        except ProtocolError as e:
+            print('Closing {}: {}'.format(self, e))
+            self.transport.close()
+            return
+        for frame in frames:
+            tx = Transaction(data=self.codec.loads(frame), binary=self.codec.binary)
+            asyncio.ensure_future(self.delegate.handle(self, tx))
 
     async def send(self, data: Sendable):
-        print(self, '<--', data.to_dict())
-        buf = json.dumps(data.to_dict()).encode('utf-8')
-        self.transport.write(struct.pack('!L', len(buf)) + buf)
+        log_wire(self, '<--', data)
+        self.outbox.write(data.encode(self.codec), data.droppable, data.coalesce_key())
+        if self.pending_codec:
+            self.codec = wire_codecs[self.pending_codec]
+            if self.pending_compression:
+                compressor = compressors[self.pending_compression]
+                self.codec = compressing_codec(self.codec, compressor, settings.SOCKET_COMPRESS_THRESHOLD)
+                self.buffer.decompressor = compressor
+            self.pending_codec = self.pending_compression = None
 
 
 class WebSocketSession (Session):
 
     def __init__(self, websocket):
+        super().__init__()
         self.websocket = websocket
 
     async def send(self, data: Sendable):
-        print(self, '<--', data.to_dict())
-        await self.websocket.send_json(data.to_dict())
+        log_wire(self, '<--', data)
+        await self.websocket.send_text(data.encode(websocket_text))
 
 
 class WebSession (Session):
-
-    def __init__(self):
-        self.queue = asyncio.Queue()
+    """
+    Session for clients of the HTTP API, which send requests with POST and receive events either by polling with GET
+    or from a stream of server-sent events. Events are encoded as they're sent (sharing the encoding with
+    WebSocketSession, see Broadcast) and kept in an EventBuffer, so a client can resume from the last event it saw. The
+    session is disconnected from delegate once it has gone idle_timeout seconds without a request (0 to never expire).
+    """
+
+    def __init__(self, delegate=None, buffer_size=None, idle_timeout=None):
+        super().__init__()
+        self.delegate = delegate
+        self.buffer = EventBuffer(buffer_size or settings.WEB_EVENT_BUFFER)
+        self.idle_timeout = settings.WEB_SESSION_TIMEOUT if idle_timeout is None else idle_timeout
+        # Sequence number of the last event returned by poll, for clients that don't say where to resume from.
+        self.delivered = 0
+        # Polls and streams in progress, which keep the session from expiring.
+        self.polling = 0
+        self.expiry = None
+        self.events = None
 
     async def send(self, data: Sendable):
-        print(self, '<--', data.to_dict())
-        await self.queue.put(data)
+        log_wire(self, '<--', data)
+        event = data.encode(websocket_text)
+        seq = self.buffer.append(event)
+        if self.events is not None:
+            self.events.outbox.write(format_event(seq, event), data.droppable, data.coalesce_key())
+
+    def touch(self):
+        """ Restarts the idle timer, which doesn't run while a poll is waiting. """
+        if self.expiry is not None:
+            self.expiry.cancel()
+            self.expiry = None
+        if self.idle_timeout and not self.polling:
+            self.expiry = asyncio.get_event_loop().call_later(self.idle_timeout, self.expire)
+
+    def expire(self):
+        self.expiry = None
+        print('Expiring idle web session {}'.format(self))
+        if hasattr(self.delegate, 'disconnected'):
+            asyncio.ensure_future(self.delegate.disconnected(self))
 
-    async def events(self, timeout=10.0):
-        if self.queue.empty():
-            # If there are no pending events, allow for long-polling until one comes in.
-            try:
-                return [await asyncio.wait_for(self.queue.get(), timeout=timeout)]
-            except asyncio.TimeoutError:
-                return []
-        else:
-            return [self.queue.get_nowait() for i in range(self.queue.qsize())]
+    async def request(self, data):
+        """ Handles a transaction sent by the client, returning the response to it. """
+        self.touch()
+        response = await self.delegate.handle(self, Transaction(data), send=False)
+        return response.to_dict()
+
+    async def poll(self, since=None, timeout=10.0, linger=0.0):
+        """
+        Returns (last, missed, events) for the events after sequence number since (or the last one returned), waiting
+        up to timeout seconds for one if there are none yet, then up to linger seconds more for any that follow it.
+        """
+        since = min(self.delivered if since is None else since, self.buffer.last)
+        self.polling += 1
+        self.touch()
+        try:
+            # Events already waiting are returned right away; lingering only batches up a burst that starts mid-poll.
+            if self.buffer.last == since and await self.buffer.wait(since, timeout) and linger:
+                await asyncio.sleep(linger)
+        finally:
+            self.polling -= 1
+            self.touch()
+        missed, events = self.buffer.since(since)
+        self.delivered = self.buffer.last
+        return self.buffer.last, missed, [event for seq, event in events]
+
+    async def stream(self, since=None, heartbeat=15.0):
+        """
+        Yields chunks of server-sent events, starting with those after sequence number since (or the last one
+        delivered), until the client goes away or falls too far behind. Only one stream is sent at a time.
+        """
+        if self.events is not None:
+            self.events.abort()
+        since = min(self.delivered if since is None else since, self.buffer.last)
+        events = self.events = EventStream(heartbeat, since)
+        # Dropping or coalescing events would leave gaps in the stream, so a client that falls behind is disconnected
+        # whatever the policy, and resumes from the buffer (after the last event it got) when it reconnects.
+        events.outbox = Outbox(events, settings.OUTBOX_LIMIT, 'disconnect', batch=settings.OUTBOX_BATCH)
+        self.polling += 1
+        self.touch()
+        missed, buffered = self.buffer.since(since)
+        if missed:
+            events.write('event: missed\ndata: {}\n\n'.format(missed).encode('ascii'))
+        for seq, event in buffered:
+            events.write(format_event(seq, event))
+        try:
+            async for chunk in events.chunks():
+                yield chunk
+        finally:
+            events.outbox.close()
+            if self.events is events:
+                self.events = None
+                self.delivered = events.sent
+            self.polling -= 1
+            self.touch()
 
 
 if __name__ == '__main__':
@@ -1,4 +1,5 @@
 from starlette.config import Config
+from starlette.datastructures import CommaSeparatedStrings
 
 
 config = Config(".env")
@@ -6,12 +7,82 @@ config = Config(".env")
 
 DEBUG = config('DEBUG', cast=bool, default=False)
 DATABASE = config('DATABASE', default='neolith.db')
+# Number of pooled read connections (0 to use dorm's single connection), and the most writes to commit together.
+DATABASE_READERS = config('DATABASE_READERS', cast=int, default=4)
+DATABASE_BATCH_SIZE = config('DATABASE_BATCH_SIZE', cast=int, default=100)
+
+# Log every message sent and received (to stdout, through a background thread if WIRE_LOG_QUEUE is set). Set
+# WIRE_LOG_SAMPLE below 1.0 to only log that fraction of messages.
+WIRE_LOG = config('WIRE_LOG', cast=bool, default=DEBUG)
+WIRE_LOG_SAMPLE = config('WIRE_LOG_SAMPLE', cast=float, default=1.0)
+WIRE_LOG_QUEUE = config('WIRE_LOG_QUEUE', cast=bool, default=True)
+
+# Use generated encode/decode functions for registered packets instead of the generic Container methods.
+COMPILED_CODECS = config('COMPILED_CODECS', cast=bool, default=False)
+# Decode incoming packet fields on first access, passing untouched binary fields through without re-encoding them.
+LAZY_DECODING = config('LAZY_DECODING', cast=bool, default=False)
 
 SOCKET_BIND = config('SOCKET_BIND', default='0.0.0.0')
 SOCKET_PORT = config('SOCKET_PORT', cast=int, default=8120)
+# Largest frame payload (in bytes) a socket client may send before being disconnected.
+SOCKET_MAX_FRAME_SIZE = config('SOCKET_MAX_FRAME_SIZE', cast=int, default=1048576)
+# Wire codecs socket clients may switch to (msgpack and cbor need the msgpack and cbor2 packages installed).
+SOCKET_CODECS = config('SOCKET_CODECS', cast=CommaSeparatedStrings, default='json,msgpack,cbor')
+# Frame compression socket clients may ask for (zstd needs the zstandard package installed), and the smallest payload
+# (in bytes) worth compressing.
+SOCKET_COMPRESSION = config('SOCKET_COMPRESSION', cast=CommaSeparatedStrings, default='zstd,zlib')
+SOCKET_COMPRESS_THRESHOLD = config('SOCKET_COMPRESS_THRESHOLD', cast=int, default=512)
 
 WEB_BIND = config('WEB_BIND', default='0.0.0.0')
 WEB_PORT = config('WEB_PORT', cast=int, default=8080)
+# Offer permessage-deflate to WebSocket clients at /ws (each connection compresses with its own context).
+WEB_SOCKET_DEFLATE = config('WEB_SOCKET_DEFLATE', cast=bool, default=True)
+# Seconds an HTTP API poll waits for an event, then for more to follow the first one before responding.
+WEB_POLL_TIMEOUT = config('WEB_POLL_TIMEOUT', cast=float, default=10.0)
+WEB_POLL_LINGER = config('WEB_POLL_LINGER', cast=float, default=0.05)
+# Events kept for each HTTP API session to resume from, and seconds without a request before the session expires (0
+# to never expire them).
+WEB_EVENT_BUFFER = config('WEB_EVENT_BUFFER', cast=int, default=1000)
+WEB_SESSION_TIMEOUT = config('WEB_SESSION_TIMEOUT', cast=float, default=60.0)
+# Seconds without an event before a keepalive comment is sent down an HTTP API event stream (at /events).
+WEB_STREAM_HEARTBEAT = config('WEB_STREAM_HEARTBEAT', cast=float, default=15.0)
+
+# Worker processes sharing the socket, IRC and web ports (with SO_REUSEPORT), each serving its own connections. The
+# workers talk to each other over Unix sockets in WORKER_SOCKET_DIR (a new temporary directory if not set).
+WORKERS = config('WORKERS', cast=int, default=1)
+WORKER_SOCKET_DIR = config('WORKER_SOCKET_DIR', default=None)
+
+# Nodes (host:port of each one's cluster listener) that together serve one logical server, and which of them this is.
+# Nodes connect to each other directly, so they should be on a private network. With WORKERS > 1, worker n of each
+# node listens on its port + n.
+CLUSTER_NODES = config('CLUSTER_NODES', cast=CommaSeparatedStrings, default='')
+CLUSTER_NODE = config('CLUSTER_NODE', default=None)
+# Secret shared by every node, which they prove they know before being let into the cluster. Required for
+# CLUSTER_NODES, and used between the workers of one server too if it's set.
+CLUSTER_SECRET = config('CLUSTER_SECRET', default=None)
+# Seconds to collect messages for other nodes before sending them (0 to send them once per event loop iteration).
+CLUSTER_BATCH_DELAY = config('CLUSTER_BATCH_DELAY', cast=float, default=0.0)
+
+# Bytes queued for a session that has stopped reading before OUTBOX_POLICY (drop, coalesce, disconnect) kicks in.
+OUTBOX_LIMIT = config('OUTBOX_LIMIT', cast=int, default=1048576)
+OUTBOX_POLICY = config('OUTBOX_POLICY', default='drop')
+# Send everything written to a session during one event loop iteration together, rather than as it's written.
+OUTBOX_BATCH = config('OUTBOX_BATCH', cast=bool, default=True)
+
+# Seconds to wait on any one recipient of a broadcast (0 for no limit), and how many sends may be in flight at once.
+FANOUT_TIMEOUT = config('FANOUT_TIMEOUT', cast=float, default=5.0)
+FANOUT_CONCURRENCY = config('FANOUT_CONCURRENCY', cast=int, default=256)
+
+# Password hashing runs on this many threads (or processes, if CRYPTO_PROCESSES is set), off the event loop. Logins
+# are turned away while more than CRYPTO_MAX_QUEUE are waiting for a worker (0 for no limit).
+CRYPTO_WORKERS = config('CRYPTO_WORKERS', cast=int, default=4)
+CRYPTO_PROCESSES = config('CRYPTO_PROCESSES', cast=bool, default=False)
+CRYPTO_MAX_QUEUE = config('CRYPTO_MAX_QUEUE', cast=int, default=0)
+
+# Seconds to cache account lookups for (and unknown usernames, separately), and the most accounts to keep cached.
+ACCOUNT_CACHE_TTL = config('ACCOUNT_CACHE_TTL', cast=float, default=300.0)
+ACCOUNT_CACHE_NEGATIVE_TTL = config('ACCOUNT_CACHE_NEGATIVE_TTL', cast=float, default=30.0)
+ACCOUNT_CACHE_SIZE = config('ACCOUNT_CACHE_SIZE', cast=int, default=10000)
 
 SERVER_NAME = config('SERVER_NAME', default='Neolith')
 PUBLIC_CHANNEL = config('PUBLIC_CHANNEL', default='public')
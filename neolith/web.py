@@ -2,7 +2,7 @@ from starlette.responses import JSONResponse
 from starlette.templating import Jinja2Templates
 
 from neolith import settings
-from neolith.models import Account
+from neolith.models import Account, email_in_use, get_account
 from neolith.protocol import KeyPair, PasswordSpec, registered_packets, types
 
 import base64
@@ -39,9 +39,9 @@ async def client(request):
 async def signup(request):
     if request.method == 'POST':
         data = await request.json()
-        if await Account.query(username=data['username']).count():
+        if await get_account(data['username']):
             return JSONResponse({'error': 'This username is already taken.'}, status_code=400)
-        if await Account.query(email=data['email']).count():
+        if await email_in_use(data['email']):
             return JSONResponse({'error': 'This email address is already used by another account.'}, status_code=400)
         await Account.insert(
             username=data['username'],
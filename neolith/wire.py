@@ -0,0 +1,243 @@
+from neolith.framing import COMPRESSED, header
+from neolith.protocol import Prepared, ProtocolError, Sendable
+
+import functools
+import json
+import zlib
+
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class JSONEncoder:
+    """
+    Encodes to_dict output as JSON. Packet fields holding lists of Prepared dicts (such as the users in a user.listing)
+    are built by joining each one's cached encoding, so a listing of thousands of sessions only encodes the ones that
+    have changed. Everything else goes through json.dumps as usual.
+    """
+
+    def __init__(self, compact=False):
+        self.separators = (',', ':') if compact else (', ', ': ')
+
+    def __call__(self, data: dict) -> str:
+        for packets in data.values():
+            if packets.__class__ is list:
+                for packet in packets:
+                    if packet.__class__ is dict and any(is_prepared_list(value) for value in packet.values()):
+                        return self.splice(data)
+        return json.dumps(data, separators=self.separators)
+
+    def splice(self, value, depth=0):
+        # Depth 0 is the transaction, 1 a list of packets, 2 a packet, and 3 a field value.
+        item_separator, key_separator = self.separators
+        if depth == 3 and is_prepared_list(value):
+            return '[' + item_separator.join(self.fragment(item) for item in value) + ']'
+        if depth < 3 and value.__class__ is dict:
+            return '{' + item_separator.join(
+                json.dumps(key) + key_separator + self.splice(item, depth + 1) for key, item in value.items()) + '}'
+        if depth < 3 and value.__class__ is list:
+            return '[' + item_separator.join(self.splice(item, depth + 1) for item in value) + ']'
+        return json.dumps(value, separators=self.separators)
+
+    def fragment(self, prepared):
+        if prepared.__class__ is not Prepared:
+            return json.dumps(prepared, separators=self.separators)
+        try:
+            return prepared.encodings[self]
+        except KeyError:
+            encoded = prepared.encodings[self] = json.dumps(prepared, separators=self.separators)
+            return encoded
+
+
+def is_prepared_list(value):
+    return value.__class__ is list and len(value) > 0 and value[0].__class__ is Prepared
+
+
+encode_json = JSONEncoder()
+encode_json_compact = JSONEncoder(compact=True)
+
+
+class WireCodec:
+    """
+    Serializes transactions for SocketSession. Calling a codec with a Sendable returns a complete frame (the 4-byte
+    length header followed by the payload), so codecs can be handed straight to Sendable.encode. Binary codecs carry
+    Binary fields as raw bytes rather than base64.
+    """
+
+    name = None
+    binary = False
+
+    def __call__(self, data: Sendable) -> bytes:
+        payload = self.dumps(data.to_dict(self.binary))
+        return header.pack(len(payload)) + payload
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, self.name)
+
+    def dumps(self, value) -> bytes:
+        raise NotImplementedError()
+
+    def loads(self, payload: bytes):
+        raise NotImplementedError()
+
+
+class JSONCodec (WireCodec):
+    name = 'json'
+
+    def dumps(self, value):
+        return encode_json(value).encode('utf-8')
+
+    def loads(self, payload):
+        return json.loads(payload)
+
+
+class MessagePackCodec (WireCodec):
+    name = 'msgpack'
+    binary = True
+
+    def dumps(self, value):
+        return msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, payload):
+        return msgpack.unpackb(payload, raw=False)
+
+
+class CBORCodec (WireCodec):
+    name = 'cbor'
+    binary = True
+
+    def dumps(self, value):
+        return cbor2.dumps(value)
+
+    def loads(self, payload):
+        return cbor2.loads(payload)
+
+
+# Codecs a socket client may ask for, by name. Binary codecs whose library isn't installed are left out.
+wire_codecs = {'json': JSONCodec()}
+if msgpack is not None:
+    wire_codecs['msgpack'] = MessagePackCodec()
+if cbor2 is not None:
+    wire_codecs['cbor'] = CBORCodec()
+
+
+class Compressor:
+    """
+    Compression a socket session may negotiate (see NegotiateCodec) for frame payloads. Decompression is limited to
+    max_size bytes of output, so a small frame can't expand into an arbitrarily large one.
+    """
+
+    name = None
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, self.name)
+
+    def compress(self, payload) -> bytes:
+        raise NotImplementedError()
+
+    def decompress(self, payload, max_size) -> bytes:
+        raise NotImplementedError()
+
+
+class ZlibCompressor (Compressor):
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, payload):
+        return zlib.compress(payload, self.level)
+
+    def decompress(self, payload, max_size):
+        decompressor = zlib.decompressobj()
+        try:
+            data = decompressor.decompress(payload, max_size)
+        except zlib.error as e:
+            raise ProtocolError('Invalid compressed frame: {}'.format(e))
+        if decompressor.unconsumed_tail:
+            raise ProtocolError('Compressed frame exceeds the maximum of {} bytes.'.format(max_size))
+        if not decompressor.eof:
+            raise ProtocolError('Invalid compressed frame: incomplete stream')
+        return data
+
+
+class ZstdCompressor (Compressor):
+    name = 'zstd'
+
+    def __init__(self, level=3):
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, payload):
+        return self.compressor.compress(payload)
+
+    def decompress(self, payload, max_size):
+        try:
+            # Check the size in the header first, since decompress allocates however much it says.
+            if zstandard.frame_content_size(payload) > max_size:
+                raise ProtocolError('Compressed frame exceeds the maximum of {} bytes.'.format(max_size))
+            return self.decompressor.decompress(payload, max_output_size=max_size)
+        except zstandard.ZstdError as e:
+            raise ProtocolError('Invalid compressed frame: {}'.format(e))
+
+
+class CompressingCodec (WireCodec):
+    """
+    Wraps a WireCodec, compressing payloads of at least threshold bytes and flagging their frames as COMPRESSED. The
+    uncompressed frame comes from Sendable.encode, so a Broadcast is only serialized once for both kinds of session.
+    """
+
+    def __init__(self, codec, compressor, threshold=512):
+        self.codec = codec
+        self.compressor = compressor
+        self.threshold = threshold
+        self.name = codec.name
+        self.binary = codec.binary
+
+    def __repr__(self):
+        return '<{} {}+{}>'.format(self.__class__.__name__, self.name, self.compressor.name)
+
+    def __call__(self, data: Sendable) -> bytes:
+        frame = data.encode(self.codec)
+        if len(frame) - header.size < self.threshold:
+            return frame
+        with memoryview(frame) as view:
+            payload = self.compressor.compress(view[header.size:])
+        if len(payload) >= len(frame) - header.size:
+            # Not worth it (encrypted data doesn't compress, for one).
+            return frame
+        return header.pack(len(payload) | COMPRESSED) + payload
+
+    def dumps(self, value):
+        return self.codec.dumps(value)
+
+    def loads(self, payload):
+        return self.codec.loads(payload)
+
+
+@functools.lru_cache(maxsize=None)
+def compressing_codec(codec, compressor, threshold):
+    """
+    Returns the CompressingCodec for codec and compressor, which is shared by every session using them so that each
+    Broadcast is compressed once for all of them.
+    """
+    return CompressingCodec(codec, compressor, threshold)
+
+
+# Compression a socket client may ask for, by name. zstd is left out if the zstandard package isn't installed.
+compressors = {'zlib': ZlibCompressor()}
+if zstandard is not None:
+    compressors['zstd'] = ZstdCompressor()
@@ -0,0 +1,97 @@
+from logging.handlers import QueueHandler, QueueListener
+
+import json
+import logging
+import queue
+import random
+import sys
+
+
+logger = logging.getLogger('neolith.wire')
+
+# Fraction of messages logged when wire logging is enabled, and the handler/listener installed by configure_wire_log.
+sample_rate = 1.0
+installed_handler = None
+listener = None
+# Whether records are formatted by the listener thread rather than wherever they're logged.
+queued = False
+
+
+class WireData:
+    """
+    Defers serializing data (a Sendable, or the dict it prepared) until (and unless) a log record using it is actually
+    formatted.
+    """
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        data = self.data
+        return json.dumps(data if isinstance(data, dict) else data.to_dict())
+
+
+class WireQueueHandler (QueueHandler):
+    """
+    Queues records as they are, where QueueHandler would format them first, so they're only formatted (and their data
+    serialized) by the listener thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def log_wire(session, direction, data):
+    """ Logs data sent to (<--) or received from (-->) session, if wire logging is enabled and this one is sampled. """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    if queued:
+        # The event loop may change data (or its cached prepared dict) while the listener thread is serializing it,
+        # so the thread gets the dict data prepares now, which is never modified once it's made.
+        data = data.to_dict()
+    logger.debug('%s %s %s', session, direction, WireData(data), extra={
+        'session': session.ident,
+        'direction': 'in' if direction == '-->' else 'out',
+    })
+
+
+def configure_wire_log(enabled=False, sample=1.0, use_queue=True, stream=None):
+    """
+    Sets up (or tears down) wire logging. When use_queue is set, records are handed to a queue and formatted and written
+    to stream by a QueueListener thread, so the event loop never serializes messages for the log or blocks on log I/O.
+    """
+    global sample_rate, installed_handler, listener, queued
+    stop_wire_log()
+    sample_rate = sample
+    if not enabled:
+        return
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    if use_queue:
+        records = queue.SimpleQueue()
+        listener = QueueListener(records, handler)
+        listener.start()
+        handler = WireQueueHandler(records)
+        queued = True
+    installed_handler = handler
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+
+def stop_wire_log():
+    """ Removes anything installed by configure_wire_log, flushing any queued records first. """
+    global installed_handler, listener, queued
+    queued = False
+    if listener is not None:
+        listener.stop()
+        listener = None
+    if installed_handler is not None:
+        logger.removeHandler(installed_handler)
+        logger.setLevel(logging.NOTSET)
+        logger.propagate = True
+        installed_handler = None
@@ -32,6 +32,10 @@ setup(
     license='MIT',
     packages=find_packages(),
     install_requires=get_requirements(),
+    extras_require={
+        'msgpack': ['msgpack'],
+        'cbor': ['cbor2'],
+    },
     setup_requires=[
         'pytest-runner',
     ],
@@ -0,0 +1,65 @@
+from starlette.requests import Request
+
+from neolith.protocol import Sendable, Session
+
+import asyncio
+import json
+
+
+class DummyTransport:
+    """ Records what's written to it in place of an asyncio transport, each writelines call as a single write. """
+
+    def __init__(self):
+        self.written = []
+        self.aborted = False
+        self.closed = False
+
+    def get_extra_info(self, name):
+        return ('127.0.0.1', 12345)
+
+    def write(self, data):
+        # Like asyncio's transports, anything written once closing has started is dropped.
+        if not self.closed:
+            self.written.append(data)
+
+    def writelines(self, data):
+        if not self.closed:
+            self.written.append(b''.join(data))
+
+    def abort(self):
+        self.aborted = True
+
+    def close(self):
+        self.closed = True
+
+
+class RecordingSession (Session):
+    """ Keeps everything sent to it, after waiting delay seconds, or raises error instead if one is given. """
+
+    def __init__(self, ident=None, nickname=None, delay=0, error=None):
+        super().__init__(username='user', nickname=nickname)
+        self.ident = ident
+        self.delay = delay
+        self.error = error
+        self.received = []
+
+    async def send(self, data: Sendable):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        self.received.append(data)
+
+    def idents(self):
+        return [packet.ident for data in self.received for packet in data]
+
+
+def make_request(method, token=None, query='', body=None):
+    """ An HTTP API request, with a session token and JSON body if given. """
+    headers = [(b'x-neolith-session', token.encode())] if token else []
+    scope = {'type': 'http', 'method': method, 'path': '/api', 'headers': headers,
+             'query_string': query.encode(), 'client': ('127.0.0.1', 1234)}
+
+    async def receive():
+        return {'type': 'http.request', 'body': json.dumps(body).encode() if body is not None else b''}
+    return Request(scope, receive)
@@ -0,0 +1,70 @@
+from neolith.cache import AsyncCache
+
+import asyncio
+import unittest
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class AsyncCacheTests (unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.loads = []
+        self.data = {'alice': 'Alice'}
+        self.cache = AsyncCache(self.loader, ttl=10, negative_ttl=2, max_size=2, clock=self.clock)
+
+    async def loader(self, key):
+        self.loads.append(key)
+        await asyncio.sleep(0)
+        return self.data.get(key)
+
+    def get(self, *keys):
+        async def run():
+            return await asyncio.gather(*[self.cache.get(key) for key in keys])
+        return asyncio.run(run())
+
+    def test_single_flight(self):
+        self.assertEqual(self.get('alice', 'alice', 'alice'), ['Alice'] * 3)
+        self.assertEqual(self.loads, ['alice'])
+        self.assertEqual(self.get('alice'), ['Alice'])
+        self.assertEqual(self.loads, ['alice'])
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_expiry(self):
+        self.get('alice', 'bob')
+        self.clock.now = 5
+        self.get('alice', 'bob')
+        self.assertEqual(self.loads, ['alice', 'bob', 'bob'])
+        self.clock.now = 11
+        self.get('alice')
+        self.assertEqual(self.loads, ['alice', 'bob', 'bob', 'alice'])
+
+    def test_lru(self):
+        self.get('alice')
+        self.get('bob')
+        self.get('alice')
+        self.get('carol')
+        self.assertEqual(list(self.cache.entries), ['alice', 'carol'])
+
+    def test_invalidate(self):
+        self.assertEqual(self.get('bob'), [None])
+        self.data['bob'] = 'Bob'
+        self.cache.invalidate('bob')
+        self.assertEqual(self.get('bob'), ['Bob'])
+
+    def test_invalidate_while_loading(self):
+        async def run():
+            pending = asyncio.ensure_future(self.cache.get('bob'))
+            await asyncio.sleep(0)
+            self.cache.invalidate('bob')
+            self.assertIsNone(await pending)
+        asyncio.run(run())
+        self.assertEqual(len(self.cache), 0)
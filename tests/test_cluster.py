@@ -0,0 +1,263 @@
+import dorm
+from helpers import RecordingSession, make_request
+
+from neolith import settings
+from neolith.cache import AsyncCache
+from neolith.cluster import Cluster, LoopbackTransport, RemoteSession, TCPTransport, UnixTransport, create_cluster
+from neolith.models import Account, load_account
+from neolith.protocol import (
+    JoinChannel, PasswordSpec, PostChat, ProtocolError, SendMessage, Transaction, UserModified, fanout)
+from neolith.server import NeolithServer, WebSession
+
+import asyncio
+import json
+import os
+import socket
+import tempfile
+import unittest
+import unittest.mock
+
+
+async def settle():
+    await asyncio.sleep(0.05)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ClusterTests (unittest.TestCase):
+    """ Runs against LoopbackTransport, and the other transports in the subclasses below. """
+
+    def make_transports(self, nodes, path):
+        hub = {}
+        return [LoopbackTransport(hub) for node in nodes]
+
+    def run_cluster(self, test, count=2):
+        async def run():
+            servers = [NeolithServer() for node in range(count)]
+            nodes = ['node{}'.format(n) for n in range(count)]
+            with tempfile.TemporaryDirectory() as path:
+                for node, server, transport in zip(nodes, servers, self.make_transports(nodes, path)):
+                    server.cluster = Cluster(server, node, nodes, transport)
+                await asyncio.gather(*[server.cluster.start() for server in servers])
+                try:
+                    await test(*servers)
+                finally:
+                    for server in servers:
+                        server.cluster.close()
+                    await settle()
+        asyncio.run(run())
+
+    async def login(self, server, ident, nickname):
+        session = RecordingSession(ident, nickname)
+        server.sessions.add(session)
+        await server.authenticate(session)
+        return session
+
+    def test_routing(self):
+        async def test(a, b):
+            alice = await self.login(a, 'a', 'alice')
+            bob = await self.login(b, 'b', 'bob')
+            await settle()
+            remote = b.get(ident='a')
+            self.assertIsInstance(remote, RemoteSession)
+            self.assertEqual(remote.nickname, 'alice')
+            self.assertTrue(b.sessions.nickname_in_use('ALICE'))
+            self.assertEqual(b.sessions.local_authenticated, {bob})
+
+            await a.broadcast(UserModified(user=alice))
+            await settle()
+            self.assertEqual(bob.idents()[-1], 'user.modified')
+
+            await JoinChannel(channel='public').handle(a, alice)
+            await JoinChannel(channel='public').handle(b, bob)
+            await settle()
+            self.assertEqual(b.channels['public'].sessions, {bob, remote})
+            self.assertEqual({s.ident for s in a.channels['public'].sessions}, {'a', 'b'})
+            await PostChat(channel='public', chat='hi').handle(a, alice)
+            await settle()
+            chat = bob.received[-1]
+            self.assertEqual((chat.ident, chat.chat, chat.user.ident), ('channel.posted', 'hi', 'a'))
+            self.assertEqual(alice.received[-1].chat, 'hi')
+
+            await SendMessage(recipient='b', message='psst').handle(a, alice)
+            await settle()
+            message = bob.received[-1]
+            self.assertEqual((message.ident, message.message, message.sender.nickname), ('message', 'psst', 'alice'))
+
+            bob.nickname = 'robert'
+            await settle()
+            self.assertEqual(a.get(ident='b').nickname, 'robert')
+            await a.disconnected(alice)
+            await settle()
+            self.assertNotIn('a', b.sessions)
+            self.assertEqual(b.channels['public'].sessions, {bob})
+            self.assertIn('user.left', bob.idents())
+        self.run_cluster(test)
+
+    def test_nickname_claims(self):
+        async def test(a, b, c):
+            first, second = RecordingSession('1', 'Nick'), RecordingSession('2', 'nick')
+            a.sessions.add(first)
+            b.sessions.add(second)
+            results = await asyncio.gather(a.authenticate(first), b.authenticate(second), return_exceptions=True)
+            errors = [result for result in results if isinstance(result, ProtocolError)]
+            self.assertEqual(len(errors), 1)
+            self.assertEqual(str(errors[0]), 'This nickname is already in use.')
+            servers = {first: a, second: b}
+            winner, loser = (first, second) if first.authenticated else (second, first)
+            # Once the winner is gone, the nickname can be claimed again.
+            await servers[winner].disconnected(winner)
+            await settle()
+            await servers[loser].authenticate(loser)
+            self.assertTrue(loser.authenticated)
+        self.run_cluster(test, count=3)
+
+    def test_lost_worker(self):
+        async def test(a, b):
+            alice = await self.login(a, 'a', 'alice')
+            await self.login(b, 'b', 'bob')
+            await settle()
+            self.assertIn('b', a.sessions)
+            b.cluster.close()
+            await settle()
+            self.assertNotIn('b', a.sessions)
+            self.assertEqual(alice.idents()[-1], 'user.left')
+            self.assertEqual(a.cluster.peers, set())
+        self.run_cluster(test)
+
+    def test_batching(self):
+        async def test(a, b):
+            sessions = [await self.login(b, str(n), 'user{}'.format(n)) for n in range(5)]
+            await settle()
+            sent = []
+            send = a.cluster.transport.send
+            a.cluster.transport.send = lambda node, data: sent.append(data) or send(node, data)
+            remote = [a.get(ident=session.ident) for session in sessions]
+            await fanout(remote, UserModified(user=remote[0]))
+            await settle()
+            # The user.modified goes out once for all five sessions.
+            self.assertEqual(len(sent), 1)
+            self.assertEqual(sent[0].count(b'user.modified'), 1)
+            for session in sessions:
+                self.assertEqual(session.idents()[-1], 'user.modified')
+            # Messages sent within batch_delay of each other go out together.
+            a.cluster.batch_delay = 0.01
+            await SendMessage(recipient='0', message='one').handle(a, remote[1])
+            await SendMessage(recipient='1', message='two').handle(a, remote[0])
+            await settle()
+            self.assertEqual(len(sent), 2)
+            self.assertEqual([sessions[0].received[-1].message, sessions[1].received[-1].message], ['one', 'two'])
+        self.run_cluster(test)
+
+    def test_web_sessions(self):
+        async def test(a, b):
+            session = WebSession(a, idle_timeout=0)
+            await a.connected(session)
+            session.username = session.nickname = 'web'
+            await session.send(UserModified(user=session))
+            self.assertEqual(b.cluster.token_node(session.token), a.cluster.node)
+            # Requests with the session's token that reach another node are passed on to the one with the session.
+            response = await b.web_handler(make_request('GET', session.token, 'since=0'))
+            self.assertEqual(response.headers['x-neolith-last-event'], '1')
+            self.assertEqual(list(json.loads(response.body)[0]), ['user.modified'])
+            response = await b.web_handler(make_request('POST', session.token, body={'txid': '1', 'user.list': {}}))
+            self.assertEqual(json.loads(response.body), {'txid': '1', 'error': 'This request requires authentication.'})
+            response = await b.events_handler(make_request('GET', session.token, 'since=0'))
+            chunk = await response.body_iterator.__anext__()
+            await response.body_iterator.aclose()
+            self.assertTrue(chunk.startswith(b'id: 1\ndata: {"user.modified"'))
+            response = await b.web_handler(make_request('GET', a.cluster.tag_token('bogus')))
+            self.assertEqual(response.status_code, 401)
+        self.run_cluster(test)
+
+    def test_accounts(self):
+        dorm.setup(models=[Account])
+
+        async def challenge(server, username):
+            session = RecordingSession()
+            await server.connected(session)
+            await server.handle(session, Transaction({'challenge': {'username': username, 'nonce': 'bm9uY2U='}}))
+            return session.received[-1]
+
+        async def test(a, b):
+            # Logging in before signing up leaves b with a cached miss for the username.
+            self.assertEqual((await challenge(b, 'newcomer')).error, 'Unknown user.')
+            # Each node is a process of its own, with its own account cache (and Account.observer).
+            with unittest.mock.patch.object(Account, 'observer', a.cluster), \
+                    unittest.mock.patch('neolith.models.accounts', AsyncCache(load_account)):
+                await Account.insert(username='Newcomer', email='newcomer@example.com',
+                    password_spec=PasswordSpec(salt=os.urandom(32)), stored_key=b'stored', server_key=b'server')
+            await settle()
+            response = (await challenge(b, 'newcomer')).first('challenge.response')
+            self.assertIsNotNone(response)
+        self.run_cluster(test)
+
+
+class UnixClusterTests (ClusterTests):
+
+    def make_transports(self, nodes, path):
+        addresses = {node: os.path.join(path, node + '.sock') for node in nodes}
+        return [UnixTransport(addresses) for node in nodes]
+
+
+class TCPClusterTests (ClusterTests):
+
+    def make_transports(self, nodes, path):
+        addresses = {node: ('127.0.0.1', free_port()) for node in nodes}
+        return [TCPTransport(addresses, 'secret') for node in nodes]
+
+    def test_secret(self):
+        addresses = {'node0': ('127.0.0.1', free_port()), 'node1': ('127.0.0.1', free_port())}
+        with self.assertRaises(ValueError):
+            TCPTransport(addresses)
+
+        async def run():
+            server, impostor = NeolithServer(), NeolithServer()
+            transports = [TCPTransport(addresses, 'secret'), TCPTransport(addresses, 'guess')]
+            for transport in transports:
+                transport.startup_timeout = 0.1
+            server.cluster = Cluster(server, 'node0', addresses, transports[0])
+            impostor.cluster = Cluster(impostor, 'node1', addresses, transports[1])
+            with self.assertLogs('neolith.cluster', 'WARNING') as logs:
+                await asyncio.gather(server.cluster.start(), impostor.cluster.start())
+                # Claiming to be a node isn't enough, without proof.
+                reader, writer = await asyncio.open_connection(*addresses['node0'])
+                writer.write(b'node1 challenge\n')
+                await reader.readline()
+                writer.write(b'proof\n')
+                self.assertEqual(await reader.read(), b'')
+                writer.close()
+            server.cluster.close()
+            impostor.cluster.close()
+            await settle()
+            self.assertEqual((server.cluster.peers, impostor.cluster.peers), (set(), set()))
+            self.assertIn('node node1 does not know the cluster secret', '\n'.join(logs.output))
+        asyncio.run(run())
+
+
+class CreateClusterTests (unittest.TestCase):
+
+    def test_workers(self):
+        with unittest.mock.patch.multiple(settings, WORKERS=3, CLUSTER_NODES=[]):
+            self.assertIsNone(create_cluster(None))
+            cluster = create_cluster(None, 1, '/tmp/neolith')
+        self.assertIsInstance(cluster.transport, UnixTransport)
+        self.assertEqual(cluster.node, '1')
+        self.assertEqual(cluster.transport.addresses['2'], '/tmp/neolith/worker-2.sock')
+
+    def test_nodes(self):
+        nodes = ['10.0.0.1:9000', '10.0.0.2:9000']
+        with unittest.mock.patch.multiple(settings, WORKERS=2, CLUSTER_NODES=nodes, CLUSTER_NODE='10.0.0.2:9000',
+                                          CLUSTER_SECRET='secret'):
+            cluster = create_cluster(None, 1, '/tmp/neolith')
+        self.assertIsInstance(cluster.transport, TCPTransport)
+        self.assertEqual(cluster.node, '10.0.0.2:9001')
+        self.assertEqual(cluster.nodes, ['10.0.0.1:9000', '10.0.0.1:9001', '10.0.0.2:9000', '10.0.0.2:9001'])
+        self.assertEqual(cluster.transport.addresses['10.0.0.1:9001'], ('10.0.0.1', 9001))
+        with unittest.mock.patch.multiple(settings, CLUSTER_NODES=nodes, CLUSTER_NODE=nodes[0], CLUSTER_SECRET=None):
+            with self.assertRaises(ValueError):
+                create_cluster(None)
@@ -0,0 +1,79 @@
+import pytest
+
+from neolith.protocol import (
+    Binary, Boolean, Container, Dictionary, Integer, List, Object, ProtocolError, String, Transaction, get_codec,
+    registered_packets, use_codecs)
+
+import json
+
+
+def sample_value(field):
+    if isinstance(field, Object):
+        return sample(field.python_type)
+    elif isinstance(field, Dictionary):
+        return {'abc': sample(field.item_type)} if issubclass(field.item_type, Container) else {'abc': 'def'}
+    elif isinstance(field, List):
+        return [sample(field.item_type)] if issubclass(field.item_type, Container) else [field.item_type(1)]
+    elif isinstance(field, Binary):
+        return b'\x00\x01binary\xff'
+    elif isinstance(field, Boolean):
+        return True
+    elif isinstance(field, Integer):
+        return 42
+    elif isinstance(field, String):
+        return 'some {} value'.format(field.name)
+    raise TypeError(field)
+
+
+def sample(container_class):
+    instance = container_class()
+    for name, field, required, readonly in container_class._schema:
+        if not readonly:
+            setattr(instance, name, sample_value(field))
+    return instance
+
+
+def dumps(data):
+    return json.dumps(data).encode('utf-8')
+
+
+@pytest.mark.parametrize('ident', sorted(registered_packets))
+def test_codec_matches(ident):
+    packet_class = registered_packets[ident]
+    codec = get_codec(packet_class)
+    p = sample(packet_class)
+    prepared = p.prepare()
+    assert dumps(codec.encode(p)) == dumps(prepared)
+    assert dumps(codec.encode(codec.decode(prepared))) == dumps(packet_class.unpack(prepared).prepare())
+    # Unset fields should pick up the same defaults, or fail on the same required field.
+    try:
+        expected = dumps(packet_class().prepare())
+    except ProtocolError as e:
+        with pytest.raises(ProtocolError) as info:
+            codec.encode(packet_class())
+        assert str(info.value) == str(e)
+    else:
+        assert dumps(codec.encode(packet_class())) == expected
+
+
+@pytest.mark.parametrize('ident', sorted(registered_packets))
+def test_transaction_codecs(ident):
+    p = sample(registered_packets[ident])
+    tx = Transaction(txid='123', packets=[p, p])
+    expected = dumps(tx.to_dict())
+    use_codecs()
+    try:
+        assert dumps(tx.to_dict()) == expected
+        assert dumps(p.to_dict()) == dumps({ident: [p.prepare()]})
+        assert dumps(Transaction(json.loads(expected)).to_dict()) == expected
+        assert dumps(Transaction(json.loads(expected), lazy=True).to_dict()) == expected
+    finally:
+        use_codecs(False)
+
+
+def test_codec_type_checks():
+    codec = get_codec(registered_packets['channel.post'])
+    with pytest.raises(AttributeError):
+        codec.decode({'channel': 5})
+    with pytest.raises(AttributeError):
+        registered_packets['channel.post'].unpack({'channel': 5})
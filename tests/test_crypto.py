@@ -0,0 +1,54 @@
+from neolith.crypto import CryptoExecutor, ExecutorBusy, verify_password, verify_proof
+from neolith.protocol import PasswordSpec
+
+import asyncio
+import hashlib
+import hmac
+import os
+import threading
+import unittest
+
+
+class CryptoTests (unittest.TestCase):
+
+    def setUp(self):
+        self.spec = PasswordSpec(salt=os.urandom(16), iterations=1000)
+        salted_password = self.spec.generate('secret')
+        self.client_key = hmac.new(salted_password, b'Client Key', 'sha256').digest()
+        self.server_key = hmac.new(salted_password, b'Server Key', 'sha256').digest()
+        self.stored_key = hashlib.sha256(self.client_key).digest()
+
+    def test_verify_password(self):
+        self.assertTrue(verify_password(self.spec, self.stored_key, 'secret'))
+        self.assertFalse(verify_password(self.spec, self.stored_key, 'wrong'))
+        self.assertFalse(verify_password(self.spec, None, 'secret'))
+
+    def test_verify_proof(self):
+        nonce = os.urandom(32)
+        client_signature = hmac.new(self.stored_key, nonce, 'sha256').digest()
+        proof = bytes(a ^ b for a, b in zip(self.client_key, client_signature))
+        expected = hmac.new(self.server_key, nonce, 'sha256').digest()
+        self.assertEqual(verify_proof(self.stored_key, self.server_key, nonce, proof), expected)
+        self.assertIsNone(verify_proof(self.stored_key, self.server_key, nonce, os.urandom(32)))
+
+    def test_executor_queue(self):
+        executor = CryptoExecutor(workers=1, max_queue=1)
+        release = threading.Event()
+
+        async def run():
+            running = asyncio.ensure_future(executor.run(release.wait))
+            waiting = asyncio.ensure_future(executor.run(verify_password, self.spec, self.stored_key, 'secret'))
+            await asyncio.sleep(0.01)
+            self.assertEqual(executor.stats()['running'], 1)
+            self.assertEqual(executor.queued, 1)
+            with self.assertRaises(ExecutorBusy):
+                await executor.run(verify_password, self.spec, self.stored_key, 'secret')
+            release.set()
+            return await running, await waiting
+
+        try:
+            self.assertEqual(asyncio.run(run()), (True, True))
+        finally:
+            executor.shutdown()
+        self.assertEqual(executor.stats()['completed'], 2)
+        self.assertEqual(executor.rejected, 1)
@@ -0,0 +1,56 @@
+from neolith.database import Database, Histogram
+
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+
+
+class DatabaseTests (unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'test.db')
+        connection = sqlite3.connect(self.path)
+        connection.execute('CREATE TABLE account (username text UNIQUE, email text)')
+        connection.commit()
+        connection.close()
+        self.database = Database(self.path, readers=2, batch_size=10)
+
+    def tearDown(self):
+        self.database.close()
+        self.tempdir.cleanup()
+
+    def test_batched_writes(self):
+        async def run():
+            inserts = [self.database.execute('INSERT INTO account (username, email) VALUES (?, ?)', [name, name])
+                for name in ('a', 'b', 'a', 'c')]
+            results = await asyncio.gather(*inserts, return_exceptions=True)
+            rows = await self.database.fetch('SELECT username FROM account ORDER BY username')
+            return results, [row['username'] for row in rows]
+
+        results, usernames = asyncio.run(run())
+        # The duplicate fails on its own, without rolling back the rest of its batch.
+        self.assertIsInstance(results[2], sqlite3.IntegrityError)
+        self.assertEqual(usernames, ['a', 'b', 'c'])
+        self.assertEqual(results[3].rowcount, 1)
+        stats = self.database.stats()
+        self.assertLessEqual(stats['write_batches'], 4)
+        self.assertEqual(stats['latency']['write']['count'], 4)
+        self.assertEqual(stats['latency']['read']['count'], 1)
+
+    def test_wal(self):
+        rows = asyncio.run(self.database.fetch('PRAGMA journal_mode'))
+        self.assertEqual(rows[0][0], 'wal')
+
+
+def test_histogram():
+    histogram = Histogram()
+    for seconds in (0.0001, 0.003, 0.003, 10):
+        histogram.observe(seconds)
+    stats = histogram.stats()
+    assert stats['count'] == 4
+    assert stats['buckets']['0.0005'] == 1
+    assert stats['buckets']['0.005'] == 2
+    assert stats['buckets']['inf'] == 1
@@ -0,0 +1,57 @@
+from helpers import RecordingSession
+
+from neolith.protocol import Broadcast, Transaction, deliver, fanout
+
+import asyncio
+import time
+import unittest
+
+
+class DeliveryTests (unittest.TestCase):
+
+    def test_isolation(self):
+        stalled = RecordingSession(delay=10)
+        broken = RecordingSession(error=ConnectionResetError())
+        healthy = [RecordingSession() for i in range(10)]
+        tx = Transaction(txid='abc')
+        start = time.monotonic()
+        failed = asyncio.run(fanout([stalled, broken] + healthy, tx, timeout=0.1))
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(set(failed), {stalled, broken})
+        for s in healthy:
+            self.assertEqual(len(s.received), 1)
+            self.assertIsInstance(s.received[0], Broadcast)
+            self.assertIs(s.received[0].data, tx)
+
+    def test_concurrency(self):
+        sessions = [RecordingSession(delay=0.05) for i in range(8)]
+        start = time.monotonic()
+        asyncio.run(fanout(sessions, Transaction(), concurrency=8))
+        self.assertLess(time.monotonic() - start, 0.3)
+        self.assertTrue(all(s.received for s in sessions))
+
+    def test_immediate(self):
+        class ImmediateSession (RecordingSession):
+            async def send(self, data):
+                self.received.append(data)
+
+        immediate = [ImmediateSession() for i in range(5)]
+        waiting = [RecordingSession(delay=0.01) for i in range(5)]
+
+        async def run():
+            tasks = len(asyncio.all_tasks())
+            sending = asyncio.ensure_future(fanout(immediate + waiting, Transaction(), concurrency=2))
+            await asyncio.sleep(0)
+            # Sends that finish without waiting don't get a task. The two that filled the semaphore and the three
+            # waiting for it do, alongside fanout itself.
+            self.assertEqual([len(s.received) for s in immediate], [1] * 5)
+            self.assertEqual(len(asyncio.all_tasks()) - tasks, 1 + 2 + 3)
+            return await sending
+
+        self.assertEqual(asyncio.run(run()), [])
+        self.assertEqual([len(s.received) for s in waiting], [1] * 5)
+
+    def test_per_recipient(self):
+        sessions = [RecordingSession() for i in range(3)]
+        asyncio.run(deliver((s, Transaction(txid=str(i))) for i, s in enumerate(sessions)))
+        self.assertEqual([s.received[0].txid for s in sessions], ['0', '1', '2'])
@@ -0,0 +1,167 @@
+from helpers import make_request
+
+from neolith import settings
+from neolith.events import EventBuffer, EventStream, event_seq, format_event
+from neolith.outbox import Outbox
+from neolith.protocol import UserModified
+from neolith.server import NeolithServer, WebSession
+
+import asyncio
+import json
+import unittest
+import unittest.mock
+
+
+class EventBufferTests (unittest.TestCase):
+
+    def test_since(self):
+        buffer = EventBuffer(3)
+        self.assertEqual(buffer.since(0), (0, []))
+        self.assertEqual([buffer.append(event) for event in 'abcde'], [1, 2, 3, 4, 5])
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual(buffer.since(3), (0, [(4, 'd'), (5, 'e')]))
+        self.assertEqual(buffer.since(2), (0, [(3, 'c'), (4, 'd'), (5, 'e')]))
+        # Events 1 and 2 were pushed out of the buffer.
+        self.assertEqual(buffer.since(0), (2, [(3, 'c'), (4, 'd'), (5, 'e')]))
+        self.assertEqual(buffer.since(5), (0, []))
+        self.assertEqual(buffer.since(10), (0, []))
+
+    def test_wait(self):
+        async def run():
+            buffer = EventBuffer()
+            self.assertFalse(await buffer.wait(0, 0.01))
+            waiters = [asyncio.ensure_future(buffer.wait(0, 1.0)) for n in range(2)]
+            await asyncio.sleep(0)
+            buffer.append('a')
+            self.assertEqual(await asyncio.gather(*waiters), [True, True])
+            self.assertTrue(await buffer.wait(0))
+        asyncio.run(run())
+
+    def test_event_seq(self):
+        self.assertEqual(event_seq(format_event(12, '{}')), 12)
+        self.assertIsNone(event_seq(EventStream.keepalive))
+        self.assertIsNone(event_seq(b'event: missed\ndata: 3\n\n'))
+
+
+class WebSessionTests (unittest.TestCase):
+
+    def test_poll(self):
+        async def run():
+            session = WebSession(idle_timeout=0)
+            user = WebSession()
+            user.ident, user.username, user.nickname = 'u', 'user', 'user'
+            await session.send(UserModified(user=user))
+            last, missed, events = await session.poll(timeout=0.01)
+            self.assertEqual((last, missed), (1, 0))
+            self.assertEqual(json.loads(events[0])['user.modified'][0]['user']['nickname'], 'user')
+            # Without a cursor, polls pick up after the last one.
+            self.assertEqual(await session.poll(timeout=0.01), (1, 0, []))
+            # A cursor resumes from anywhere still buffered.
+            self.assertEqual(await session.poll(0, timeout=0.01), (1, 0, events))
+            # The first event to come in while waiting is held back briefly to batch any that follow it.
+            poll = asyncio.ensure_future(session.poll(timeout=1.0, linger=0.05))
+            await asyncio.sleep(0.01)
+            await session.send(UserModified(user=user))
+            await asyncio.sleep(0.01)
+            await session.send(UserModified(user=user))
+            last, missed, events = await poll
+            self.assertEqual((last, missed, len(events)), (3, 0, 2))
+        asyncio.run(run())
+
+    def test_expiry(self):
+        async def run():
+            server = NeolithServer()
+            session = WebSession(server, idle_timeout=0.05)
+            await server.connected(session)
+            session.touch()
+            # Polling keeps the session alive.
+            await session.poll(timeout=0.1)
+            self.assertIs(server.get(token=session.token), session)
+            await asyncio.sleep(0.1)
+            self.assertIsNone(server.get(token=session.token))
+        asyncio.run(run())
+
+    def test_web_handler(self):
+        async def run():
+            server = NeolithServer()
+            response = await server.web_handler(make_request('GET', 'bogus'))
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(len(server.sessions), 0)
+            session = WebSession(server, idle_timeout=0)
+            await server.connected(session)
+            session.username = session.nickname = 'web'
+            await session.send(UserModified(user=session))
+            response = await server.web_handler(make_request('GET', session.token, 'since=0'))
+            self.assertEqual(response.headers['x-neolith-last-event'], '1')
+            self.assertNotIn('x-neolith-missed', response.headers)
+            self.assertEqual(list(json.loads(response.body)[0]), ['user.modified'])
+            response = await server.web_handler(make_request('GET', session.token, 'since=x'))
+            self.assertEqual(response.status_code, 400)
+            response = await server.events_handler(make_request('GET', query='token=bogus'))
+            self.assertEqual(response.status_code, 401)
+            response = await server.events_handler(make_request('GET', query='token=' + session.token))
+            self.assertEqual(response.media_type, 'text/event-stream')
+        asyncio.run(run())
+
+    def test_stream(self):
+        async def run():
+            session = WebSession(idle_timeout=0)
+            session.ident, session.username, session.nickname = 'w', 'web', 'web'
+            await session.send(UserModified(user=session))
+            await session.send(UserModified(user=session))
+            stream = session.stream(1, heartbeat=0.05)
+            # Resuming after event 1 replays event 2, then carries on with new events as they're sent.
+            chunk = await stream.__anext__()
+            self.assertTrue(chunk.startswith(b'id: 2\ndata: {"user.modified"'))
+            self.assertTrue(chunk.endswith(b'\n\n'))
+            await session.send(UserModified(user=session))
+            self.assertTrue((await stream.__anext__()).startswith(b'id: 3\n'))
+            self.assertEqual(await stream.__anext__(), EventStream.keepalive)
+            # A new stream replaces the old one.
+            replacement = session.stream(3, heartbeat=0.05)
+            self.assertEqual(await replacement.__anext__(), EventStream.keepalive)
+            with self.assertRaises(StopAsyncIteration):
+                await stream.__anext__()
+            await replacement.aclose()
+            self.assertIsNone(session.events)
+        asyncio.run(run())
+
+    def test_stream_backpressure(self):
+        async def run(policy):
+            session = WebSession(idle_timeout=0)
+            session.ident, session.username, session.nickname = 'w', 'web', 'web'
+            with unittest.mock.patch.multiple(settings, OUTBOX_LIMIT=1000, OUTBOX_POLICY=policy):
+                stream = session.stream(heartbeat=1.0)
+                sending = asyncio.ensure_future(stream.__anext__())
+                await session.send(UserModified(user=session))
+                await sending
+            # While that chunk is being sent, events queue up in the outbox, until there are too many. Whatever the
+            # policy, none are dropped from the stream, it's closed instead.
+            for n in range(20):
+                await session.send(UserModified(user=session))
+            self.assertTrue(session.events.closed)
+            with self.assertRaises(StopAsyncIteration):
+                await stream.__anext__()
+            # The events are still buffered for the client to resume from, after the only one it was sent.
+            self.assertEqual(session.buffer.last, 21)
+            self.assertEqual(session.delivered, 1)
+        for policy in Outbox.policies:
+            with self.subTest(policy=policy):
+                asyncio.run(run(policy))
+
+    def test_stream_delivered(self):
+        async def run():
+            session = WebSession(idle_timeout=0)
+            session.ident, session.username, session.nickname = 'w', 'web', 'web'
+            for n in range(3):
+                await session.send(UserModified(user=session))
+            stream = session.stream(1, heartbeat=1.0)
+            self.assertTrue((await stream.__anext__()).startswith(b'id: 2\n'))
+            await session.send(UserModified(user=session))
+            self.assertTrue((await stream.__anext__()).startswith(b'id: 4\n'))
+            # The client went away while event 4 was being sent, so only 2 and 3 are known to have made it.
+            await stream.aclose()
+            self.assertEqual(session.delivered, 3)
+            last, missed, events = await session.poll(timeout=0)
+            self.assertEqual((last, missed, len(events)), (4, 0, 1))
+        asyncio.run(run())
@@ -0,0 +1,66 @@
+import pytest
+
+from neolith.framing import COMPRESSED, FrameBuffer, header
+from neolith.protocol import ProtocolError
+from neolith.wire import ZlibCompressor
+
+import os
+import random
+import zlib
+
+
+def frame(payload):
+    return header.pack(len(payload)) + payload
+
+
+def test_chunked_frames():
+    rng = random.Random(1234)
+    payloads = [os.urandom(rng.randrange(0, 300)) for i in range(500)]
+    stream = b''.join(frame(p) for p in payloads)
+    buf = FrameBuffer(initial_size=64)
+    received = []
+    pos = 0
+    while pos < len(stream):
+        size = rng.randrange(1, 700)
+        buf.feed(stream[pos:pos + size])
+        received.extend(buf.frames())
+        pos += size
+    assert received == payloads
+    assert len(buf) == 0
+
+
+def test_partial_frame():
+    buf = FrameBuffer()
+    buf.feed(frame(b'first') + frame(b'second')[:7])
+    assert buf.frames() == [b'first']
+    assert buf.frames() == []
+    buf.feed(frame(b'second')[7:])
+    assert buf.frames() == [b'second']
+
+
+def test_max_frame_size():
+    buf = FrameBuffer(max_frame_size=16)
+    buf.feed(frame(b'x' * 16))
+    assert buf.frames() == [b'x' * 16]
+    # The header alone is enough to reject a frame, without waiting for (or buffering) its payload.
+    buf.feed(header.pack(4 * 1024 * 1024 * 1024 - 1))
+    with pytest.raises(ProtocolError):
+        buf.frames()
+
+
+def test_compressed_frames():
+    payload = b'chat ' * 100
+    compressed = zlib.compress(payload)
+    buf = FrameBuffer(max_frame_size=1000)
+    buf.feed(header.pack(len(compressed) | COMPRESSED) + compressed)
+    with pytest.raises(ProtocolError):
+        buf.frames()
+    buf = FrameBuffer(max_frame_size=1000)
+    buf.decompressor = ZlibCompressor()
+    buf.feed(header.pack(len(compressed) | COMPRESSED) + compressed + frame(b'raw'))
+    assert buf.frames() == [payload, b'raw']
+    # Frames may not decompress to more than max_frame_size either.
+    compressed = zlib.compress(b'x' * 1001)
+    buf.feed(header.pack(len(compressed) | COMPRESSED) + compressed)
+    with pytest.raises(ProtocolError):
+        buf.frames()
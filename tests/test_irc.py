@@ -0,0 +1,130 @@
+from helpers import DummyTransport
+
+from neolith import settings
+from neolith.constants import ERR, RPL
+from neolith.irc import MAX_LINE_LENGTH, IRCSession, escape, format_line, format_list, irc_lines
+from neolith.protocol import Broadcast, ChatPosted, Session, valid_nickname
+from neolith.server import NeolithServer
+
+import asyncio
+
+
+def test_escape():
+    assert escape('word') == 'word'
+    assert escape('two words') == ':two words'
+    assert escape('') == ':'
+    assert escape(':)') == '::)'
+    # Line endings would otherwise start a new command.
+    assert escape('hi\r\nQUIT') == ':hi QUIT'
+
+
+def test_format_line():
+    name = settings.SERVER_NAME
+    assert format_line('PRIVMSG', '#public', 'hi there', prefix='nick') == b':nick PRIVMSG #public :hi there\r\n'
+    assert format_line('CAP', '*', 'LS', 'sasl') == ':{} CAP * LS sasl\r\n'.format(name).encode()
+    assert format_line(RPL.NOTOPIC, 'nick', '#public') == ':{} 331 nick #public\r\n'.format(name).encode()
+
+    # Nothing can start a new line, and the prefix and middle parameters can't be split up either.
+    line = format_line('PRIVMSG', ':#pub lic', 'a\0b', prefix='x\r\n:evil 001')
+    assert line == b':x_:evil_001 PRIVMSG _#pub_lic :a b\r\n'
+    assert format_line('PRIVMSG', '', 'hi', prefix='nick') == b':nick PRIVMSG * hi\r\n'
+
+
+def test_forged_lines():
+    user = Session(ident='a', username='u', nickname='x\r\n:evil 001 victim :pwn\r\n:x', hostname='h')
+    data = Broadcast(ChatPosted(channel='public', chat='hi', user=user))
+    line = data.encode(irc_lines)[0][2]
+    assert line.count(b'\r\n') == 1 and line.endswith(b' PRIVMSG #public hi\r\n')
+
+
+def test_valid_nickname():
+    for nickname in ('nick', 'Nick_2', '[away]', 'ñandú'):
+        assert valid_nickname(nickname)
+    for nickname in ('', None, 'two words', 'x\r\ny', 'a\0', ':nick', '#chan', 'a!b', 'a@b', 'a,b', 'a*'):
+        assert not valid_nickname(nickname)
+
+
+def test_format_list():
+    names = ['user{}'.format(n) for n in range(500)]
+    lines = format_list(RPL.NAMREPLY, 'nick', '=', '#public', items=names).split(b'\r\n')[:-1]
+    assert len(lines) > 1
+    assert all(len(line) + 2 <= MAX_LINE_LENGTH for line in lines)
+    assert len(lines[0]) + 2 > MAX_LINE_LENGTH - len(' user499')
+    received = [name for line in lines for name in line.split(b' :', 1)[1].decode().split(' ')]
+    assert received == names
+    assert format_list(RPL.NAMREPLY, 'nick', '=', '#public', items=[]).endswith(b' #public :\r\n')
+
+
+def test_shared_lines():
+    user = Session(ident='a', username='user', nickname='nick', hostname='host')
+    data = Broadcast(ChatPosted(channel='public', chat='hello there', user=user))
+    lines = data.encode(irc_lines)
+    assert data.encode(irc_lines) is lines
+    assert lines[0][1:] == ('a', b':nick!user@host PRIVMSG #public :hello there\r\n')
+
+
+def test_names_reply():
+    async def run():
+        server = NeolithServer()
+        channel = server.channels[settings.PUBLIC_CHANNEL]
+        for n in range(200):
+            member = Session(ident=str(n), username='user', nickname='user{}'.format(n), authenticated=True)
+            channel.add(member)
+        session = IRCSession(server)
+        session.connection_made(DummyTransport())
+        session.nickname = 'nick'
+        await session.handle_JOIN('#' + settings.PUBLIC_CHANNEL)
+        await asyncio.sleep(0)
+        return b''.join(session.transport.written).split(b'\r\n')
+    lines = asyncio.run(run())
+    names = [line for line in lines if b' 353 nick = #' in line]
+    assert len(names) > 1
+    assert all(len(line) + 2 <= MAX_LINE_LENGTH for line in names)
+    assert sum(len(line.split(b' :', 1)[1].split()) for line in names) == 200
+
+
+def test_quit():
+    async def run():
+        session = IRCSession(None)
+        session.connection_made(DummyTransport())
+        session.data_received(b'QUIT\r\n')
+        await asyncio.sleep(0.01)
+        return session.transport
+    transport = asyncio.run(run())
+    # The goodbye goes out before the connection is closed, even though writes are batched.
+    assert transport.written == [':{} ERROR :Bye for now!\r\n'.format(settings.SERVER_NAME).encode()]
+    assert transport.closed
+
+
+def test_invalid_nick():
+    async def run():
+        session = IRCSession(NeolithServer())
+        session.connection_made(DummyTransport())
+        await session.handle_NICK(':evil')
+        await asyncio.sleep(0)
+        return session
+    session = asyncio.run(run())
+    assert session.nickname is None
+    assert session.transport.written == [
+        ':{} {} * _evil :Erroneous nickname\r\n'.format(settings.SERVER_NAME, ERR.ERRONEUSNICKNAME).encode()]
+
+
+def test_subclass_commands():
+    class Mixin:
+        async def handle_PING(self, *params, prefix=None):
+            self.write('PONG', 'mixin')
+
+    class Session (Mixin, IRCSession):
+        async def handle_QUIT(self, *params, prefix=None):
+            self.write('ERROR', 'Not yet!')
+
+    async def run():
+        session = Session(None)
+        session.connection_made(DummyTransport())
+        session.data_received(b'PING x\r\nQUIT\r\n')
+        await asyncio.sleep(0.01)
+        return session.transport
+    transport = asyncio.run(run())
+    name = settings.SERVER_NAME
+    assert b''.join(transport.written) == ':{0} PONG mixin\r\n:{0} ERROR :Not yet!\r\n'.format(name).encode()
+    assert not transport.closed
@@ -0,0 +1,86 @@
+from helpers import DummyTransport
+
+from neolith import settings
+from neolith.irc import IRCSession
+from neolith.ircparser import IRCMessage, LineBuffer, command_table, parse_message
+
+import asyncio
+
+
+def test_parse_message():
+    assert parse_message('PRIVMSG #public :hello there') == IRCMessage({}, None, 'PRIVMSG', ['#public', 'hello there'])
+    assert parse_message(':nick!user@host privmsg  #public  hi') == \
+        IRCMessage({}, 'nick!user@host', 'PRIVMSG', ['#public', 'hi'])
+    # Trailing parameters may be empty, or contain colons and runs of spaces.
+    assert parse_message('TOPIC #public :').params == ['#public', '']
+    assert parse_message('PRIVMSG #public :a :b  c').params == ['#public', 'a :b  c']
+    assert parse_message('NICK bob:1').params == ['bob:1']
+    assert parse_message('') is None
+    assert parse_message(':prefix-only') is None
+
+
+def test_parse_tags():
+    message = parse_message(r'@id=123;+draft/reply=a\sb\:c\\d\;time :nick PRIVMSG #public :hi')
+    assert message.tags == {'id': '123', '+draft/reply': 'a b;c\\d', 'time': ''}
+    assert (message.prefix, message.command, message.params) == ('nick', 'PRIVMSG', ['#public', 'hi'])
+
+
+def test_line_buffer():
+    buf = LineBuffer()
+    assert buf.feed(b'NICK bob\r\nUSER bob 0 * :Bob\nPI') == [b'NICK bob', b'USER bob 0 * :Bob']
+    assert buf.feed(b'NG') == []
+    assert buf.feed(b' x\r') == []
+    assert buf.feed(b'\n') == [b'PING x']
+    assert len(buf) == 0
+
+
+def test_line_limits():
+    buf = LineBuffer()
+    longest = b'PRIVMSG #public :' + b'x' * (510 - 17)
+    assert buf.feed(longest + b'\r\n') == [longest]
+    assert buf.feed(longest + b'x\r\n') == [None]
+    tagged = b'@' + b'a' * 8189 + b' ' + longest
+    assert buf.feed(tagged + b'\r\n') == [tagged]
+    # A line that never ends is dropped as soon as it's too long, rather than buffered.
+    assert buf.feed(b'x' * 10000) == [None]
+    assert len(buf) == 0
+    assert buf.feed(b'x' * 10000) == []
+    assert buf.feed(b'xx\r\nPING x\r\n') == [b'PING x']
+
+
+def test_command_table():
+    class Handlers:
+        async def handle_PING(self):
+            pass
+        handle_ALIAS = handle_PING
+        handled = None
+
+    assert command_table(Handlers) == {'PING': Handlers.handle_PING, 'ALIAS': Handlers.handle_PING}
+
+    class Mixin:
+        async def handle_PONG(self):
+            pass
+
+    class Overrides (Mixin, Handlers):
+        async def handle_PING(self):
+            pass
+
+    # Inherited handlers are included, and overridden ones replaced.
+    assert command_table(Overrides) == {'PING': Overrides.handle_PING, 'PONG': Mixin.handle_PONG,
+                                        'ALIAS': Handlers.handle_PING}
+
+
+def test_dispatch():
+    async def run():
+        session = IRCSession(None)
+        session.connection_made(DummyTransport())
+        session.data_received(b'ping :neolith\r\nBOGUS x\n' + b'x' * 600 + b'\r\n')
+        await asyncio.sleep(0.01)
+        return b''.join(session.transport.written).split(b'\r\n')
+    name = settings.SERVER_NAME
+    assert asyncio.run(run()) == [
+        ':{} 421 * BOGUS :Unknown command'.format(name).encode(),
+        ':{} 417 * :Input line was too long'.format(name).encode(),
+        ':{} PONG {} neolith'.format(name, name).encode(),
+        b'',
+    ]
@@ -0,0 +1,124 @@
+from helpers import DummyTransport
+
+from neolith import settings
+from neolith.outbox import Outbox
+from neolith.protocol import Broadcast, Channel, ChannelModified, ChatPosted, Session, Transaction
+from neolith.server import NeolithServer
+
+import asyncio
+import unittest
+import unittest.mock
+
+
+class OutboxTests (unittest.TestCase):
+
+    def setUp(self):
+        self.transport = DummyTransport()
+
+    def test_passthrough(self):
+        outbox = Outbox(self.transport, limit=10)
+        outbox.write(b'x' * 100)
+        self.assertEqual(self.transport.written, [b'x' * 100])
+        self.assertEqual(outbox.depth, 0)
+
+    def test_pause_resume(self):
+        outbox = Outbox(self.transport, limit=100)
+        outbox.pause()
+        outbox.write(b'one')
+        outbox.write(b'two')
+        self.assertEqual(self.transport.written, [])
+        self.assertEqual(outbox.stats()['depth'], 2)
+        self.assertEqual(outbox.stats()['bytes'], 6)
+        outbox.resume()
+        self.assertEqual(self.transport.written, [b'one', b'two'])
+        self.assertEqual(outbox.depth, 0)
+
+    def test_drop_oldest(self):
+        outbox = Outbox(self.transport, limit=12, policy='drop')
+        outbox.pause()
+        outbox.write(b'resp', droppable=False)
+        for chat in (b'aaaa', b'bbbb', b'cccc'):
+            self.assertTrue(outbox.write(chat, droppable=True))
+        self.assertEqual(outbox.dropped, 1)
+        outbox.resume()
+        self.assertEqual(self.transport.written, [b'resp', b'bbbb', b'cccc'])
+        self.assertFalse(self.transport.aborted)
+
+    def test_coalesce(self):
+        outbox = Outbox(self.transport, limit=100, policy='coalesce')
+        outbox.pause()
+        outbox.write(b'first', droppable=True, key=('channel.modified', 'public'))
+        outbox.write(b'other', droppable=True)
+        outbox.write(b'second', droppable=True, key=('channel.modified', 'public'))
+        self.assertEqual(outbox.coalesced, 1)
+        outbox.resume()
+        self.assertEqual(self.transport.written, [b'other', b'second'])
+
+    def test_disconnect(self):
+        outbox = Outbox(self.transport, limit=10, policy='disconnect')
+        outbox.pause()
+        outbox.write(b'aaaa', droppable=True)
+        self.assertFalse(outbox.write(b'b' * 10, droppable=True))
+        self.assertTrue(self.transport.aborted)
+        self.assertFalse(outbox.write(b'more'))
+
+    def test_undroppable_overflow(self):
+        outbox = Outbox(self.transport, limit=10, policy='drop')
+        outbox.pause()
+        outbox.write(b'x' * 8)
+        outbox.write(b'y' * 8)
+        self.assertTrue(self.transport.aborted)
+
+    def test_batch(self):
+        async def run():
+            outbox = Outbox(self.transport, limit=10, batch=True)
+            for chat in (b'aaaa', b'bbbb', b'cccc'):
+                outbox.write(chat, droppable=True)
+            # Nothing goes out until the next iteration of the loop, and then it goes out in one write.
+            self.assertEqual(self.transport.written, [])
+            await asyncio.sleep(0)
+            self.assertEqual(self.transport.written, [b'aaaabbbbcccc'])
+            outbox.write(b'dddd')
+            outbox.pause()
+            await asyncio.sleep(0)
+            self.assertEqual(len(self.transport.written), 1)
+            # Once paused, the limit applies as usual.
+            outbox.write(b'eeee', droppable=True)
+            outbox.write(b'ffff', droppable=True)
+            self.assertEqual(outbox.dropped, 1)
+            outbox.resume()
+            self.assertEqual(self.transport.written[1:], [b'ddddffff'])
+            await asyncio.sleep(0)
+            self.assertEqual(len(self.transport.written), 2)
+        asyncio.run(run())
+
+    def test_shutdown(self):
+        async def run():
+            outbox = Outbox(self.transport, batch=True)
+            outbox.write(b'last words')
+            outbox.shutdown()
+            # Written before closing, rather than left for a flush that never comes.
+            self.assertEqual(self.transport.written, [b'last words'])
+            self.assertTrue(self.transport.closed)
+            self.assertFalse(self.transport.aborted)
+            self.assertFalse(outbox.write(b'more'))
+            await asyncio.sleep(0)
+            self.assertEqual(self.transport.written, [b'last words'])
+        asyncio.run(run())
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            Outbox(self.transport, policy='block')
+        # A misconfigured policy stops the server starting, rather than every connection failing.
+        with unittest.mock.patch.object(settings, 'OUTBOX_POLICY', 'block'):
+            with self.assertRaises(ValueError):
+                NeolithServer()
+
+    def test_sendable_flags(self):
+        user = Session(ident='abc', username='u', nickname='n')
+        chat = ChatPosted(channel='public', chat='hi', user=user)
+        self.assertTrue(chat.droppable)
+        self.assertTrue(Broadcast(chat).droppable)
+        self.assertFalse(Transaction(packets=[chat]).droppable)
+        modified = ChannelModified(channel=Channel(name='public'))
+        self.assertEqual(Broadcast(modified).coalesce_key(), ('channel.modified', 'public'))
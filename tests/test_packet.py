@@ -1,6 +1,10 @@
 import pytest
 
-from neolith.protocol import Binary, Container, Integer, List, Packet, ProtocolError, String, Transaction, packet
+from neolith.protocol import (
+    Binary, Broadcast, Container, Integer, List, Packet, Prepared, ProtocolError, Session, String, Transaction,
+    UserList, packet)
+
+import json
 
 
 class SomeType (Container):
@@ -15,7 +19,7 @@ class SomeResponse (Packet):
 
 
 @packet('some.request')
-class SomeRequest (Packet):
+class SomeRequest (Packet, slots=True):
     sequence = Integer(required=True)
     nickname = String()
     icon = Binary()
@@ -69,3 +73,104 @@ def test_lists():
     )
     for p4 in Transaction(p3.to_dict()).packets:
         assert ["foo", "bar"] == [t.name for t in p4.objects]
+
+
+def test_schema():
+    assert [f[0] for f in SomeRequest._schema] == ['sequence', 'nickname', 'icon', 'ints', 'version']
+    flags = [(f[2], f[3]) for f in SomeRequest._schema if f[0] in ('sequence', 'version')]
+    assert flags == [(True, False), (False, True)]
+
+
+def test_broadcast():
+    calls = []
+
+    def wire_format(data):
+        calls.append(data)
+        return json.dumps(data.to_dict()).encode('utf-8')
+
+    p = SomeRequest(sequence=3, nickname='shared')
+    b = Broadcast.wrap(p)
+    assert Broadcast.wrap(b) is b
+    assert b.encode(wire_format) == b.encode(wire_format) == wire_format(p)
+    assert len(calls) == 2
+    assert b.to_dict() is b.to_dict()
+    assert list(b) == [p]
+    assert b.ident == 'some.request'
+
+
+def test_lazy():
+    data = {
+        'sequence': 1,
+        'icon': 'MTIz',
+        'ints': [1, 2],
+        'version': 2,
+    }
+    p = Transaction({'some.request': data}, lazy=True).first('some.request')
+    assert not SomeRequest.icon.is_set(p)
+    # Untouched binary fields are sent on exactly as they were received.
+    assert Transaction(packets=[p]).to_dict() == Transaction({'some.request': data}).to_dict()
+    assert not SomeRequest.icon.is_set(p)
+    assert p.icon == b'123'
+    assert p.ints == [1, 2]
+    assert p.version == 1
+    p.icon = b'456'
+    assert p.to_dict()['some.request'][0]['icon'] == 'NDU2'
+
+    # Badly typed fields are only noticed when they're accessed, as a ProtocolError like any other bad request.
+    p = Transaction({'some.request': dict(data, sequence='1')}, lazy=True).first('some.request')
+    with pytest.raises(ProtocolError):
+        p.sequence
+    # Except those that could be sent on without being accessed, which are checked up front.
+    for icon in (123, 'MTI', 'MT!z'):
+        with pytest.raises(ProtocolError):
+            Transaction({'some.request': dict(data, icon=icon)}, lazy=True)
+
+
+def test_lazy_nested():
+    data = {'reply': 'hi', 'objects': [{'name': 'one', 'flags': 1}, {'name': 'two'}]}
+    p = SomeResponse.unpack(data, lazy=True)
+    assert [o.name for o in p.objects] == ['one', 'two']
+    assert p.objects[0]._raw is not None
+    assert p.objects[1].flags is None
+    assert p.prepare() == SomeResponse.unpack(data).prepare()
+
+
+def test_prepared_cache():
+    session = Session(ident='abc', username='user', nickname='nick', x25519=b'key')
+    prepared = session.prepare()
+    assert isinstance(prepared, Prepared)
+    assert session.prepare() is prepared
+    assert UserList(users=[session]).to_dict()['user.listing'][0]['users'][0] is prepared
+    assert session.prepare(binary=True)['x25519'] == b'key'
+    session.nickname = 'other'
+    assert session.prepare() is not prepared
+    assert session.prepare()['nickname'] == 'other'
+    # Attributes that aren't fields don't affect the prepared form.
+    prepared = session.prepare()
+    session.token = 'secret'
+    assert session.prepare() is prepared
+
+
+def test_slots():
+    p = SomeRequest(sequence=1)
+    assert not hasattr(p, '__dict__')
+    # Only packets declared with slots=True use them.
+    assert hasattr(SomeResponse(), '__dict__')
+    assert p.ints == []
+    assert p.version == 1
+    with pytest.raises(AttributeError):
+        p.version = 2
+    with pytest.raises(AttributeError):
+        p.sequence = 'one'
+    with pytest.raises(AttributeError):
+        p.anything = True
+    assert SomeRequest.unpack(p.prepare()).prepare() == p.prepare()
+
+    class Unslotted (SomeRequest, slots=False):
+        extra = String(default='extra')
+
+    u = Unslotted(sequence=2)
+    u.anything = True
+    assert u.__dict__ == {'anything': True}
+    assert u.prepare()['extra'] == 'extra'
+    assert u.__dict__ == {'anything': True, 'extra': 'extra'}
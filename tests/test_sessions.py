@@ -0,0 +1,85 @@
+from neolith.protocol import Channel, Sendable, Session
+from neolith.server import Sessions
+
+import unittest
+
+
+class DummySession (Session):
+
+    async def send(self, data: Sendable):
+        pass
+
+
+def make_session(ident, nickname=None, token=None):
+    session = DummySession(nickname=nickname)
+    session.ident = ident
+    session.token = token or 'token-' + ident
+    return session
+
+
+class SessionRegistryTests (unittest.TestCase):
+
+    def setUp(self):
+        self.sessions = Sessions()
+        self.alice = make_session('a', 'Alice')
+        self.bob = make_session('b', 'bob')
+        self.sessions.add(self.alice)
+        self.sessions.add(self.bob)
+
+    def test_lookups(self):
+        self.assertIs(self.sessions['a'], self.alice)
+        self.assertEqual(list(self.sessions.find(token='token-b')), [self.bob])
+        self.assertEqual(list(self.sessions.find(nickname='Alice')), [self.alice])
+        # The index is case-insensitive, but find still compares exactly.
+        self.assertEqual(list(self.sessions.find(nickname='alice')), [])
+        self.assertEqual(list(self.sessions.find(nickname='Alice', authenticated=True)), [])
+        self.assertEqual(len(self.sessions), 2)
+
+    def test_attribute_changes(self):
+        self.alice.authenticated = True
+        self.assertEqual(self.sessions.authenticated, {self.alice})
+        self.assertTrue(self.sessions.nickname_in_use('ALICE'))
+        self.assertFalse(self.sessions.nickname_in_use('alice', exclude=self.alice))
+        self.assertFalse(self.sessions.nickname_in_use('bob'))
+        self.alice.nickname = 'Carol'
+        self.assertFalse(self.sessions.nickname_in_use('alice'))
+        self.assertEqual(list(self.sessions.find(nickname='Carol', authenticated=True)), [self.alice])
+        self.alice.token = 'new'
+        self.assertEqual(list(self.sessions.find(token='token-a')), [])
+        self.assertEqual(list(self.sessions.find(token='new')), [self.alice])
+
+    def test_remove(self):
+        self.alice.authenticated = True
+        self.assertTrue(self.sessions.remove(self.alice))
+        self.assertFalse(self.sessions.remove(self.alice))
+        self.assertNotIn('a', self.sessions)
+        self.assertEqual(self.sessions.authenticated, set())
+        self.assertEqual(self.sessions.by_nickname, {'bob': {self.bob}})
+        self.assertEqual(list(self.sessions.find(token='token-a')), [])
+        # Changes after removal no longer touch the registry.
+        self.alice.nickname = 'bob'
+        self.assertEqual(self.sessions.by_nickname, {'bob': {self.bob}})
+
+
+class ChannelMembershipTests (unittest.TestCase):
+
+    def test_authenticated_members(self):
+        channel = Channel(name='public')
+        alice = make_session('a', 'alice')
+        bob = make_session('b', 'bob')
+        bob.authenticated = True
+        self.assertTrue(channel.add(alice))
+        self.assertTrue(channel.add(bob))
+        self.assertFalse(channel.add(bob))
+        self.assertEqual(channel.authenticated_sessions, {bob})
+        alice.authenticated = True
+        self.assertEqual(channel.authenticated_sessions, {alice, bob})
+        self.assertEqual(alice.channels, {channel})
+        bob.authenticated = False
+        self.assertEqual(channel.authenticated_sessions, {alice})
+        channel.remove(alice)
+        self.assertEqual(channel.authenticated_sessions, set())
+        self.assertEqual(alice.channels, set())
+        alice.authenticated = False
+        alice.authenticated = True
+        self.assertEqual(channel.authenticated_sessions, set())
@@ -0,0 +1,187 @@
+from helpers import DummyTransport
+import pytest
+
+from neolith.framing import COMPRESSED, FrameBuffer, header
+from neolith.protocol import (
+    Broadcast, Channel, EncryptedMessage, Message, Session, Transaction, UserList, use_codecs)
+from neolith.server import NeolithServer, SocketSession
+from neolith.wire import compressing_codec, compressors, encode_json, encode_json_compact, wire_codecs
+
+import asyncio
+import json
+import os
+
+
+def sample_transaction():
+    sender = Session(ident='abc', username='user', nickname='nick', x25519=os.urandom(32))
+    encrypted = EncryptedMessage(sender_key=os.urandom(32), nonce=os.urandom(12), data=os.urandom(100))
+    return Transaction(txid='1', packets=[Message(sender=sender, encrypted=encrypted)])
+
+
+def decode_frame(codec, frame):
+    size, = header.unpack_from(frame)
+    assert size == len(frame) - header.size
+    return Transaction(data=codec.loads(frame[header.size:]), binary=codec.binary)
+
+
+@pytest.mark.parametrize('name', ['json', 'msgpack', 'cbor'])
+@pytest.mark.parametrize('compiled', [False, True])
+def test_roundtrip(name, compiled):
+    codec = wire_codecs.get(name)
+    if codec is None:
+        pytest.skip('{} is not installed'.format(name))
+    use_codecs(compiled)
+    try:
+        tx = sample_transaction()
+        decoded = decode_frame(codec, codec(tx))
+    finally:
+        use_codecs(False)
+    original, message = tx.first('message'), decoded.first('message')
+    assert message.encrypted.data == original.encrypted.data
+    assert message.encrypted.nonce == original.encrypted.nonce
+    assert message.sender.x25519 == original.sender.x25519
+    assert decoded.to_dict() == tx.to_dict()
+
+
+def test_binary_is_smaller():
+    codec = wire_codecs.get('msgpack') or wire_codecs.get('cbor')
+    if codec is None:
+        pytest.skip('No binary codec is installed')
+    tx = sample_transaction()
+    assert len(codec(tx)) < len(wire_codecs['json'](tx))
+    assert isinstance(tx.to_dict(binary=True)['message'][0]['encrypted']['data'], bytes)
+
+
+def test_negotiate():
+    codec = wire_codecs.get('msgpack') or wire_codecs.get('cbor')
+    if codec is None:
+        pytest.skip('No binary codec is installed')
+    json_codec = wire_codecs['json']
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        server = NeolithServer()
+        session = SocketSession(server)
+        session.connection_made(DummyTransport())
+        loop.run_until_complete(asyncio.sleep(0))
+        session.data_received(json_codec(Transaction({'txid': '1', 'codec': {'codecs': ['bogus', codec.name]}})))
+        loop.run_until_complete(asyncio.sleep(0.01))
+        response = decode_frame(json_codec, session.transport.written[-1])
+        assert response.first('codec.response').codec == codec.name
+        assert session.codec is codec
+        session.data_received(codec(Transaction({'txid': '2', 'user.list': {}})))
+        loop.run_until_complete(asyncio.sleep(0.01))
+        response = codec.loads(session.transport.written[-1][header.size:])
+        assert response == {'txid': '2', 'error': 'This request requires authentication.'}
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def test_negotiate_unsupported():
+    loop = asyncio.new_event_loop()
+    try:
+        session = SocketSession(None)
+        tx = Transaction({'codec': {'codecs': ['bogus']}})
+        server = NeolithServer()
+        response = loop.run_until_complete(server.handle(session, tx, send=False))
+        assert response.error == 'None of the requested codecs are supported.'
+        assert session.codec is wire_codecs['json']
+    finally:
+        loop.close()
+
+
+def test_lazy_type_error():
+    loop = asyncio.new_event_loop()
+    try:
+        session = SocketSession(None)
+        session.authenticated = True
+        tx = Transaction({'txid': '1', 'channel.post': {'channel': 123, 'chat': 'hi'}}, lazy=True)
+        response = loop.run_until_complete(NeolithServer().handle(session, tx, send=False))
+        # Decoded lazily, the badly typed field still gets an error response rather than none at all.
+        assert response.txid == '1'
+        assert response.error == 'PostChat.channel must be of type str (got int)'
+    finally:
+        loop.close()
+
+
+def test_lazy_binary_error():
+    loop = asyncio.new_event_loop()
+    try:
+        server = NeolithServer()
+        session = SocketSession(None)
+        session.ident, session.nickname, session.authenticated = 'a', 'alice', True
+        server.channels.add(Channel(name='secret', encrypted=True))
+        server.channels['secret'].add(session)
+        encrypted = {'sender_key': 'a2V5', 'nonce': 'bm9uY2U=', 'data': 'not base64!'}
+        tx = Transaction({'txid': '1', 'channel.post': {'channel': 'secret', 'encrypted': {'a': encrypted}}}, lazy=True)
+        response = loop.run_until_complete(server.handle(session, tx, send=False))
+        # The ciphertext would only have been sent on, never decoded, but the sender is still told it's malformed.
+        assert response.txid == '1'
+        assert response.error == 'EncryptedMessage.data is not validly encoded'
+    finally:
+        loop.close()
+
+
+@pytest.mark.parametrize('name', ['zlib', 'zstd'])
+def test_compression(name):
+    compressor = compressors.get(name)
+    if compressor is None:
+        pytest.skip('{} is not installed'.format(name))
+    codec = compressing_codec(wire_codecs['json'], compressor, 512)
+    assert compressing_codec(wire_codecs['json'], compressor, 512) is codec
+    sessions = [Session(ident=str(n), username='user', nickname='nick{}'.format(n)) for n in range(50)]
+    listing = Broadcast(Transaction(txid='1', packets=[UserList(users=sessions)]))
+    frame = listing.encode(codec)
+    assert header.unpack_from(frame)[0] & COMPRESSED
+    assert len(frame) < len(listing.encode(wire_codecs['json'])) / 4
+    # Every session using the codec shares the compressed frame.
+    assert listing.encode(codec) is frame
+    buf = FrameBuffer()
+    buf.decompressor = compressor
+    buf.feed(frame)
+    assert codec.loads(buf.frames()[0]) == listing.to_dict()
+    # Small frames are sent as they are.
+    small = Transaction(txid='2', packets=[UserList(users=sessions[:1])])
+    assert codec(small) == wire_codecs['json'](small)
+
+
+def test_negotiate_compression():
+    json_codec = wire_codecs['json']
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        session = SocketSession(NeolithServer())
+        session.connection_made(DummyTransport())
+        loop.run_until_complete(asyncio.sleep(0))
+        request = {'txid': '1', 'codec': {'codecs': ['json'], 'compression': ['bogus', 'zlib']}}
+        session.data_received(json_codec(Transaction(request)))
+        loop.run_until_complete(asyncio.sleep(0.01))
+        response = decode_frame(json_codec, session.transport.written[-1])
+        assert response.first('codec.response').compression == 'zlib'
+        assert session.codec.compressor is compressors['zlib']
+        # Compressed frames are accepted from the client too.
+        payload = compressors['zlib'].compress(json.dumps({'txid': '2', 'user.list': {}}).encode())
+        session.data_received(header.pack(len(payload) | COMPRESSED) + payload)
+        loop.run_until_complete(asyncio.sleep(0.01))
+        response = json_codec.loads(session.transport.written[-1][header.size:])
+        assert response == {'txid': '2', 'error': 'This request requires authentication.'}
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+def test_json_fragments(compiled):
+    sessions = [Session(ident=str(n), username='user', nickname='nick{}'.format(n), x25519=b'key') for n in range(5)]
+    tx = Transaction(txid='1', packets=[UserList(users=sessions), UserList(users=[])])
+    use_codecs(compiled)
+    try:
+        for encoder, separators in ((encode_json, None), (encode_json_compact, (',', ':'))):
+            expected = json.dumps(tx.to_dict(), separators=separators)
+            assert encoder(tx.to_dict()) == expected
+            assert sessions[0].prepare().encodings[encoder] == json.dumps(sessions[0].prepare(), separators=separators)
+            sessions[0].nickname = 'changed'
+            assert encoder(tx.to_dict()) == json.dumps(tx.to_dict(), separators=separators)
+    finally:
+        use_codecs(False)
@@ -0,0 +1,69 @@
+from neolith.protocol import Sendable, Session
+from neolith.wirelog import configure_wire_log, log_wire, stop_wire_log
+
+import io
+import json
+import threading
+import unittest
+import unittest.mock
+
+
+class CountingSendable (Sendable):
+
+    def __init__(self):
+        self.calls = 0
+
+    def to_dict(self):
+        self.calls += 1
+        return {'txid': 'abc'}
+
+
+class WireLogTests (unittest.TestCase):
+
+    def setUp(self):
+        self.session = Session(ident='123', username='user', nickname='nick', hostname='localhost')
+        self.stream = io.StringIO()
+
+    def tearDown(self):
+        stop_wire_log()
+
+    def test_disabled(self):
+        configure_wire_log(False)
+        data = CountingSendable()
+        log_wire(self.session, '<--', data)
+        self.assertEqual(data.calls, 0)
+
+    def test_enabled(self):
+        configure_wire_log(True, stream=self.stream)
+        data = CountingSendable()
+        log_wire(self.session, '-->', data)
+        stop_wire_log()
+        self.assertEqual(data.calls, 1)
+        self.assertEqual(self.stream.getvalue(), 'nick!user@localhost --> {"txid": "abc"}\n')
+
+    def test_queue(self):
+        threads = []
+        dumps = json.dumps
+
+        def recording_dumps(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return dumps(*args, **kwargs)
+
+        configure_wire_log(True, stream=self.stream)
+        with unittest.mock.patch('json.dumps', recording_dumps):
+            log_wire(self.session, '<--', CountingSendable())
+            stop_wire_log()
+        # The message is only serialized (and formatted) by the listener thread.
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+        self.assertEqual(self.stream.getvalue(), 'nick!user@localhost <-- {"txid": "abc"}\n')
+
+    def test_sampling(self):
+        for use_queue in (False, True):
+            configure_wire_log(True, sample=0.0, use_queue=use_queue, stream=self.stream)
+            data = CountingSendable()
+            for i in range(100):
+                log_wire(self.session, '<--', data)
+            stop_wire_log()
+            self.assertEqual(data.calls, 0)
+            self.assertEqual(self.stream.getvalue(), '')